@@ -0,0 +1,454 @@
+"""
+asyncio 服务方式 (Config.SERVER_MODE = 'asyncio'): 单个事件循环处理所有连接 (HTTP/1.1 keep-alive)。
+
+    /api/stream                 SSE 长连接直接在事件循环中推送，每个连接只是一个协程与一个事件队列
+    只读取内存快照的接口        (LOOP_ENDPOINTS) 在事件循环中直接执行 Flask 应用
+    其余接口                    (控制、入住/退房、账单与导出、报表等会访问数据库或等待命令循环的接口)
+                                在 workers 个线程的有界线程池中执行，超出的请求在事件循环中排队等待
+
+所有接口仍由 app.py 中的 Flask 路由实现，两种服务方式的行为相同。
+请求体只接受 Content-Length (不超过 max_body 字节)；带 Transfer-Encoding 的请求返回 501，
+请求格式错误返回 400，请求体过大返回 413，这些错误响应以及所有 4xx/5xx 响应之后都关闭连接，
+未读取的请求体不会被当作下一个请求解析。
+模拟 tick 由事件循环中的 tick 任务按 commands.interval 提交给命令循环 (CommandLoop.submit_tick)，
+房间与调度队列仍只在命令循环线程中修改。
+"""
+import asyncio
+import sys
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from werkzeug.exceptions import HTTPException
+
+# 只读取 current_snapshot / 内存缓存、不会阻塞的接口 (Flask endpoint 名)
+LOOP_ENDPOINTS = {
+    'get_rooms', 'get_rooms_status', 'get_room_status',
+    'get_persistence_status', 'get_shards_status', 'get_metrics',
+}
+STREAM_ENDPOINT = 'stream_room_states'
+KEEPALIVE_SECONDS = 15
+# 流式响应每次从线程池取出的数据量
+STREAM_CHUNK_BYTES = 64 * 1024
+MAX_HEADER_BYTES = 64 * 1024
+
+
+class RequestError(Exception):
+    """无法安全解析的请求: 回复 status 后关闭连接"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class StreamClient:
+    """一个 SSE 连接: after_version 之前的事件已包含在发送给它的快照中"""
+
+    def __init__(self, scope, after_version, max_pending):
+        self.scope = scope
+        self.after_version = after_version
+        self.events = asyncio.Queue(maxsize=max_pending)
+        self.overflowed = False
+        self.closed = False
+
+    async def watch(self, reader):
+        """客户端断开时立即结束推送 (否则要等到下一次写入才能发现)"""
+        try:
+            while await reader.read(4096):
+                pass
+        except ConnectionError:
+            pass
+        self.closed = True
+        try:
+            self.events.put_nowait(None)
+        except asyncio.QueueFull:
+            pass
+
+
+class StreamHub:
+    """
+    Broadcaster 的一个订阅者，把命令循环线程发布的事件转交给事件循环，再分发给所有 SSE 连接。
+    只在有连接时订阅，没有连接时 publish_changes 不会生成增量事件。
+    """
+
+    def __init__(self, broadcaster, loop):
+        self.broadcaster = broadcaster
+        self.loop = loop
+        self.clients = set()
+
+    def deliver(self, event):
+        # 发布线程
+        try:
+            self.loop.call_soon_threadsafe(self._dispatch, event)
+        except RuntimeError:
+            # 事件循环已关闭
+            pass
+
+    def _dispatch(self, event):
+        for client in self.clients:
+            if event.version <= client.after_version:
+                continue
+            try:
+                client.events.put_nowait(event)
+            except asyncio.QueueFull:
+                client.overflowed = True
+
+    def add(self, client):
+        if not self.clients:
+            self.broadcaster.add(self)
+        self.clients.add(client)
+
+    def remove(self, client):
+        self.clients.discard(client)
+        if not self.clients:
+            self.broadcaster.unsubscribe(self)
+
+
+class Request:
+    def __init__(self, method, target, version, headers, body):
+        self.method = method
+        self.version = version
+        self.headers = headers  # [(name, value), ...]
+        self.body = body
+        path, _, self.query = target.partition('?')
+        # PEP 3333: PATH_INFO 为按 latin-1 解码的原始字节
+        self.path = urllib.parse.unquote_to_bytes(path).decode('latin-1')
+
+    def header(self, name):
+        name = name.lower()
+        for key, value in self.headers:
+            if key.lower() == name:
+                return value
+        return None
+
+    @property
+    def keep_alive(self):
+        connection = (self.header('Connection') or '').lower()
+        if self.version == 'HTTP/1.0':
+            return connection == 'keep-alive'
+        return connection != 'close'
+
+
+class AsyncServer:
+    def __init__(self, server, workers=8, max_body=1024 * 1024):
+        # server: app 模块 (Flask 应用、命令循环、快照与 Broadcaster)
+        self.server = server
+        self.app = server.app
+        self.workers = workers
+        self.max_body = max_body
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='aio-worker')
+        self.hub = None
+        self._slots = None
+        self.connections = 0
+        self.requests = 0
+
+    # --- Serving ---
+    async def serve_forever(self, host='127.0.0.1', port=5000, ready=None):
+        loop = asyncio.get_running_loop()
+        self.hub = StreamHub(self.server.broadcaster, loop)
+        self._slots = asyncio.Semaphore(self.workers)
+        tick_task = asyncio.create_task(self._tick_loop())
+        srv = await asyncio.start_server(self._handle, host, port, backlog=4096, limit=MAX_HEADER_BYTES)
+        self.port = srv.sockets[0].getsockname()[1]
+        print(f"[AsyncServer] Serving on http://{host}:{self.port} ({self.workers} workers)")
+        if ready is not None:
+            ready()
+        try:
+            async with srv:
+                await srv.serve_forever()
+        finally:
+            tick_task.cancel()
+            self.executor.shutdown(wait=False)
+
+    async def _tick_loop(self):
+        """模拟 tick: 按计划时刻提交给命令循环，tick 耗时超过间隔时不追赶 (与 CommandLoop 自行计时相同)"""
+        commands = self.server.commands
+        commands.take_over_ticks()
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time() + commands.interval
+        while True:
+            await asyncio.sleep(next_tick - loop.time())
+            await asyncio.wrap_future(commands.submit_tick(loop.time() - next_tick))
+            next_tick += commands.interval
+            if next_tick < loop.time():
+                next_tick = loop.time() + commands.interval
+
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        try:
+            while True:
+                try:
+                    request = await self._read_request(reader)
+                except RequestError as e:
+                    await self._reject(writer, e)
+                    break
+                if request is None:
+                    break
+                self.requests += 1
+                if not await self._respond(request, reader, writer):
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.connections -= 1
+            writer.close()
+
+    async def _read_request(self, reader):
+        try:
+            head = await reader.readuntil(b'\r\n\r\n')
+        except asyncio.IncompleteReadError:
+            # 客户端关闭了 keep-alive 连接
+            return None
+        except asyncio.LimitOverrunError:
+            raise RequestError('431 Request Header Fields Too Large', "Request headers too large")
+        lines = head.decode('latin-1').split('\r\n')
+        parts = lines[0].split(' ')
+        if len(parts) != 3 or parts[2] not in ('HTTP/1.0', 'HTTP/1.1'):
+            raise RequestError('400 Bad Request', "Malformed request line")
+        method, target, version = parts
+        headers = []
+        for line in lines[1:]:
+            if line:
+                name, sep, value = line.partition(':')
+                if not sep or not name or name != name.strip():
+                    raise RequestError('400 Bad Request', "Malformed header")
+                headers.append((name, value.strip()))
+        request = Request(method, target, version, headers, b'')
+        if request.header('Transfer-Encoding') is not None:
+            # 不支持 chunked 请求体: 无法确定请求体的边界，不能继续使用该连接
+            raise RequestError('501 Not Implemented', "Transfer-Encoding is not supported")
+        lengths = {value for name, value in headers if name.lower() == 'content-length'}
+        if len(lengths) > 1:
+            raise RequestError('400 Bad Request', "Conflicting Content-Length")
+        length = lengths.pop() if lengths else '0'
+        if not length.isdigit():
+            raise RequestError('400 Bad Request', "Invalid Content-Length")
+        length = int(length)
+        if length > self.max_body:
+            raise RequestError('413 Payload Too Large', f"Request body exceeds {self.max_body} bytes")
+        if length:
+            request.body = await reader.readexactly(length)
+        return request
+
+    async def _reject(self, writer, error):
+        body = error.message.encode('utf-8')
+        writer.write((
+            f"HTTP/1.1 {error.status}\r\n"
+            "Content-Type: text/plain; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n\r\n"
+        ).encode('latin-1') + body)
+        await writer.drain()
+
+    def _environ(self, request, writer):
+        peer = writer.get_extra_info('peername') or ('', 0)
+        sock = writer.get_extra_info('sockname') or ('', 0)
+        environ = {
+            'REQUEST_METHOD': request.method,
+            'SCRIPT_NAME': '',
+            'PATH_INFO': request.path,
+            'QUERY_STRING': request.query,
+            'SERVER_NAME': str(sock[0]),
+            'SERVER_PORT': str(sock[1]),
+            'SERVER_PROTOCOL': request.version,
+            'REMOTE_ADDR': str(peer[0]),
+            'REMOTE_PORT': str(peer[1]),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': 'http',
+            'wsgi.input': BytesIO(request.body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        for name, value in request.headers:
+            key = name.upper().replace('-', '_')
+            if key not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                key = 'HTTP_' + key
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+        return environ
+
+    def _endpoint(self, request):
+        try:
+            endpoint, _ = self.app.url_map.bind('localhost').match(request.path, request.method)
+            return endpoint
+        except HTTPException:
+            # 404 / 405 由 Flask 生成响应
+            return None
+
+    async def _respond(self, request, reader, writer):
+        """处理一个请求，返回连接是否可以继续使用"""
+        endpoint = self._endpoint(request)
+        if endpoint == STREAM_ENDPOINT and request.method == 'GET':
+            handled = await self._stream(request, reader, writer)
+            if handled:
+                return False
+        environ = self._environ(request, writer)
+        if endpoint is None or endpoint in LOOP_ENDPOINTS:
+            status, headers, body = self._call_app(environ)
+            data, done = self._read_body(body, None)
+            return await self._send(request, writer, status, headers, data, body if not done else None)
+        async with self._slots:
+            loop = asyncio.get_running_loop()
+            status, headers, body = await loop.run_in_executor(self.executor, self._call_app, environ)
+            data, done = await loop.run_in_executor(self.executor, self._read_body, body, STREAM_CHUNK_BYTES)
+            return await self._send(request, writer, status, headers, data, body if not done else None)
+
+    def _call_app(self, environ):
+        response = []
+
+        def start_response(status, headers, exc_info=None):
+            response[:] = [status, headers]
+
+        body = self.app(environ, start_response)
+        return response[0], response[1], body
+
+    def _read_body(self, body, limit):
+        """读取响应体，limit 为 None 时读完；返回 (数据, 是否读完)。读完时关闭 body"""
+        parts = []
+        size = 0
+        for part in body:
+            parts.append(part)
+            size += len(part)
+            if limit is not None and size >= limit:
+                return b''.join(parts), False
+        if hasattr(body, 'close'):
+            body.close()
+        return b''.join(parts), True
+
+    async def _send(self, request, writer, status, headers, data, rest):
+        """写出响应；rest 为尚未读完的流式响应体 (在线程池中逐块读取，使用 chunked 编码)"""
+        # 错误响应之后关闭连接
+        keep_alive = request.keep_alive and int(status.split(' ', 1)[0]) < 400
+        has_length = any(name.lower() == 'content-length' for name, _ in headers)
+        chunked = rest is not None and not has_length and request.version == 'HTTP/1.1'
+        if rest is None and not has_length:
+            headers = headers + [('Content-Length', str(len(data)))]
+        elif not has_length and not chunked:
+            keep_alive = False
+        lines = [f"{request.version} {status}"]
+        lines += [f"{name}: {value}" for name, value in headers]
+        if chunked:
+            lines.append("Transfer-Encoding: chunked")
+        lines.append(f"Connection: {'keep-alive' if keep_alive else 'close'}")
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode('latin-1'))
+        if request.method == 'HEAD':
+            if rest is not None:
+                await asyncio.get_running_loop().run_in_executor(self.executor, self._close, rest)
+            await writer.drain()
+            return keep_alive
+        if rest is None:
+            writer.write(data)
+            await writer.drain()
+            return keep_alive
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                if data:
+                    writer.write(b"%x\r\n%s\r\n" % (len(data), data) if chunked else data)
+                    await writer.drain()
+                if rest is None:
+                    break
+                data, done = await loop.run_in_executor(self.executor, self._read_body, rest, STREAM_CHUNK_BYTES)
+                if done:
+                    rest = None
+        finally:
+            if rest is not None:
+                await loop.run_in_executor(self.executor, self._close, rest)
+        if chunked:
+            writer.write(b"0\r\n\r\n")
+            await writer.drain()
+        return keep_alive
+
+    @staticmethod
+    def _close(body):
+        if hasattr(body, 'close'):
+            body.close()
+
+    # --- Server-Sent Events ---
+    async def _stream(self, request, reader, writer):
+        """在事件循环中推送 /api/stream；参数无效 (房间不存在) 时返回 False，交给 Flask 生成错误响应"""
+        server = self.server
+        args = urllib.parse.parse_qs(request.query)
+        room_id = args.get('room', [None])[0]
+        try:
+            floor = int(args['floor'][0]) if 'floor' in args else None
+        except ValueError:
+            floor = None
+        scope = server.stream_scope(room_id, floor)
+        if scope is None:
+            return False
+        # 不在事件循环中等待 state_lock: 先订阅再读取快照 (publish_state 先替换快照再发布事件)，
+        # 版本不晚于该快照的事件由 after_version 过滤，因此不会漏掉或重复事件。
+        # 生成全量快照事件的开销与房间数成正比，放到线程池中执行
+        loop = asyncio.get_running_loop()
+        client = StreamClient(scope, 0, server.broadcaster.max_pending)
+        self.hub.add(client)
+        snapshot = server.current_snapshot
+        client.after_version = snapshot.version
+        try:
+            first = await loop.run_in_executor(self.executor, server.build_snapshot_event, snapshot, scope)
+        except BaseException:
+            self.hub.remove(client)
+            raise
+        watcher = asyncio.ensure_future(client.watch(reader))
+        try:
+            writer.write((
+                f"{request.version} 200 OK\r\n"
+                "Content-Type: text/event-stream; charset=utf-8\r\n"
+                "Cache-Control: no-cache\r\n"
+                "X-Accel-Buffering: no\r\n"
+                "Access-Control-Allow-Origin: *\r\n"
+                "Connection: close\r\n\r\n"
+            ).encode('latin-1'))
+            writer.write(first.render(scope).encode('utf-8'))
+            await writer.drain()
+            while not client.closed:
+                if client.overflowed:
+                    # 消费过慢: 丢弃积压事件并重新发送全量快照
+                    while not client.events.empty():
+                        client.events.get_nowait()
+                    client.overflowed = False
+                    snapshot = server.current_snapshot
+                    client.after_version = snapshot.version
+                    resync = await loop.run_in_executor(self.executor, server.build_snapshot_event, snapshot, scope)
+                    writer.write(resync.render(scope).encode('utf-8'))
+                    await writer.drain()
+                try:
+                    event = await asyncio.wait_for(client.events.get(), KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    writer.write(b": keepalive\n\n")
+                    await writer.drain()
+                    continue
+                if event is None:
+                    break
+                if event.version <= client.after_version:
+                    # 重新同步之前已进入队列的事件
+                    continue
+                payload = event.render(scope)
+                if payload:
+                    writer.write(payload.encode('utf-8'))
+                    await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            watcher.cancel()
+            self.hub.remove(client)
+        return True
+
+    def stats(self):
+        return {
+            "connections": self.connections,
+            "streams": len(self.hub.clients) if self.hub is not None else 0,
+            "requests": self.requests,
+            "workers": self.workers,
+        }
+
+
+def serve(server, host='127.0.0.1', port=5000, workers=8, max_body=1024 * 1024):
+    """以 asyncio 服务方式运行 (阻塞直到中断)"""
+    try:
+        asyncio.run(AsyncServer(server, workers, max_body).serve_forever(host, port))
+    except KeyboardInterrupt:
+        pass
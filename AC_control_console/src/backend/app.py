@@ -1,429 +1,319 @@
-from flask import Flask, jsonify, request, Response
+from flask import Flask, jsonify, request, Response, g, send_file
 from flask_cors import CORS
 import time
 import random
 import datetime
 import json
-from threading import Thread
+import queue
+import sys
+import gc
+import atexit
+from threading import Lock, RLock
 import database  # Import database module
+import hotel
+from hotel import Config, Room, Scheduler
+from broadcaster import Broadcaster, DeltaEvent, HOTEL_SCOPE, scope_matches
+from persister import StatePersister
+from snapshot import build_snapshot
+from command_loop import CommandLoop
+import bill_export
+from bill_cache import BillCache
+from history import HistoryStore, RESOLUTIONS, plan_capacities
+import metrics
+import room_service
+import topology
+from profiling import Profiler, ProfilerBusy, memory_report
+from bill_export import EXPORT_FORMATS
 
 app = Flask(__name__)
-CORS(app)
+# 跨域请求默认读不到自定义响应头: 分页总数与快照版本需显式暴露给前端
+CORS(app, expose_headers=["X-Total-Count", "ETag"])
+# 请求体上限 (超过返回 413)，asyncio 服务方式使用同一上限
+app.config['MAX_CONTENT_LENGTH'] = Config.MAX_REQUEST_BYTES
+
+# --- Startup timings ---
+startup_timings = {}  # 阶段名 -> 毫秒
+_phase_start = time.perf_counter()
+
+def startup_phase(name):
+    """记录上一阶段结束到现在的耗时"""
+    global _phase_start
+    now = time.perf_counter()
+    startup_timings[name] = (now - _phase_start) * 1000
+    _phase_start = now
+
+# 启动时一次性创建大量长期存在的对象 (房间与快照)，期间暂停循环垃圾回收，
+# 完成后用 gc.freeze() 把它们移出分代回收，之后的回收不再反复扫描这些对象
+gc.disable()
 
 # Initialize Database
 database.init_db()
-
-# --- Configuration ---
-class Config:
-    # 计费费率 (元/秒)
-    FEE_RATES = {
-        "High": 1.0 / 60.0,
-        "Mid":  1.0 / 120.0,
-        "Low":  1.0 / 180.0
-    }
-    # 温度变化速率 (°C/秒)
-    TEMP_RATES = {
-        "High": 1.0 / 60.0,
-        "Mid":  1.0 / 120.0,
-        "Low":  1.0 / 180.0
-    }
-    # 回温速率: 0.5度/分钟
-    RETURN_RATE = 1.0 / 120.0
-    
-    MAX_SERVICE_SLOTS = 3
-    WAIT_DURATION_ALLOC = 120
-
-# --- Room ---
-class Room:
-    def __init__(self, room_id, floor, initial_temp=28.0):
-        self.room_id = room_id
-        self.floor = floor
-        
-        # Room Info
-        room_num = int(room_id[-2:])
-        
-        if floor == 1:
-            self.room_type = '豪华大床' if room_num > 8 else '标准间'
-            self.room_price = 350.0 if room_num > 8 else 220.0
-            self.deposit = 100.0
-        else:
-            self.room_type = '标准间'
-            self.room_price = 220.0
-            self.deposit = 100.0
-            
-        self.is_free = True
-        
-        # State
-        self.power_on = False
-        self.is_active = False  # Serving state
-        self.fan_speed = "Mid"
-        self.initial_temp = initial_temp
-        self.current_temp = initial_temp
-        self.target_temp = 25.0
-        self.total_fee = 0.0
-        self.duration = 0  # seconds
-        
-        # Tenant Info
-        self.tenant_id = None
-        self.tenant_name = None
-        self.tenant_phone = None
-        self.stay_days = 0
-        self.food_orders = []
-        self.food_fee = 0.0
-        
-        # Session Info
-        self.current_session_start_time = None
-        self.current_session_fee_start = 0.0
-        
-        # Stats
-        self.dispatch_count = 0
-        self.speed_stats = {
-            "High": {"duration": 0, "fee": 0.0},
-            "Mid": {"duration": 0, "fee": 0.0},
-            "Low": {"duration": 0, "fee": 0.0}
-        }
-
-    def to_dict(self):
-        return {
-            "room_id": self.room_id,
-            "type": self.room_type,
-            "price": self.room_price,
-            "deposit": self.deposit,
-            "isFree": self.is_free,
-            "power_on": self.power_on,
-            "is_active": self.is_active,
-            "fan_speed": self.fan_speed,
-            "initial_temp": self.initial_temp,
-            "current_temp": self.current_temp,
-            "target_temp": self.target_temp,
-            "total_fee": self.total_fee,
-            "duration": self.duration,
-            "tenant_id": self.tenant_id,
-            "tenant_name": self.tenant_name,
-            "tenant_phone": self.tenant_phone,
-            "stay_days": self.stay_days,
-            "food_orders": self.food_orders,
-            "food_fee": self.food_fee
-        }
-
-    def update_temp_and_fee(self):
-        """Update temperature and fee based on current state"""
-        if not self.power_on:
-            self._handle_return_temp()
-            return
-
-        if self.is_active:
-            # Active: Cooling/Heating and Charging
-            current_rate = Config.FEE_RATES.get(self.fan_speed, 0)
-            temp_change = Config.TEMP_RATES.get(self.fan_speed, 0)
-            
-            self.total_fee += current_rate
-            self.duration += 1
-            
-            # Update stats
-            if self.fan_speed in self.speed_stats:
-                self.speed_stats[self.fan_speed]['duration'] += 1
-                self.speed_stats[self.fan_speed]['fee'] += current_rate
-            
-            diff = self.current_temp - self.target_temp
-            if diff > 0:
-                self.current_temp -= temp_change
-            else:
-                self.current_temp += temp_change
-        else:
-            # Inactive (Waiting or Idle): Return temp
-            self._handle_return_temp()
-
-    def _handle_return_temp(self):
-        diff_init = self.current_temp - self.initial_temp
-        if abs(diff_init) > 0.01:
-            if diff_init > 0:
-                self.current_temp -= Config.RETURN_RATE
-            else:
-                self.current_temp += Config.RETURN_RATE
-
-# --- Scheduler ---
-class Scheduler:
-    def __init__(self):
-        self.service_queue = []  # List of dicts
-        self.waiting_queue = []  # List of dicts
-
-    def get_speed_val(self, speed_str):
-        return {'High': 3, 'Mid': 2, 'Low': 1}.get(speed_str, 0)
-
-    def request_service(self, room_id, fan_speed):
-        """Handle service request"""
-        # 1. Update existing request
-        in_queue = False
-        for item in self.service_queue:
-            if item['room_id'] == room_id:
-                item['fan_speed'] = fan_speed
-                in_queue = True
-                break
-
-        if not in_queue:
-            for item in self.waiting_queue:
-                if item['room_id'] == room_id:
-                    item['fan_speed'] = fan_speed
-                    in_queue = True
-                    break
-
-        # 2. Add to queue if new
-        if not in_queue:
-            if len(self.service_queue) < Config.MAX_SERVICE_SLOTS:
-                self.add_to_service(room_id, fan_speed)
-            else:
-                self.add_to_waiting(room_id, fan_speed)
-
-        # 3. Rebalance
-        self.rebalance()
-
-    def rebalance(self):
-        """Core scheduling logic"""
-        # 1. Fill empty slots
-        while len(self.service_queue) < Config.MAX_SERVICE_SLOTS and self.waiting_queue:
-            best_waiter = self._get_highest_priority_waiter()
-            if best_waiter:
-                self.waiting_queue.remove(best_waiter)
-                self.add_to_service(best_waiter['room_id'], best_waiter['fan_speed'])
-
-        # 2. Preempt if full
-        while len(self.service_queue) >= Config.MAX_SERVICE_SLOTS and self.waiting_queue:
-            min_service_item = self._get_lowest_priority_service()
-            max_wait_item = self._get_highest_priority_waiter()
-            
-            min_service_val = self.get_speed_val(min_service_item['fan_speed'])
-            max_wait_val = self.get_speed_val(max_wait_item['fan_speed'])
-            
-            if max_wait_val > min_service_val:
-                # Preempt
-                self.waiting_queue.remove(max_wait_item)
-                self.preempt_service(min_service_item, max_wait_item['room_id'], max_wait_item['fan_speed'])
-            else:
-                break
-
-    def _get_highest_priority_waiter(self):
-        if not self.waiting_queue:
-            return None
-        # Priority: High > Mid > Low, then FIFO
-        # Since list is FIFO, we just need to find max priority
-        best = None
-        max_prio = -1
-        for w in self.waiting_queue:
-            p = self.get_speed_val(w['fan_speed'])
-            if p > max_prio:
-                max_prio = p
-                best = w
-        return best
-
-    def _get_lowest_priority_service(self):
-        if not self.service_queue:
-            return None
-        # Priority: Lowest speed, then Longest service time (smallest start_time)
-        min_val = 100
-        candidates = []
-        for item in self.service_queue:
-            val = self.get_speed_val(item['fan_speed'])
-            if val < min_val:
-                min_val = val
-                candidates = [item]
-            elif val == min_val:
-                candidates.append(item)
-        
-        # Return the one with smallest start_time (longest duration)
-        return min(candidates, key=lambda x: x['start_time'])
-
-    def release_service(self, room_id):
-        self.service_queue = [i for i in self.service_queue if i['room_id'] != room_id]
-        self.waiting_queue = [i for i in self.waiting_queue if i['room_id'] != room_id]
-        self.rebalance()
-
-    def check_time_slices(self):
-        for item in self.waiting_queue:
-            item['wait_duration'] -= 1
-        
-        expired_items = [i for i in self.waiting_queue if i['wait_duration'] <= 0]
-        
-        for waiter in expired_items:
-            if self.service_queue:
-                victim = min(self.service_queue, key=lambda x: x['start_time'])
-                
-                if self.get_speed_val(victim['fan_speed']) <= self.get_speed_val(waiter['fan_speed']):
-                    self.waiting_queue.remove(waiter)
-                    self.preempt_service(victim, waiter['room_id'], waiter['fan_speed'])
-                else:
-                    waiter['wait_duration'] = Config.WAIT_DURATION_ALLOC
-
-    def add_to_service(self, room_id, fan_speed):
-        self.service_queue.append({
-            'room_id': room_id,
-            'fan_speed': fan_speed,
-            'start_time': time.time()
-        })
-        if room_id in rooms:
-            rooms[room_id].is_active = True
-        print(f"[Scheduler] Room {room_id} START service.")
-
-    def add_to_waiting(self, room_id, fan_speed):
-        for item in self.waiting_queue:
-            if item['room_id'] == room_id:
-                return
-        self.waiting_queue.append({
-            'room_id': room_id,
-            'fan_speed': fan_speed,
-            'wait_duration': Config.WAIT_DURATION_ALLOC
-        })
-        if room_id in rooms:
-            rooms[room_id].is_active = False
-            rooms[room_id].dispatch_count += 1
-        print(f"[Scheduler] Room {room_id} ENTER waiting queue.")
-
-    def preempt_service(self, victim, new_room_id, new_fan_speed):
-        print(f"[Scheduler] Preempting Room {victim['room_id']} for Room {new_room_id}")
-        self.service_queue.remove(victim)
-        self.add_to_waiting(victim['room_id'], victim['fan_speed'])
-        self.add_to_service(new_room_id, new_fan_speed)
+startup_phase('init_db')
 
 # --- Initialization ---
-rooms = {}
-# Load active check-ins from DB
-active_check_ins = database.get_active_check_ins()
-# Load room states from DB
-saved_room_states = database.get_all_room_states()
-
-for floor in range(1, 5):
-    for r in range(1, 11):
-        room_id = f"{floor}{r:02d}"
-        rooms[room_id] = Room(room_id, floor)
-        
-        # Restore state from DB if exists
-        if room_id in active_check_ins:
-            info = active_check_ins[room_id]
-            rooms[room_id].is_free = False
-            rooms[room_id].tenant_id = info['tenant_id']
-            rooms[room_id].tenant_name = info['tenant_name']
-            rooms[room_id].tenant_phone = info['tenant_phone']
-            rooms[room_id].stay_days = info['stay_days']
-            rooms[room_id].deposit = info.get('deposit', 0.0)
-            try:
-                rooms[room_id].food_orders = json.loads(info.get('food_orders', '[]'))
-                # Calculate food fee
-                total_food = 0
-                for item in rooms[room_id].food_orders:
-                    total_food += item.get('price', 0) * item.get('count', 0)
-                rooms[room_id].food_fee = total_food
-            except:
-                rooms[room_id].food_orders = []
-                rooms[room_id].food_fee = 0.0
-        else:
-            rooms[room_id].is_free = True
-
-# Test Cases
-def set_test_case(room_id, temp, price=None):
-    if room_id in rooms:
-        rooms[room_id].initial_temp = temp
-        # Only set current_temp if not restored from DB (we'll handle this by re-applying DB state after)
-        rooms[room_id].current_temp = temp
-        rooms[room_id].room_price = price
-
-# Cooling cases
-set_test_case("101", 32.0, 100.0)
-set_test_case("102", 28.0, 125.0)
-set_test_case("103", 30.0, 150.0)
-set_test_case("104", 29.0, 200.0)
-set_test_case("105", 35.0, 100.0)
-# Heating cases
-set_test_case("106", 10.0, 100.0)
-set_test_case("107", 15.0, 125.0)
-set_test_case("108", 18.0, 150.0)
-set_test_case("109", 12.0, 200.0)
-set_test_case("110", 14.0, 100.0)
-
-# Apply saved room states (Overwriting test cases if data exists)
-for room_id, state in saved_room_states.items():
-    if room_id in rooms:
-        rooms[room_id].power_on = state['power_on']
-        rooms[room_id].fan_speed = state['fan_speed']
-        rooms[room_id].target_temp = state['target_temp']
-        rooms[room_id].current_temp = state['current_temp']
-        rooms[room_id].total_fee = state['total_fee']
-        rooms[room_id].duration = state['duration']
-        
-        # If power was on, we might need to request service
-        if rooms[room_id].power_on:
-             # We don't auto-request here to avoid storming, 
-             # but the background task auto-reactivate logic might pick it up 
-             # if we set is_active to False initially.
-             pass
-
-scheduler = Scheduler()
+# 发布只读快照时持有 (SSE 订阅据此对齐快照与增量事件)；分片模式下同时保护房间镜像
+state_lock = RLock()
+
+if Config.SHARD_COUNT > 1:
+    # 分片模式: 房间由各分片进程模拟，本进程只保存房间镜像并转发请求
+    from sharding import ShardRouter
+    engine = None
+    rooms = {}
+    router = ShardRouter(rooms, room_service.room_keys(), Config.SHARD_COUNT, Config.SHARD_KEY, state_lock)
+else:
+    router = None
+    if Config.SIMULATION_ENGINE == 'vector':
+        from vector_engine import VectorEngine
+        engine = VectorEngine()
+        rooms = engine.rooms
+        make_room = engine.add_room
+    else:
+        engine = None
+        rooms = {}
+        make_room = Room
+    room_service.load_rooms(rooms, make_room, room_service.room_keys())
+startup_phase('load_rooms')
+
+# 分片模式下由 router 提供 is_waiting / waiting_ids 查询
+scheduler = Scheduler(rooms) if router is None else router
 is_simulation_mode = False
 
+# --- History (GET /api/room/<id>/history) ---
+# 每次模拟步进之后记录所有房间的温度与累计费用，分片模式下每秒从房间镜像记录
+history = None
+if Config.HISTORY_ENABLED:
+    history_capacities = plan_capacities(len(rooms), Config.HISTORY_RAW_SECONDS, Config.HISTORY_MINUTE_POINTS,
+                                         Config.HISTORY_QUARTER_POINTS, Config.HISTORY_MAX_BYTES)
+    if history_capacities is None:
+        print(f"[History] {len(rooms)} rooms do not fit in Config.HISTORY_MAX_BYTES, history disabled")
+    else:
+        history = HistoryStore(rooms.keys(), *history_capacities, database.write_history_chunks,
+                               database.load_history_chunks, database.load_history_chunk)
+
+def history_time():
+    """历史曲线的时间轴: 模拟时钟 (分片模式下为真实时间)"""
+    return scheduler.clock.time() if router is None else time.time()
+
+def record_history():
+    if history is not None:
+        history.record(history_time(), rooms)
+
+# --- State Push (SSE) ---
+broadcaster = Broadcaster()
+published_version = 0
+
+def build_snapshot_event(snapshot, scope):
+    """Full state of all rooms in scope, sent when a client (re)subscribes"""
+    states = [(r.room_id, r.floor, r.state())
+              for r in snapshot.rooms.values() if scope_matches(scope, r.room_id, r.floor)]
+    return DeltaEvent(snapshot.version, states, event_type='snapshot')
+
+def publish_changes(snapshot):
+    """Publish every room changed since the last published snapshot as one coalesced delta event"""
+    global published_version
+    if snapshot.version == published_version:
+        return
+    if broadcaster.has_subscribers():
+        states = [(r.room_id, r.floor, r.state())
+                  for r in snapshot.rooms.values() if r.version > published_version]
+        broadcaster.publish(DeltaEvent(snapshot.version, states))
+    published_version = snapshot.version
+
+# --- State Persistence (journal + write-behind checkpoints) ---
+# 状态变化先追加到事件日志 (group commit)，room_states 每 Config.PERSIST_INTERVAL 秒写入一次作为检查点；
+# 启动时在 load_rooms 载入的检查点之上重放日志尾部。分片模式下由各分片进程记录自己的日志
+journal = None
+if router is None and Config.JOURNAL_ENABLED:
+    journal, recovered_rooms, replayed_events = room_service.open_journal(
+        'main', rooms, scheduler, Config.JOURNAL_COMMIT_INTERVAL)
+    startup_phase('replay_journal')
+persister = StatePersister(database.update_room_states, Config.PERSIST_INTERVAL, journal)
+if journal is not None:
+    # 重放恢复的状态还不在检查点中: 重新登记，由下一个检查点写入
+    for room_id in sorted(recovered_rooms):
+        persister.mark_dirty(rooms[room_id], 'recovered')
+    persister.mark_scheduler(scheduler)
+    if replayed_events:
+        print(f"[Journal] Replayed {replayed_events} events, {len(recovered_rooms)} rooms recovered")
+persisted_version = Room.versions.latest
+
+def mark_dirty_rooms():
+    """Queue every room changed since the last call for the next batched write"""
+    global persisted_version
+    with state_lock:
+        persisted_version = persister.mark_changed(rooms, persisted_version, scheduler.ticks)
+        persister.mark_scheduler(scheduler)
+
+def record_change(kind, room_id, outcome):
+    """
+    命令循环中成功的操作: 登记房间状态与调度队列的变化 (写入事件日志，随下一个检查点保存)。
+    返回 (结果, 状态码, 日志 lsn)，请求线程用 persister.wait_durable(lsn) 等待日志提交
+    """
+    return record_changes(kind, [room_id], outcome)
+
+def record_changes(kind, room_ids, outcome):
+    """同 record_change，一次操作涉及多个房间 (批量控制)；返回最后一个事件的 lsn，一次等待即可"""
+    result, status = outcome
+    lsn = None
+    if status == 200:
+        persister.mark_scheduler(scheduler)
+        for room_id in dict.fromkeys(room_ids):
+            lsn = persister.mark_dirty(rooms[room_id], kind)
+    return result, status, lsn
+
+# --- Metrics (GET /metrics) ---
+# tick 相关的直方图只由命令循环线程写入
+STEP_SECONDS = metrics.Histogram('hotel_simulation_step_seconds', 'Duration of one background simulation step',
+                                 single_writer=True)
+TICK_LAG_SECONDS = metrics.Histogram('hotel_tick_lag_seconds', 'Delay of background ticks behind their scheduled time',
+                                     single_writer=True)
+TICKS = metrics.Counter('hotel_ticks_total', 'Background ticks run by the command loop')
+QUEUE_LENGTH = metrics.Gauge('hotel_queue_length', 'Rooms in the scheduler queues', ['queue'])
+PREEMPTIONS = metrics.Counter('hotel_preemptions_total', 'Service preemptions (Scheduler.preempt_service)')
+EXPIRED_SLICES = metrics.Counter('hotel_time_slice_expiries_total', 'Expired wait time slices handled by check_time_slices')
+REBALANCES = metrics.Counter('hotel_rebalances_total', 'Scheduler rebalance runs (Scheduler.rebalance)')
+PENDING_COMMANDS = metrics.Gauge('hotel_pending_commands', 'Commands queued for the command loop')
+PERSIST_QUEUE = metrics.Gauge('hotel_persist_queue_depth', 'Dirty rooms waiting for the next batched write')
+SHARD_TICK_SECONDS = metrics.Gauge('hotel_shard_tick_seconds', 'Duration of the last simulation step per shard', ['shard'])
+REQUEST_SECONDS = metrics.Histogram('hotel_http_request_seconds', 'HTTP request latency', ['method', 'route'])
+BILL_CACHE = metrics.Counter('hotel_bill_cache_total', 'Bill cache lookups (bills and AC session lists)', ['result'])
+JOURNAL_COMMITS = metrics.Counter('hotel_journal_commits_total', 'Journal group commits (one fsync each)')
+JOURNAL_EVENTS = metrics.Counter('hotel_journal_events_total', 'Events written to the journal')
+
+def scheduler_total(name):
+    """Scheduler 累计计数 (分片模式下为各分片之和)"""
+    if router is not None:
+        return sum(stats[name] for stats in router.shard_stats)
+    return getattr(scheduler, name)
+
+PREEMPTIONS.set_function(lambda: scheduler_total('preemptions'))
+EXPIRED_SLICES.set_function(lambda: scheduler_total('expired_slices'))
+REBALANCES.set_function(lambda: scheduler_total('rebalances'))
+TICKS.set_function(lambda: commands.tick_count)
+PENDING_COMMANDS.set_function(lambda: commands.pending())
+PERSIST_QUEUE.set_function(lambda: persister.queue_depth())
+BILL_CACHE.labels('hit').set_function(lambda: bills.hits)
+BILL_CACHE.labels('miss').set_function(lambda: bills.misses)
+JOURNAL_COMMITS.set_function(lambda: journal.commits if journal is not None else 0)
+JOURNAL_EVENTS.set_function(lambda: journal.events_written if journal is not None else 0)
+
+@metrics.on_collect
+def collect_state_metrics():
+    # 队列长度取自已发布的快照，抓取时不访问模拟循环中的对象
+    snapshot = current_snapshot
+    QUEUE_LENGTH.labels('service').set(sum(1 for view in snapshot.rooms.values() if view.is_active))
+    QUEUE_LENGTH.labels('waiting').set(len(snapshot.waiting_ids()))
+    if router is not None:
+        for index, stats in enumerate(router.shard_stats):
+            SHARD_TICK_SECONDS.labels(index).set(stats['last_tick_seconds'])
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_latency(response):
+    start = g.get('request_start')
+    if start is not None:
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        REQUEST_SECONDS.labels(request.method, route).observe(time.perf_counter() - start)
+    return response
+
 def run_simulation_step():
     """Run one second of simulation"""
-    scheduler.check_time_slices()
-    
-    for room_id, room in rooms.items():
-        # Auto-reactivate logic for Idle rooms
-        if room.power_on and not room.is_active:
-            in_waiting = any(i['room_id'] == room_id for i in scheduler.waiting_queue)
-            if not in_waiting:
-                diff = room.current_temp - room.target_temp
-                if abs(diff) > 1.0:
-                    # print(f"[Auto Reactivate] Room {room_id} temp diff > 1.0. Requesting service.")
-                    scheduler.request_service(room_id, room.fan_speed)
-        
-        # Check if target reached
-        if room.is_active:
-            diff = room.current_temp - room.target_temp
-            if abs(diff) < 0.01:
-                # print(f"[Reached Target] Room {room_id} reached target temp. Releasing service.")
-                scheduler.release_service(room_id)
-                room.is_active = False
-        
-        # Update state
-        room.update_temp_and_fee()
-        
-        # Ensure consistency if room is off
-        if not room.power_on:
-            if room.is_active or any(i['room_id'] == room_id for i in scheduler.waiting_queue):
-                scheduler.release_service(room_id)
-                room.is_active = False
-
-# --- Background Task ---
-def background_task():
-    tick = 0
-    while True:
-        if not is_simulation_mode:
-            tick += 1
+    if engine is not None:
+        engine.step(scheduler)
+    else:
+        hotel.run_simulation_step(rooms, scheduler)
+    record_history()
+
+def fast_forward(seconds):
+    """Advance `seconds` of simulation, jumping straight from one event to the next"""
+    if engine is not None:
+        engine.fast_forward(scheduler, seconds)
+    else:
+        hotel.fast_forward(rooms, scheduler, seconds)
+    # 快进跳过的时间段只记录终点
+    record_history()
+
+# --- Command Loop (single writer) ---
+def simulation_tick():
+    """每秒执行一次 (命令循环线程)"""
+    TICK_LAG_SECONDS.observe(commands.last_tick_lag)
+    # 分片模式下由各分片进程自行逐秒模拟与写回
+    if not is_simulation_mode and router is None:
+        start = time.perf_counter()
+        run_simulation_step()
+        STEP_SECONDS.observe(time.perf_counter() - start)
+        # 变化的房间登记为脏行，由写线程按 Config.PERSIST_INTERVAL 批量写入数据库
+        mark_dirty_rooms()
+    elif router is not None:
+        with state_lock:
+            record_history()
+
+def publish_state():
+    """
+    发布新的只读快照并推送变化 (命令循环线程，每个 tick 及每批命令之后)。
+    查询接口只读取 current_snapshot，不会与模拟循环争用房间对象。
+    """
+    global current_snapshot
+    with state_lock:
+        current_snapshot = build_snapshot(rooms, scheduler, current_snapshot)
+        publish_changes(current_snapshot)
+
+if router is not None:
+    router.start()
+    atexit.register(router.stop)
+    startup_phase('start_shards')
+else:
+    persister.start()
+    # 退出时写入剩余的脏行
+    atexit.register(persister.stop)
+if history is not None:
+    history.start()
+    atexit.register(history.stop)
+
+current_snapshot = build_snapshot(rooms, scheduler)
+published_version = current_snapshot.version
+gc.freeze()
+gc.enable()
+startup_phase('snapshot')
+# rooms / scheduler 的所有修改都通过 commands.submit() 在命令循环线程中执行
+# 加速时钟下每个真实秒执行 Config.CLOCK_SPEED 步模拟 (分片模式由各分片进程按各自的时钟步进)
+tick_interval = scheduler.clock.tick_interval if router is None else 1.0
+commands = CommandLoop(simulation_tick, publish_state, tick_interval)
+commands.start()
+startup_phase('start_loop')
+print(f"[Startup] {len(rooms)} rooms ready in {sum(startup_timings.values()):.1f} ms ("
+      + ", ".join(f"{name} {ms:.1f} ms" for name, ms in startup_timings.items()) + ")")
+
+def set_simulation_mode(enabled):
+    global is_simulation_mode
+    is_simulation_mode = enabled
+    if router is not None:
+        router.broadcast('set_simulation_mode', enabled)
+    else:
+        scheduler.set_test_mode(enabled)
+
+def advance_simulation(seconds, fast):
+    if router is not None:
+        # 各分片并行推进
+        router.broadcast('tick', seconds, fast)
+    elif fast:
+        fast_forward(seconds)
+    else:
+        for _ in range(seconds):
             run_simulation_step()
-            
-            # Save to DB every 5 seconds
-            if tick % 5 == 0:
-                for room_id, room in rooms.items():
-                    if room.power_on or room.total_fee > 0:
-                        database.update_room_state(
-                            room.room_id, room.power_on, room.fan_speed, 
-                            room.target_temp, room.current_temp, 
-                            room.total_fee, room.duration
-                        )
-        time.sleep(1)
-
-thread = Thread(target=background_task)
-thread.daemon = True
-thread.start()
 
 # --- Routes ---
 @app.route('/api/test/start', methods=['POST'])
 def start_simulation_mode():
-    global is_simulation_mode
-    is_simulation_mode = True
+    commands.submit(set_simulation_mode, True)
     return jsonify({"status": "Simulation mode started"})
 
 @app.route('/api/test/stop', methods=['POST'])
 def stop_simulation_mode():
-    global is_simulation_mode
-    is_simulation_mode = False
+    commands.submit(set_simulation_mode, False)
     return jsonify({"status": "Simulation mode stopped"})
 
 @app.route('/api/test/tick', methods=['POST'])
@@ -432,51 +322,229 @@ def tick_simulation():
         return jsonify({"error": "Not in simulation mode"}), 400
     
     seconds = request.json.get('seconds', 60)
-    for _ in range(seconds):
-        run_simulation_step()
+    # fast_forward: 事件驱动快进，只在状态发生转折的时刻逐秒计算，其余时间解析推进
+    fast = request.json.get('fast_forward', False)
+    commands.submit(advance_simulation, seconds, fast)
         
     return jsonify({"status": f"Advanced {seconds} seconds"})
 
-@app.route('/api/rooms', methods=['GET'])
-def get_rooms():
+# --- Room list (/api/rooms) ---
+# 列表中的房型、房价、押金与空闲状态只在入住/退房时变化: 按查询参数缓存序列化后的响应，
+# 入住/退房后整体作废。读取快照前记下代数，构建期间发生过入住/退房的结果不写入缓存。
+ROOM_LIST_CACHE_SIZE = 256
+room_list_cache = {}
+room_list_generation = 0
+room_list_lock = Lock()
+
+def invalidate_room_list():
+    global room_list_generation
+    with room_list_lock:
+        room_list_generation += 1
+        room_list_cache.clear()
+
+def build_room_list(snapshot, building, floor, page, page_size):
+    """按拓扑顺序分组的房间列表，返回 (序列化后的 JSON, 过滤后的房间总数)"""
+    floors = topology.current().floors(building, floor)
+    total = sum(len(room_ids) for _, _, room_ids in floors)
+    start = (page - 1) * page_size if page_size else 0
+    stop = start + page_size if page_size else total
     floors_data = []
-    for i in range(1, 5):
+    offset = 0
+    for building_id, level, room_ids in floors:
+        # 只取落在当前页中的房间
+        selected = room_ids[max(0, start - offset):max(0, stop - offset)]
+        offset += len(room_ids)
         floor_rooms = []
-        for j in range(1, 11):
-            room_id = f"{i}{j:02d}"
-            if room_id in rooms:
-                r = rooms[room_id]
+        for room_id in selected:
+            r = snapshot.rooms.get(room_id)
+            if r is not None:
                 floor_rooms.append({
-                    "id": int(r.room_id), 
+                    "id": int(r.room_id) if r.room_id.isdigit() else r.room_id,
                     "type": r.room_type,
                     "price": r.room_price,
                     "deposit": r.deposit,
                     "isFree": r.is_free
                 })
-        floors_data.append({"level": i, "rooms": floor_rooms})
-    return jsonify(floors_data)
+        if floor_rooms or not page_size:
+            floors_data.append({"level": level, "building": building_id, "rooms": floor_rooms})
+    return (app.json.dumps(floors_data) + "\n").encode('utf-8'), total
+
+@app.route('/api/rooms', methods=['GET'])
+def get_rooms():
+    """
+    房间列表 (入住界面): 按楼栋/楼层分组的房型、房价、押金与空闲状态
+    Query: building=main / floor=1 过滤; page=1&page_size=50 按房间分页 (过滤后的总数见 X-Total-Count)
+    """
+    building = request.args.get('building')
+    floor = request.args.get('floor', type=int)
+    page = request.args.get('page', 1, type=int)
+    page_size = request.args.get('page_size', type=int)
+    if page < 1 or (page_size is not None and page_size < 1):
+        return jsonify({"error": "page and page_size must be positive"}), 400
+
+    key = (building, floor, page, page_size)
+    cached = room_list_cache.get(key)
+    if cached is None:
+        generation = room_list_generation
+        cached = build_room_list(current_snapshot, *key)
+        with room_list_lock:
+            if generation == room_list_generation and len(room_list_cache) < ROOM_LIST_CACHE_SIZE:
+                room_list_cache[key] = cached
+    body, total = cached
+    return Response(body, mimetype=app.json.mimetype, headers={"X-Total-Count": str(total)})
+
+@app.route('/api/rooms/status', methods=['GET'])
+def get_rooms_status():
+    """
+    批量获取房间状态 (一次一致快照)
+    Query: rooms=101,102 / floor=1 过滤; since_version=N 只返回版本大于 N 的房间
+    Header: If-None-Match 携带上次的 ETag, 无变化时返回 304
+    """
+    since_version = request.args.get('since_version', type=int)
+    floor = request.args.get('floor', type=int)
+    room_ids = request.args.get('rooms')
+
+    snapshot = current_snapshot
+    version = snapshot.version
+    etag = str(version)
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers={"ETag": f'"{etag}"'})
+
+    # ETag 本身就是版本号，可直接作为增量查询的起点
+    if since_version is None:
+        for tag in request.if_none_match.as_set():
+            if tag.isdigit():
+                since_version = int(tag)
+                break
+
+    if room_ids:
+        selected = [snapshot.rooms[r] for r in room_ids.split(',') if r in snapshot.rooms]
+    else:
+        selected = snapshot.rooms.values()
+    if floor is not None:
+        selected = [r for r in selected if r.floor == floor]
+
+    result = [room.state() for room in selected
+              if since_version is None or room.version > since_version]
+
+    if since_version is not None and not result:
+        return Response(status=304, headers={"ETag": f'"{etag}"'})
+
+    resp = jsonify({"version": version, "rooms": result})
+    resp.set_etag(etag)
+    return resp
+
+def stream_scope(room_id, floor):
+    """SSE 订阅范围 (单个房间 / 一层 / 整栋酒店)，房间不存在时返回 None"""
+    if room_id is not None:
+        return ('room', room_id) if room_id in current_snapshot.rooms else None
+    if floor is not None:
+        return ('floor', floor)
+    return HOTEL_SCOPE
+
+@app.route('/api/stream', methods=['GET'])
+def stream_room_states():
+    """
+    Server-Sent Events 推送房间状态变化
+    Query: room=101 订阅单个房间 / floor=1 订阅一层 / 不带参数订阅整栋酒店
+    首先发送一次 snapshot 事件，之后每个 tick 合并发送一次 delta 事件
+    """
+    scope = stream_scope(request.args.get('room'), request.args.get('floor', type=int))
+    if scope is None:
+        return jsonify({"error": "Room not found"}), 404
+
+    # 订阅与读取快照在同一把锁内完成 (发布也持有该锁)，保证不会漏掉或重复事件
+    with state_lock:
+        sub = broadcaster.subscribe(scope)
+        snapshot = build_snapshot_event(current_snapshot, scope)
+
+    def generate():
+        try:
+            yield snapshot.render(scope)
+            while True:
+                if sub.overflowed:
+                    # 消费过慢: 丢弃积压事件并重新发送全量快照
+                    with state_lock:
+                        while not sub.events.empty():
+                            sub.events.get_nowait()
+                        sub.overflowed = False
+                        resync = build_snapshot_event(current_snapshot, scope)
+                    yield resync.render(scope)
+                try:
+                    event = sub.get(timeout=15)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                payload = event.render(scope)
+                if payload:
+                    yield payload
+        finally:
+            broadcaster.unsubscribe(sub)
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 @app.route('/api/room/<room_id>/status', methods=['GET'])
 def get_room_status(room_id):
-    if room_id in rooms:
-        state = rooms[room_id].to_dict()
-        state['is_waiting'] = any(i['room_id'] == room_id for i in scheduler.waiting_queue)
+    room = current_snapshot.rooms.get(room_id)
+    if room is not None:
+        state = room.to_dict()
+        state['is_waiting'] = room.is_waiting
         return jsonify(state)
     else:
         return jsonify({"error": "Room not found"}), 404
 
+@app.route('/api/room/<room_id>/history', methods=['GET'])
+def get_room_history(room_id):
+    """
+    房间温度与累计费用的历史曲线: {"points": [[时间戳, 温度, 累计费用], ...]}
+    Query: from / to 为时间戳 (秒，默认最近 1 小时); resolution 为 1 / 60 / 900 (秒)，
+    不指定时选择点数不超过 Config.HISTORY_MAX_POINTS 的最细分辨率
+    """
+    if history is None:
+        return jsonify({"error": "History is disabled"}), 404
+    if room_id not in history.index:
+        return jsonify({"error": "Room not found"}), 404
+    stop = request.args.get('to', history_time(), type=float)
+    start = request.args.get('from', stop - 3600, type=float)
+    resolution = request.args.get('resolution', type=int)
+    if start > stop:
+        return jsonify({"error": "from must not be later than to"}), 400
+    if resolution is None:
+        resolution = next((r for r in RESOLUTIONS if (stop - start) / r <= Config.HISTORY_MAX_POINTS), RESOLUTIONS[-1])
+    elif resolution not in RESOLUTIONS:
+        return jsonify({"error": f"resolution must be one of {list(RESOLUTIONS)}"}), 400
+    points = history.query(room_id, start, stop, resolution)
+    return jsonify({
+        "room_id": room_id,
+        "from": start,
+        "to": stop,
+        "resolution": resolution,
+        "points": [[t, round(temp, 3), round(fee, 4)] for t, temp, fee in points],
+    })
+
+# --- Bills ---
+# 入住信息与详单在内存中缓存 (入住/退房时作废)，账单按房间的 bill_version 缓存
+bills = BillCache(database.get_room_check_in_info, database.iter_ac_sessions)
+
 @app.route('/api/room/<room_id>/bill', methods=['GET'])
 def get_room_bill(room_id):
-    if room_id not in rooms:
+    rooms_view = current_snapshot.rooms
+    if room_id not in rooms_view:
         return jsonify({"error": "Room not found"}), 404
     
-    room = rooms[room_id]
+    room = rooms_view[room_id]
     if room.is_free:
         return jsonify({"error": "Room is not occupied"}), 400
-        
-    # Get check-in info from DB
-    check_in_info = database.get_room_check_in_info(room_id)
-    check_in_date = check_in_info['check_in_time'] if check_in_info else "Unknown"
+
+    # 控制/入住/退房后，或空调每服务 BILL_REFRESH_SECONDS 秒重新生成
+    key = (room.bill_version, room.duration // Config.BILL_REFRESH_SECONDS)
+    body = bills.bill(room_id, key, lambda: (app.json.dumps(room_bill(room)) + "\n").encode('utf-8'))
+    return Response(body, mimetype=app.json.mimetype)
+
+def room_bill(room):
+    """GET /bill 的账单数据 (结果由 get_room_bill 缓存)"""
+    check_in_date = bills.check_in_time(room.room_id)
     
     # Calculate fees
     stay_fee = room.room_price * room.stay_days
@@ -519,56 +587,75 @@ def get_room_bill(room_id):
         "deposit": room.deposit,
         "records": records
     }
-    return jsonify(bill_data)
+    return bill_data
+
+def bill_export_response(room, bill_name, header_lines, summary):
+    """
+    流式导出账单: 详单取自账单缓存 (bill_version 未变化时不再查询数据库)，详单很多时逐批从数据库读取。
+    ?format=txt (默认, 固定宽度文本) | csv (仅详单行) | ndjson (首行汇总, 之后每行一个详单)
+    """
+    fmt = request.args.get('format', 'txt')
+    if fmt not in EXPORT_FORMATS:
+        return f"Unsupported format: {fmt}", 400
+    mimetype, ext = EXPORT_FORMATS[fmt]
+
+    room_id = room.room_id
+    sessions = bills.sessions(room_id, room.bill_version)
+    if fmt == 'csv':
+        body = bill_export.iter_csv(room_id, sessions)
+    elif fmt == 'ndjson':
+        body = bill_export.iter_ndjson(room_id, summary, sessions)
+    else:
+        body = bill_export.iter_txt(header_lines, sessions)
+    return Response(body, mimetype=mimetype, headers={"Content-Disposition": f"attachment;filename={bill_name}_{room_id}.{ext}"})
+
+def speed_stats_summary(room):
+    return {speed: dict(room.speed_stats.get(speed, {"duration": 0, "fee": 0})) for speed in ["High", "Mid", "Low"]}
 
 @app.route('/api/room/<room_id>/export/ac_bill', methods=['GET'])
 def export_ac_bill(room_id):
-    if room_id not in rooms:
+    rooms_view = current_snapshot.rooms
+    if room_id not in rooms_view:
         return "Room not found", 404
     
-    room = rooms[room_id]
-    check_in_info = database.get_room_check_in_info(room_id)
-    check_in_date = check_in_info['check_in_time'] if check_in_info else "Unknown"
+    room = rooms_view[room_id]
+    check_in_date = bills.check_in_time(room_id)
     check_out_date = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     
-    sessions = database.get_ac_sessions(room_id)
-    
     # Header
-    content = f"=== 空调费用详单 ===\n"
-    content += f"房间号: {room_id}\n"
-    content += f"入住时间: {check_in_date}\n"
-    content += f"离开时间: {check_out_date}\n"
-    content += f"空调总费用: {room.total_fee:.2f}元\n"
-    content += f"空调调度次数: {room.dispatch_count}次\n"
-    content += f"--------------------------------------------------\n"
-    content += f"风速统计:\n"
+    lines = [f"=== 空调费用详单 ===\n"]
+    lines.append(f"房间号: {room_id}\n")
+    lines.append(f"入住时间: {check_in_date}\n")
+    lines.append(f"离开时间: {check_out_date}\n")
+    lines.append(f"空调总费用: {room.total_fee:.2f}元\n")
+    lines.append(f"空调调度次数: {room.dispatch_count}次\n")
+    lines.append(f"--------------------------------------------------\n")
+    lines.append(f"风速统计:\n")
     for speed in ["High", "Mid", "Low"]:
         s = room.speed_stats.get(speed, {"duration": 0, "fee": 0})
-        content += f"  {speed}: 时长 {s['duration']:.2f}秒, 费用 {s['fee']:.2f}元\n"
-    content += f"--------------------------------------------------\n"
-    content += f"{'开始时间':<20} | {'结束时间':<20} | {'时长(秒)':<8} | {'风速':<5} | {'费用':<8} | {'累积费用':<8}\n"
-    content += f"--------------------------------------------------\n"
-    
-    for s in sessions:
-        # s: request_time, start_time, end_time, duration, fan_speed, fee, total_fee_snapshot
-        start = s[1]
-        end = s[2]
-        dur = s[3]
-        speed = s[4]
-        fee = s[5]
-        total = s[6]
-        content += f"{start:<20} | {end:<20} | {dur:<8} | {speed:<5} | {fee:<8.4f} | {total:<8.4f}\n"
-        
-    return Response(content, mimetype='text/plain', headers={"Content-Disposition": f"attachment;filename=ac_bill_{room_id}.txt"})
+        lines.append(f"  {speed}: 时长 {s['duration']:.2f}秒, 费用 {s['fee']:.2f}元\n")
+    lines.append(f"--------------------------------------------------\n")
+    lines.append(f"{'开始时间':<20} | {'结束时间':<20} | {'时长(秒)':<8} | {'风速':<5} | {'费用':<8} | {'累积费用':<8}\n")
+    lines.append(f"--------------------------------------------------\n")
+    
+    summary = {
+        "bill": "ac_bill",
+        "check_in_time": check_in_date,
+        "check_out_time": check_out_date,
+        "total_ac_fee": room.total_fee,
+        "dispatch_count": room.dispatch_count,
+        "speed_stats": speed_stats_summary(room),
+    }
+    return bill_export_response(room, "ac_bill", lines, summary)
 
 @app.route('/api/room/<room_id>/export/stay_bill', methods=['GET'])
 def export_stay_bill(room_id):
-    if room_id not in rooms:
+    rooms_view = current_snapshot.rooms
+    if room_id not in rooms_view:
         return "Room not found", 404
     
-    room = rooms[room_id]
-    check_in_info = database.get_room_check_in_info(room_id)
-    check_in_date = check_in_info['check_in_time'] if check_in_info else "Unknown"
+    room = rooms_view[room_id]
+    check_in_date = bills.check_in_time(room_id)
     check_out_date = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     
     stay_fee = room.room_price * room.stay_days
@@ -594,234 +681,242 @@ def export_stay_bill(room_id):
 
 @app.route('/api/room/<room_id>/export/detailed_bill', methods=['GET'])
 def export_detailed_bill(room_id):
-    if room_id not in rooms:
+    rooms_view = current_snapshot.rooms
+    if room_id not in rooms_view:
         return "Room not found", 404
     
-    room = rooms[room_id]
-    check_in_info = database.get_room_check_in_info(room_id)
-    check_in_date = check_in_info['check_in_time'] if check_in_info else "Unknown"
+    room = rooms_view[room_id]
+    check_in_date = bills.check_in_time(room_id)
     check_out_date = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     
     stay_fee = room.room_price * room.stay_days
     total_cost = stay_fee + room.total_fee + room.food_fee
     final_payable = total_cost - room.deposit
     
-    sessions = database.get_ac_sessions(room_id)
-    
-    content = f"=== 住宿详细账单 ===\n"
-    content += f"房间号: {room_id}\n"
-    content += f"入住时间: {check_in_date}\n"
-    content += f"离开时间: {check_out_date}\n"
-    content += f"入住天数: {room.stay_days}\n"
-    content += f"--------------------------------------------------\n"
-    content += f"费用汇总:\n"
-    content += f"  房费 ({room.room_price}元/晚 * {room.stay_days}天): {stay_fee:.2f}元\n"
-    content += f"  餐饮费: {room.food_fee:.2f}元\n"
-    content += f"  空调费: {room.total_fee:.2f}元\n"
-    content += f"  已付押金: {room.deposit:.2f}元\n"
-    content += f"--------------------------------------------------\n"
-    content += f"应付总额: {total_cost:.2f}元\n"
-    content += f"实付金额 (扣除押金): {final_payable:.2f}元\n"
-    content += f"==================================================\n"
-    content += f"\n"
-    content += f"=== 空调使用明细 ===\n"
-    content += f"空调调度次数: {room.dispatch_count}次\n"
-    content += f"风速统计:\n"
+    lines = [f"=== 住宿详细账单 ===\n"]
+    lines.append(f"房间号: {room_id}\n")
+    lines.append(f"入住时间: {check_in_date}\n")
+    lines.append(f"离开时间: {check_out_date}\n")
+    lines.append(f"入住天数: {room.stay_days}\n")
+    lines.append(f"--------------------------------------------------\n")
+    lines.append(f"费用汇总:\n")
+    lines.append(f"  房费 ({room.room_price}元/晚 * {room.stay_days}天): {stay_fee:.2f}元\n")
+    lines.append(f"  餐饮费: {room.food_fee:.2f}元\n")
+    lines.append(f"  空调费: {room.total_fee:.2f}元\n")
+    lines.append(f"  已付押金: {room.deposit:.2f}元\n")
+    lines.append(f"--------------------------------------------------\n")
+    lines.append(f"应付总额: {total_cost:.2f}元\n")
+    lines.append(f"实付金额 (扣除押金): {final_payable:.2f}元\n")
+    lines.append(f"==================================================\n")
+    lines.append(f"\n")
+    lines.append(f"=== 空调使用明细 ===\n")
+    lines.append(f"空调调度次数: {room.dispatch_count}次\n")
+    lines.append(f"风速统计:\n")
     for speed in ["High", "Mid", "Low"]:
         s = room.speed_stats.get(speed, {"duration": 0, "fee": 0})
-        content += f"  {speed}: 时长 {s['duration']:.2f}秒, 费用 {s['fee']:.2f}元\n"
-    content += f"--------------------------------------------------\n"
-    content += f"{'开始时间':<20} | {'结束时间':<20} | {'时长(秒)':<8} | {'风速':<5} | {'费用':<8} | {'累积费用':<8}\n"
-    content += f"--------------------------------------------------\n"
-    
-    for s in sessions:
-        # s: request_time, start_time, end_time, duration, fan_speed, fee, total_fee_snapshot
-        start = s[1]
-        end = s[2]
-        dur = s[3]
-        speed = s[4]
-        fee = s[5]
-        total = s[6]
-        content += f"{start:<20} | {end:<20} | {dur:<8} | {speed:<5} | {fee:<8.4f} | {total:<8.4f}\n"
-        
-    return Response(content, mimetype='text/plain', headers={"Content-Disposition": f"attachment;filename=detailed_bill_{room_id}.txt"})
+        lines.append(f"  {speed}: 时长 {s['duration']:.2f}秒, 费用 {s['fee']:.2f}元\n")
+    lines.append(f"--------------------------------------------------\n")
+    lines.append(f"{'开始时间':<20} | {'结束时间':<20} | {'时长(秒)':<8} | {'风速':<5} | {'费用':<8} | {'累积费用':<8}\n")
+    lines.append(f"--------------------------------------------------\n")
+    
+    summary = {
+        "bill": "detailed_bill",
+        "check_in_time": check_in_date,
+        "check_out_time": check_out_date,
+        "stay_days": room.stay_days,
+        "room_price": room.room_price,
+        "stay_fee": stay_fee,
+        "food_fee": room.food_fee,
+        "total_ac_fee": room.total_fee,
+        "deposit": room.deposit,
+        "total_cost": total_cost,
+        "final_payable": final_payable,
+        "dispatch_count": room.dispatch_count,
+        "speed_stats": speed_stats_summary(room),
+    }
+    return bill_export_response(room, "detailed_bill", lines, summary)
 
 @app.route('/api/room/<room_id>/control', methods=['POST'])
 def control_room(room_id):
-    if room_id not in rooms:
-        return jsonify({"error": "Room not found"}), 404
-    
-    room = rooms[room_id]
-
-    # Check if room is occupied
-    if room.is_free:
-        return jsonify({"error": "Room is not checked in. AC control disabled."}), 403
-    
     data = request.json
-    
-    if 'power_on' in data:
-        new_power_state = data['power_on']
-        
-        # Logic: Manual ON -> OFF cycle counts as 1 day stay
-        if room.power_on and not new_power_state:
-            room.stay_days += 1
-            print(f"[Billing] Room {room_id} stay_days increased to {room.stay_days}")
-            database.update_stay_days(room_id, room.stay_days)
-            
-            # Log AC Session
-            if room.current_session_start_time:
-                end_time = datetime.datetime.now()
-                duration = int((end_time - room.current_session_start_time).total_seconds())
-                session_fee = room.total_fee - room.current_session_fee_start
-                
-                database.log_ac_session(
-                    room_id,
-                    room.current_session_start_time, # Request time (approx)
-                    room.current_session_start_time, # Start time
-                    end_time,
-                    duration,
-                    room.fan_speed,
-                    session_fee,
-                    room.total_fee
-                )
-                room.current_session_start_time = None
-            
-        room.power_on = new_power_state
-        
-        # Reset target temp to default (25.0) and fan speed to Mid on power switch
-        room.target_temp = 25.0
-        room.fan_speed = "Mid"
-        
-        print(f"[Control] Room {room_id} Power -> {room.power_on}")
-        if room.power_on:
-            scheduler.request_service(room_id, room.fan_speed)
-            # Start Session Logging
-            room.current_session_start_time = datetime.datetime.now()
-            room.current_session_fee_start = room.total_fee
-        else:
-            scheduler.release_service(room_id)
-            room.is_active = False
-
-    if 'target_temp' in data:
-        room.target_temp = data['target_temp']
-        print(f"[Control] Room {room_id} Target Temp -> {room.target_temp}")
-        if room.power_on and not room.is_active:
-             diff = room.current_temp - room.target_temp
-             if abs(diff) > 1.0:
-                 scheduler.request_service(room_id, room.fan_speed)
-
-    if 'fan_speed' in data:
-        new_speed = data['fan_speed']
-        
-        # If speed changes while ON, log the previous session segment
-        if room.power_on and room.fan_speed != new_speed:
-             if room.current_session_start_time:
-                end_time = datetime.datetime.now()
-                duration = int((end_time - room.current_session_start_time).total_seconds())
-                session_fee = room.total_fee - room.current_session_fee_start
-                
-                database.log_ac_session(
-                    room_id,
-                    room.current_session_start_time,
-                    room.current_session_start_time,
-                    end_time,
-                    duration,
-                    room.fan_speed, # Log with OLD speed
-                    session_fee,
-                    room.total_fee
-                )
-                # Start new session segment
-                room.current_session_start_time = end_time
-                room.current_session_fee_start = room.total_fee
-
-        room.fan_speed = new_speed
-        print(f"[Control] Room {room_id} Fan Speed -> {room.fan_speed}")
-        if room.power_on:
-            scheduler.request_service(room_id, room.fan_speed)
-            
-    # Save state to DB immediately on control action
-    database.update_room_state(
-        room.room_id, room.power_on, room.fan_speed, 
-        room.target_temp, room.current_temp, 
-        room.total_fee, room.duration
-    )
-        
-    return jsonify({"status": "success", "current_state": room.to_dict()})
+    if router is not None and room_id in router.shard_of:
+        result, status = router.call_room(room_id, 'control', room_id, data)
+        commands.sync()
+        return jsonify(result), status
+
+    result, status, lsn = commands.submit(apply_control, room_id, data)
+    # 日志提交 (与同一时段的其他事件共用一次 fsync) 后再返回
+    persister.wait_durable(lsn)
+    return jsonify(result), status
+
+def apply_control(room_id, data):
+    return record_change('control', room_id, room_service.control_room(rooms, scheduler, room_id, data))
+
+@app.route('/api/rooms/control', methods=['POST'])
+def control_rooms():
+    """
+    批量控制: {"commands": [{"room_id": "301", "power_on": false}, ...]} (也可直接提交命令列表)
+    全部命令检查通过后才执行，调度器只在最后重新分配一次，详单写入一个事务、日志一次提交。
+    返回 {"results": [{"room_id", "status", "applied", "current_state" | "error"}, ...]}，顺序与命令相同
+    """
+    data = request.get_json(silent=True)
+    batch = data.get('commands') if isinstance(data, dict) else data
+    if not isinstance(batch, list) or not batch:
+        return jsonify({"error": "commands must be a non-empty list"}), 400
+    if router is not None:
+        result, status = router.control_rooms(batch)
+        commands.sync()
+        return jsonify(result), status
+
+    result, status, lsn = commands.submit(apply_control_batch, batch)
+    persister.wait_durable(lsn)
+    return jsonify(result), status
+
+def apply_control_batch(batch):
+    outcome = room_service.control_rooms(rooms, scheduler, batch)
+    return record_changes('control', [command['room_id'] for command in batch] if outcome[1] == 200 else [], outcome)
+
+def apply_check_in(data):
+    return record_change('check_in', data.get('room_id'), room_service.check_in(rooms, data))
+
+def apply_check_out(room_id):
+    return record_change('check_out', room_id, room_service.check_out(rooms, scheduler, room_id))
 
 @app.route('/api/check_in', methods=['POST'])
 def check_in():
     data = request.json
     room_id = data.get('room_id')
-    id_card = data.get('id_card')
-    name = data.get('name')
-    phone = data.get('phone')
-    deposit = float(data.get('deposit', 0))
-    food_orders = data.get('food_orders', []) # List of {name, price, count}
-    # days is no longer required from frontend, default to 0
-    days = 0
-
-    if not all([room_id, id_card, name]):
-        return jsonify({"error": "Missing required fields"}), 400
-
-    if room_id not in rooms:
-        return jsonify({"error": "Room not found"}), 404
-
-    room = rooms[room_id]
-    # Check if room is already occupied (optional, but good practice)
-    # For now, we assume we can overwrite or check-in
-    
-    room.tenant_id = id_card
-    room.tenant_name = name
-    room.tenant_phone = phone
-    room.stay_days = days
-    room.deposit = deposit
-    room.food_orders = food_orders
-    room.is_free = False # Mark as occupied
-    
-    # Calculate food fee
-    total_food = 0
-    for item in food_orders:
-        total_food += item.get('price', 0) * item.get('count', 0)
-    room.food_fee = total_food
-    
-    # Save to DB
-    database.add_check_in(room_id, id_card, name, phone, days, deposit, json.dumps(food_orders))
-    
-    print(f"[CheckIn] Room {room_id} checked in by {name}. Deposit: {deposit}, Food Fee: {total_food}")
-    
-    return jsonify({"status": "success", "message": "Check-in successful"})
+    if router is not None and room_id in router.shard_of:
+        result, status = router.call_room(room_id, 'check_in', data)
+        commands.sync()
+    else:
+        result, status, lsn = commands.submit(apply_check_in, data)
+        persister.wait_durable(lsn)
+    if status == 200:
+        invalidate_room_list()
+        bills.invalidate(room_id)
+    return jsonify(result), status
 
 @app.route('/api/check_out', methods=['POST'])
 def check_out():
     data = request.json
     room_id = data.get('room_id')
-    
-    if not room_id or room_id not in rooms:
-        return jsonify({"error": "Room not found"}), 404
-        
-    room = rooms[room_id]
-    
-    # Clear memory state
-    room.is_free = True
-    room.tenant_id = None
-    room.tenant_name = None
-    room.tenant_phone = None
-    room.stay_days = 0
-    room.power_on = False # Turn off AC
-    room.is_active = False
-    scheduler.release_service(room_id) # Stop service
-    
-    # Update DB
-    database.check_out_db(room_id)
-    
-    print(f"[CheckOut] Room {room_id} checked out.")
-    return jsonify({"status": "success", "message": "Check-out successful"})
+    if router is not None and room_id in router.shard_of:
+        result, status = router.call_room(room_id, 'check_out', room_id)
+        commands.sync()
+    else:
+        result, status, lsn = commands.submit(apply_check_out, room_id)
+        persister.wait_durable(lsn)
+    if status == 200:
+        invalidate_room_list()
+        bills.invalidate(room_id)
+    return jsonify(result), status
+
+@app.route('/api/persistence/status', methods=['GET'])
+def get_persistence_status():
+    return jsonify(persister.stats())
+
+@app.route('/api/shards/status', methods=['GET'])
+def get_shards_status():
+    if router is None:
+        return jsonify({"enabled": False, "shards": []})
+    return jsonify({"enabled": True, "shards": router.stats()})
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+# --- Profiling (admin) ---
+profiler = Profiler()
+PROFILE_ENDPOINTS = ('start_profile', 'list_profiles', 'get_profile_file', 'get_memory_report', 'static')
+
+def profile_hooks(targets):
+    """分析目标 -> (owner, 属性名): 'tick' 为模拟步进，其余为接口路径 (如 /api/rooms/status) 或 endpoint 名"""
+    rules = {rule.rule: rule.endpoint for rule in app.url_map.iter_rules()}
+    hooks = {}
+    for target in targets:
+        if target == 'tick':
+            if router is not None:
+                raise ValueError("Simulation steps run in the shard processes in sharded mode")
+            hooks[target] = (sys.modules[__name__], 'run_simulation_step')
+            continue
+        endpoint = rules.get(target, target)
+        if endpoint not in app.view_functions or endpoint in PROFILE_ENDPOINTS:
+            raise ValueError(f"Unknown route: {target}")
+        hooks[target] = (app.view_functions, endpoint)
+    return hooks
+
+def profile_state():
+    """tracemalloc 报告中的房间与调度队列规模"""
+    sizes = {"rooms": len(rooms)}
+    if router is None:
+        sizes.update(scheduler.queue_sizes())
+    return sizes
+
+@app.route('/api/admin/profile', methods=['POST'])
+def start_profile():
+    """
+    开始一次分析会话: {"seconds": 10, "mode": "cprofile"|"sampling", "targets": ["tick", "/api/rooms/status"],
+    "interval": 0.005, "tracemalloc": false, "wait": false}。wait 为 true 时等待会话结束再返回。
+    """
+    data = request.json or {}
+    try:
+        targets = data.get('targets', ['tick'])
+        if isinstance(targets, str):
+            targets = [targets]
+        session = profiler.start(profile_hooks(targets), float(data.get('seconds', 10)),
+                                 data.get('mode', 'cprofile'), float(data.get('interval', 0.005)),
+                                 bool(data.get('tracemalloc', False)), profile_state)
+    except ProfilerBusy as e:
+        return jsonify({"error": str(e)}), 409
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+    if data.get('wait'):
+        session.wait()
+        return jsonify(session.to_dict())
+    return jsonify(session.to_dict()), 202
+
+@app.route('/api/admin/profile', methods=['GET'])
+def list_profiles():
+    return jsonify([session.to_dict() for session in profiler.sessions.values()])
+
+@app.route('/api/admin/profile/<session_id>/<kind>', methods=['GET'])
+def get_profile_file(session_id, kind):
+    """下载分析结果: kind 为 pstats / txt / collapsed / tracemalloc"""
+    session = profiler.get(session_id)
+    if session is None or kind not in session.files:
+        return jsonify({"error": "Profile not found"}), 404
+    path = session.files[kind]
+    if kind == 'pstats':
+        return send_file(path, mimetype='application/octet-stream', as_attachment=True,
+                         download_name=f"{session_id}.pstats")
+    return send_file(path, mimetype='text/plain')
+
+@app.route('/api/admin/memory', methods=['GET'])
+def get_memory_report():
+    """房间对象、快照副本与历史曲线缓冲区的内存占用估算 (?sample=1000 抽样房间数)"""
+    sample = request.args.get('sample', 1000, type=int)
+    if sample <= 0:
+        return jsonify({"error": "sample must be positive"}), 400
+    return jsonify(memory_report(rooms, current_snapshot, sample, history))
 
 @app.route('/api/report', methods=['GET'])
 def get_report():
     data = database.get_report_data()
     return jsonify(data)
 
+@app.route('/api/report/verify', methods=['GET', 'POST'])
+def verify_report():
+    # GET 只校验汇总表; POST 校验并在不一致时从原始记录重建
+    result = database.check_report_rollup(repair=request.method == 'POST')
+    return jsonify(result)
+
 if __name__ == '__main__':
     print("启动 Python 后端计费服务...")
-    app.run(port=5000)
+    if Config.SERVER_MODE == 'asyncio':
+        import aio_server
+        # 以 python app.py 运行时本模块为 __main__，直接传入，避免再次导入 app
+        aio_server.serve(sys.modules[__name__], port=5000, workers=Config.ASYNC_WORKERS,
+                         max_body=Config.MAX_REQUEST_BYTES)
+    else:
+        app.run(port=5000)
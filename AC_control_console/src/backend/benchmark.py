@@ -0,0 +1,532 @@
+"""
+性能基准测试
+
+测量模拟步进、调度队列操作、HTTP 热点接口和数据库写入的性能，结果写入 JSON；
+指定 --baseline 时与保存的基准结果比较，性能下降超过阈值的指标会被标记为回归 (退出码 1)。
+
+用法:
+    python benchmark.py                          # 完整测试 (房间数 40 -> 100k)
+    python benchmark.py --quick                  # 快速测试 (房间数 40 -> 4000)
+    python benchmark.py --output bench.json      # 指定结果文件
+    python benchmark.py --baseline base.json     # 与基准比较
+    python benchmark.py --compare new.json --baseline base.json   # 只比较两个已有结果
+    python benchmark.py --only sim_step,scheduler                 # 只运行部分测试
+    python benchmark.py --only startup                            # 启动耗时 (建库、恢复房间、生成快照)
+    python benchmark.py --only memory                             # 每个房间占用的内存 (房间对象、快照与历史曲线)
+    python benchmark.py --only asyncio                            # asyncio 服务方式: 保持大量 SSE 连接时的查询延迟与推送耗时
+
+所有测试使用临时数据库，不会修改 hotel.db。
+"""
+import argparse
+import contextlib
+import datetime
+import gc
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import database
+import history
+import hotel
+import journal
+import room_service
+from hotel import Room, Scheduler
+from snapshot import build_snapshot
+
+SUITES = ['sim_step', 'scheduler', 'http', 'database', 'startup', 'memory', 'asyncio']
+
+# 各指标的方向: 'lower' 越小越好 (耗时/延迟)，'higher' 越大越好 (吞吐)
+results = {}
+
+
+def record(name, value, unit, better):
+    results[name] = {"value": value, "unit": unit, "better": better}
+    print(f"  {name:<48} {value:>14.6g} {unit}")
+
+
+@contextlib.contextmanager
+def quiet():
+    """屏蔽模拟与调度过程中的打印输出"""
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def timed(fn, repeat):
+    """重复执行 fn，返回每次耗时 (秒) 的列表"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(p / 100.0 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def make_rooms(count, make_room=Room):
+    """生成 count 个房间: 每层 100 间，约 1/4 开机 (高/中/低风速轮流)"""
+    rooms = {}
+    for i in range(count):
+        floor, num = 1 + i // 100, i % 100
+        room_id = f"{floor}{num:02d}"
+        room = make_room(room_id, floor)
+        room.current_temp = 28.0 + (i % 7)
+        room.initial_temp = room.current_temp
+        rooms[room_id] = room
+    scheduler = Scheduler(rooms)
+    speeds = ["High", "Mid", "Low"]
+    with quiet():
+        for i, room in enumerate(rooms.values()):
+            if i % 4 == 0:
+                room.is_free = False
+                room.power_on = True
+                room.fan_speed = speeds[i % 3]
+                scheduler.request_service(room.room_id, room.fan_speed)
+    return rooms, scheduler
+
+
+# --- Simulation step ---
+def burst_step(count, make_engine=None):
+    """
+    其余 3/4 的房间同时开机后的第一秒: 每个房间都要逐个调用调度器 (申请服务并进入等待队列)，
+    是一秒内调度器调用最多的情况。返回三次 (每次重新建房间) 的耗时中位数。
+    """
+    samples = []
+    for _ in range(3):
+        engine = make_engine() if make_engine else None
+        rooms, scheduler = make_rooms(count, engine.add_room if engine else Room)
+        if engine:
+            engine.rooms.update(rooms)
+        for room in rooms.values():
+            room.power_on = True
+        step = (lambda: engine.step(scheduler)) if engine else (lambda: hotel.run_simulation_step(rooms, scheduler))
+        with quiet():
+            samples += timed(step, 1)
+    return statistics.median(samples)
+
+
+def bench_sim_step(sizes):
+    print("run_simulation_step (seconds per step):")
+    for count in sizes:
+        rooms, scheduler = make_rooms(count)
+        repeat = max(3, min(50, 200000 // count))
+        with quiet():
+            samples = timed(lambda: hotel.run_simulation_step(rooms, scheduler), repeat)
+        record(f"sim_step.object.rooms_{count}", statistics.median(samples), "s", "lower")
+    for count in sizes:
+        record(f"sim_step.object_burst.rooms_{count}", burst_step(count), "s", "lower")
+
+    try:
+        from vector_engine import VectorEngine
+    except ImportError:
+        print("  (numpy not installed, vector engine skipped)")
+        return
+    for count in sizes:
+        engine = VectorEngine()
+        rooms, scheduler = make_rooms(count, engine.add_room)
+        engine.rooms.update(rooms)
+        repeat = max(3, min(50, 200000 // count))
+        with quiet():
+            samples = timed(lambda: engine.step(scheduler), repeat)
+        record(f"sim_step.vector.rooms_{count}", statistics.median(samples), "s", "lower")
+    for count in sizes:
+        record(f"sim_step.vector_burst.rooms_{count}", burst_step(count, VectorEngine), "s", "lower")
+
+
+# --- Scheduler ---
+def bench_scheduler(queue_lengths):
+    print("Scheduler operations (ops per second):")
+    speeds = ["High", "Mid", "Low"]
+    for length in queue_lengths:
+        # 所有房间都在排队: 服务队列已满，等待队列长度约为 length
+        rooms, scheduler = make_rooms(length * 4)
+        ids = [room_id for i, room_id in enumerate(rooms) if i % 4 != 0]
+        ops = min(20000, max(2000, length * 2))
+
+        def request_release():
+            for i in range(ops):
+                room_id = ids[i % len(ids)]
+                scheduler.request_service(room_id, speeds[i % 3])
+                scheduler.release_service(room_id)
+
+        def rebalance():
+            for _ in range(ops):
+                scheduler.rebalance()
+
+        def time_slices():
+            for _ in range(ops):
+                scheduler.check_time_slices()
+
+        with quiet():
+            elapsed = min(timed(request_release, 3))
+        record(f"scheduler.request_release.queue_{length}", 2 * ops / elapsed, "ops/s", "higher")
+        with quiet():
+            elapsed = min(timed(rebalance, 3))
+        record(f"scheduler.rebalance.queue_{length}", ops / elapsed, "ops/s", "higher")
+        with quiet():
+            elapsed = min(timed(time_slices, 3))
+        record(f"scheduler.check_time_slices.queue_{length}", ops / elapsed, "ops/s", "higher")
+
+
+# --- HTTP hot paths ---
+def bench_http(requests_per_endpoint):
+    print("HTTP (Flask test client):")
+    with quiet():
+        import app as server
+        client = server.app.test_client()
+        client.post('/api/test/start')
+        for room_id in ["101", "102", "103", "104", "105"]:
+            client.post('/api/check_in', json={'room_id': room_id, 'id_card': 'bench', 'name': 'bench'})
+            client.post(f'/api/room/{room_id}/control', json={'power_on': True})
+
+        samples = timed(lambda: client.post('/api/test/tick', json={'seconds': 60}), 10)
+    record("http.tick.simulated_seconds_per_second", 60 / statistics.median(samples), "sim-s/s", "higher")
+    with quiet():
+        samples = timed(lambda: client.post('/api/test/tick', json={'seconds': 3600, 'fast_forward': True}), 5)
+    record("http.tick_fast_forward.simulated_seconds_per_second", 3600 / statistics.median(samples), "sim-s/s", "higher")
+
+    temps = [22.0, 24.0, 26.0]
+    room_ids = ["101", "102", "103", "104", "105"]
+    endpoints = {
+        "control_room": lambda i: client.post(f'/api/room/{room_ids[i % 5]}/control',
+                                              json={'target_temp': temps[i % 3]}),
+        "rooms_control": lambda i: client.post('/api/rooms/control',
+                                               json=[{'room_id': r, 'target_temp': temps[i % 3]} for r in room_ids]),
+        "room_status": lambda i: client.get(f'/api/room/{room_ids[i % 5]}/status'),
+        "rooms_status": lambda i: client.get('/api/rooms/status'),
+        "rooms_list": lambda i: client.get('/api/rooms'),
+        "room_history": lambda i: client.get(f'/api/room/{room_ids[i % 5]}/history?resolution=60'),
+    }
+    for name, call in endpoints.items():
+        samples = []
+        with quiet():
+            for i in range(requests_per_endpoint):
+                start = time.perf_counter()
+                call(i)
+                samples.append(time.perf_counter() - start)
+        record(f"http.{name}.p50", percentile(samples, 50), "s", "lower")
+        record(f"http.{name}.p99", percentile(samples, 99), "s", "lower")
+    with quiet():
+        client.post('/api/test/stop')
+
+
+# --- asyncio serving mode ---
+def bench_asyncio(streams):
+    """在 aio_server 上保持 streams 个 SSE 连接，测量状态查询延迟与一次控制推送到所有连接的耗时"""
+    import asyncio
+    import aio_server
+    print(f"asyncio server ({streams} SSE streams):")
+    try:
+        import resource
+        # 每个连接在本进程中占用两个文件描述符 (客户端与服务端)
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        wanted = 2 * streams + 256
+        if soft < wanted:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (wanted if hard == resource.RLIM_INFINITY else min(hard, wanted), hard))
+    except (ImportError, ValueError, OSError):
+        pass
+    with quiet():
+        import app as server
+        # 房间 101 入住 (http 测试之后已入住则忽略)，控制请求改为与当前不同的目标温度，保证产生增量事件
+        server.app.test_client().post('/api/check_in', json={'room_id': '101', 'id_card': 'bench', 'name': 'bench'})
+        target = 23.0 if server.current_snapshot.rooms['101'].target_temp != 23.0 else 24.0
+        srv = aio_server.AsyncServer(server, hotel.Config.ASYNC_WORKERS)
+        ready = threading.Event()
+        threading.Thread(target=lambda: asyncio.run(srv.serve_forever('127.0.0.1', 0, ready.set)), daemon=True).start()
+        ready.wait()
+
+    async def request(method, path, body=b''):
+        reader, writer = await asyncio.open_connection('127.0.0.1', srv.port)
+        writer.write(f"{method} {path} HTTP/1.1\r\nHost: bench\r\nContent-Type: application/json\r\n"
+                     f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+        data = await reader.read()
+        writer.close()
+        return data
+
+    async def open_stream():
+        reader, writer = await asyncio.open_connection('127.0.0.1', srv.port)
+        writer.write(b"GET /api/stream HTTP/1.1\r\nHost: bench\r\n\r\n")
+        await reader.readuntil(b"\r\n\r\n")
+        await reader.readuntil(b"\n\n")  # snapshot 事件
+        return reader, writer
+
+    async def wait_version(reader, version):
+        while True:
+            event = await reader.readuntil(b"\n\n")
+            for line in event.split(b"\n"):
+                if line.startswith(b"id: ") and int(line[4:]) >= version:
+                    return time.perf_counter()
+
+    async def run():
+        start = time.perf_counter()
+        conns = []
+        for i in range(0, streams, 200):
+            conns += await asyncio.gather(*[open_stream() for _ in range(min(200, streams - i))])
+        connect_seconds = time.perf_counter() - start
+        samples = []
+        for _ in range(200):
+            start = time.perf_counter()
+            await request('GET', '/api/room/101/status')
+            samples.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        await request('POST', '/api/room/101/control', json.dumps({'target_temp': target}).encode())
+        # 控制请求在快照发布之后返回，推送的增量事件版本不小于当前快照
+        version = server.current_snapshot.version
+        done = await asyncio.wait_for(asyncio.gather(*[wait_version(reader, version) for reader, _ in conns]), 60)
+        for _, writer in conns:
+            writer.close()
+        return connect_seconds, samples, max(done) - start
+
+    with quiet():
+        connect_seconds, samples, fanout = asyncio.run(run())
+    record("asyncio.stream_connects_per_second", streams / connect_seconds, "conn/s", "higher")
+    record("asyncio.room_status.p50", percentile(samples, 50), "s", "lower")
+    record("asyncio.room_status.p99", percentile(samples, 99), "s", "lower")
+    record("asyncio.control_fanout_seconds", fanout, "s", "lower")
+
+
+# --- Database ---
+def bench_database(rows):
+    print("database.py writes:")
+    rooms = [f"{1 + i // 100}{i % 100:02d}" for i in range(rows)]
+
+    def batched():
+        database.update_room_states([(room_id, True, "Mid", 25.0, 26.5, 1.25, 60) for room_id in rooms])
+
+    def single():
+        for room_id in rooms[:200]:
+            database.update_room_state(room_id, True, "High", 24.0, 25.5, 2.5, 120)
+
+    def sessions():
+        now = datetime.datetime.now()
+        for room_id in rooms[:200]:
+            database.log_ac_session(room_id, now, now, now, 60, "Mid", 0.5, 1.0)
+
+    elapsed = statistics.median(timed(batched, 5))
+    record("database.update_room_states.rows_per_second", rows / elapsed, "rows/s", "higher")
+    elapsed = statistics.median(timed(single, 3))
+    record("database.update_room_state.rows_per_second", 200 / elapsed, "rows/s", "higher")
+    elapsed = statistics.median(timed(sessions, 3))
+    record("database.log_ac_session.rows_per_second", 200 / elapsed, "rows/s", "higher")
+
+    # 事件日志: 8 个线程并发追加控制事件并等待持久化 (与 update_room_state 逐行写入对比)
+    path = journal.journal_path(database.DB_PATH, 'bench')
+    log = journal.Journal(path, commit_interval=hotel.Config.JOURNAL_COMMIT_INTERVAL)
+    log.start()
+    row = ("101", True, "High", 24.0, 25.5, 2.5, 120)
+
+    def writer():
+        for _ in range(100):
+            log.wait(log.append('control', row))
+
+    threads = [threading.Thread(target=writer) for _ in range(8)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    log.close()
+    os.remove(path)
+    record("journal.durable_events_per_second", 800 / elapsed, "events/s", "higher")
+    record("journal.events_per_commit", log.events_written / max(1, log.commits), "events", "higher")
+
+
+# --- Startup ---
+def bench_startup(sizes):
+    print("Startup phases (seconds):")
+    for count in sizes:
+        tmpdir = tempfile.mkdtemp(prefix='hotel-bench-startup-')
+        database.configure(path=os.path.join(tmpdir, 'startup.db'))
+        with quiet():
+            start = time.perf_counter()
+            database.init_db()
+            migrate = time.perf_counter() - start
+
+        # 所有房间都有保存的状态，1/4 在住 (其中一半点过餐)
+        keys = [(f"{1 + i // 100}{i % 100:02d}", 1 + i // 100) for i in range(count)]
+        database.update_room_states([(room_id, i % 4 == 0, "Mid", 25.0, 26.5, 1.25, 60)
+                                     for i, (room_id, _) in enumerate(keys)])
+        conn = database.get_connection()
+        food = json.dumps([{"name": "bench", "price": 20.0, "count": 1}])
+        with conn:
+            conn.executemany(
+                "INSERT INTO check_ins (room_id, tenant_id, tenant_name, tenant_phone, stay_days, deposit, food_orders) "
+                "VALUES (?, 'bench', 'bench', NULL, 1, 100.0, ?)",
+                [(room_id, food if i % 8 == 0 else '[]') for i, (room_id, _) in enumerate(keys) if i % 4 == 0])
+
+        # 与 app.py 启动时相同: 创建房间与快照期间暂停循环垃圾回收 (上一轮的房间先释放，不计入耗时)
+        rooms = None
+        gc.collect()
+        gc.disable()
+        try:
+            with quiet():
+                start = time.perf_counter()
+                database.init_db()
+                ready = time.perf_counter() - start
+                start = time.perf_counter()
+                rooms = room_service.load_rooms({}, Room, keys)
+                load = time.perf_counter() - start
+                start = time.perf_counter()
+                build_snapshot(rooms, Scheduler(rooms))
+                snapshot = time.perf_counter() - start
+        finally:
+            gc.enable()
+        record(f"startup.migrate_new_db.rooms_{count}", migrate, "s", "lower")
+        record(f"startup.init_db_current.rooms_{count}", ready, "s", "lower")
+        record(f"startup.load_rooms.rooms_{count}", load, "s", "lower")
+        record(f"startup.build_snapshot.rooms_{count}", snapshot, "s", "lower")
+        record(f"startup.total.rooms_{count}", ready + load + snapshot, "s", "lower")
+
+
+# --- Memory ---
+def traced_bytes(build):
+    """build() 创建并保留 (作为返回值) 的对象占用的内存字节数"""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        start = tracemalloc.get_traced_memory()[0]
+        kept = build()
+        used = tracemalloc.get_traced_memory()[0] - start
+    finally:
+        tracemalloc.stop()
+    del kept
+    return used
+
+
+def bench_memory(sizes):
+    print("Memory (bytes per room):")
+    for count in sizes:
+        built = {}
+
+        def build_rooms():
+            # 与 sim_step 相同的房间，模拟几秒使服务中的房间产生分项统计
+            rooms, scheduler = make_rooms(count)
+            with quiet():
+                for _ in range(5):
+                    hotel.run_simulation_step(rooms, scheduler)
+            built['rooms'], built['scheduler'] = rooms, scheduler
+            return rooms, scheduler
+
+        rooms_bytes = traced_bytes(build_rooms)
+        snapshot_bytes = traced_bytes(lambda: build_snapshot(built['rooms'], built['scheduler']))
+        record(f"memory.rooms.rooms_{count}", rooms_bytes / count, "bytes/room", "lower")
+        record(f"memory.snapshot.rooms_{count}", snapshot_bytes / count, "bytes/room", "lower")
+        # 历史曲线缓冲区 (按 Config.HISTORY_MAX_BYTES 确定的点数)
+        capacities = history.plan_capacities(count, hotel.Config.HISTORY_RAW_SECONDS, hotel.Config.HISTORY_MINUTE_POINTS,
+                                              hotel.Config.HISTORY_QUARTER_POINTS, hotel.Config.HISTORY_MAX_BYTES)
+        if capacities is None:
+            print(f"  memory.history.rooms_{count}: history disabled (Config.HISTORY_MAX_BYTES)")
+        else:
+            history_bytes = traced_bytes(lambda: history.HistoryStore(built['rooms'].keys(), *capacities))
+            record(f"memory.history.rooms_{count}", history_bytes / count, "bytes/room", "lower")
+
+
+# --- Baseline comparison ---
+def compare(current, baseline, threshold):
+    """返回 (回归列表, 比较行)，回归即比基准差 threshold 以上 (0.25 = 25%)"""
+    regressions = []
+    lines = []
+    for name, base in sorted(baseline.items()):
+        if name not in current:
+            continue
+        new = current[name]['value']
+        old = base['value']
+        if old <= 0 or new <= 0:
+            continue
+        # 统一换算成 "变慢了多少": >0 表示变差
+        if base['better'] == 'lower':
+            change = new / old - 1
+        else:
+            change = old / new - 1
+        flag = "REGRESSION" if change > threshold else ""
+        lines.append(f"  {name:<48} {old:>12.6g} -> {new:<12.6g} {change:+7.1%} {flag}")
+        if flag:
+            regressions.append(name)
+    return regressions, lines
+
+
+def load_results(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)['results']
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark suite for the AC control backend")
+    parser.add_argument('--quick', action='store_true', help="smaller sizes for a fast run")
+    parser.add_argument('--only', help=f"comma separated subset of {','.join(SUITES)}")
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--baseline', help="baseline JSON to compare against")
+    parser.add_argument('--compare', help="compare this existing result file instead of running")
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help="relative slowdown flagged as regression (default 0.25)")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        current = load_results(args.compare)
+    else:
+        suites = args.only.split(',') if args.only else SUITES
+        unknown = set(suites) - set(SUITES)
+        if unknown:
+            parser.error(f"unknown suites: {', '.join(sorted(unknown))}")
+
+        tmpdir = tempfile.mkdtemp(prefix='hotel-bench-')
+        database.configure(path=os.path.join(tmpdir, 'bench.db'))
+        database.init_db()
+
+        if args.quick:
+            sizes, lengths, http_requests, db_rows, streams = [40, 400, 4000], [10, 100, 1000], 200, 1000, 1000
+        else:
+            sizes, lengths, http_requests, db_rows, streams = [40, 400, 4000, 40000, 100000], [10, 100, 1000, 10000], 1000, 10000, 5000
+
+        if 'sim_step' in suites:
+            bench_sim_step(sizes)
+        if 'scheduler' in suites:
+            bench_scheduler(lengths)
+        if 'http' in suites:
+            bench_http(http_requests)
+        if 'database' in suites:
+            bench_database(db_rows)
+        if 'startup' in suites:
+            bench_startup(sizes)
+        if 'memory' in suites:
+            bench_memory(sizes)
+        if 'asyncio' in suites:
+            bench_asyncio(streams)
+
+        current = results
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({
+                "meta": {
+                    "timestamp": datetime.datetime.now().isoformat(timespec='seconds'),
+                    "python": platform.python_version(),
+                    "platform": platform.platform(),
+                    "quick": args.quick,
+                },
+                "results": results,
+            }, f, indent=2, ensure_ascii=False)
+        print(f"Results written to {args.output}")
+
+    if args.baseline:
+        regressions, lines = compare(current, load_results(args.baseline), args.threshold)
+        print(f"Comparison with {args.baseline} (threshold {args.threshold:.0%}):")
+        print("\n".join(lines))
+        if regressions:
+            print(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+            return 1
+        print("No regressions")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
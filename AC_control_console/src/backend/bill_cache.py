@@ -0,0 +1,108 @@
+import itertools
+import threading
+from collections import OrderedDict
+
+
+class BillCache:
+    """
+    账单相关数据的按房间缓存，结账时反复刷新账单不再重复查询数据库。
+      入住时间: 第一次读取后保存在内存中，入住/退房时 (invalidate) 清除
+      详单: 按房间的 bill_version 缓存 (详单只在控制操作时写入，控制/入住/退房都会增加 bill_version)
+      账单: 调用方给出的 key (bill_version 加上粗粒度的计费进度) 不变时直接返回上次的结果
+    详单与账单按最近使用保留 max_rooms 个房间；详单超过 max_sessions 条的房间不缓存，仍逐批从数据库读取。
+    """
+
+    def __init__(self, load_check_in, iter_sessions, max_rooms=256, max_sessions=5000):
+        # load_check_in(room_id) -> 入住信息 dict 或 None (database.get_room_check_in_info)
+        # iter_sessions(room_id) -> 详单行的迭代器 (database.iter_ac_sessions)
+        self.load_check_in = load_check_in
+        self.iter_sessions = iter_sessions
+        self.max_rooms = max_rooms
+        self.max_sessions = max_sessions
+        self._lock = threading.Lock()
+        self._check_ins = {}
+        self._sessions = OrderedDict()   # room_id -> (bill_version, [row, ...])
+        self._bills = OrderedDict()      # room_id -> (key, 账单)
+        # 每次 invalidate 加一: 读取数据库期间发生过入住/退房的结果不写入缓存
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _remember(self, table, room_id, entry):
+        with self._lock:
+            table[room_id] = entry
+            table.move_to_end(room_id)
+            while len(table) > self.max_rooms:
+                table.popitem(last=False)
+
+    def _lookup(self, table, room_id, key):
+        entry = table.get(room_id)
+        if entry is not None and entry[0] == key:
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        return None
+
+    def check_in(self, room_id):
+        """当前入住信息 (只在第一次或入住/退房后读取数据库)"""
+        if room_id in self._check_ins:
+            return self._check_ins[room_id]
+        generation = self._generation
+        info = self.load_check_in(room_id)
+        with self._lock:
+            if generation == self._generation:
+                self._check_ins[room_id] = info
+        return info
+
+    def check_in_time(self, room_id):
+        info = self.check_in(room_id)
+        return info['check_in_time'] if info else "Unknown"
+
+    def sessions(self, room_id, bill_version):
+        """房间的全部详单 (可迭代)，bill_version 未变化时不再查询数据库"""
+        rows = self._lookup(self._sessions, room_id, bill_version)
+        if rows is not None:
+            return rows
+        source = self.iter_sessions(room_id)
+        rows = list(itertools.islice(source, self.max_sessions + 1))
+        if len(rows) > self.max_sessions:
+            # 详单太多不缓存，剩余的行继续从同一个游标逐批读取
+            return _stream(rows, source)
+        self._remember(self._sessions, room_id, (bill_version, rows))
+        return rows
+
+    def bill(self, room_id, key, build):
+        """key 与上次相同时返回缓存的账单，否则调用 build() 生成并缓存"""
+        bill = self._lookup(self._bills, room_id, key)
+        if bill is None:
+            bill = build()
+            self._remember(self._bills, room_id, (key, bill))
+        return bill
+
+    def invalidate(self, room_id):
+        """入住/退房: 清除该房间缓存的入住信息、详单与账单"""
+        with self._lock:
+            self._generation += 1
+            self._check_ins.pop(room_id, None)
+            self._sessions.pop(room_id, None)
+            self._bills.pop(room_id, None)
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "check_ins": len(self._check_ins),
+            "sessions": len(self._sessions),
+            "bills": len(self._bills),
+        }
+
+
+def _stream(rows, source):
+    """先输出已读取的行，再继续读取 source；读完或被关闭 (下载中断) 时关闭 source 释放数据库连接"""
+    try:
+        yield from rows
+        yield from source
+    finally:
+        close = getattr(source, 'close', None)
+        if close is not None:
+            close()
@@ -0,0 +1,64 @@
+import csv
+import io
+import json
+
+# 详单字段顺序与 database.iter_ac_sessions 返回的行一致
+SESSION_FIELDS = ["request_time", "start_time", "end_time", "duration", "fan_speed", "fee", "total_fee_snapshot"]
+
+# format 参数 -> (mimetype, 文件扩展名)
+EXPORT_FORMATS = {
+    "txt": ("text/plain", "txt"),
+    "csv": ("text/csv", "csv"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+}
+
+# 每次向客户端发送的详单行数
+CHUNK_ROWS = 256
+
+
+def _chunked(lines):
+    """把逐行生成的文本合并成较大的块发送，减少写 socket 的次数"""
+    buf = []
+    for line in lines:
+        buf.append(line)
+        if len(buf) >= CHUNK_ROWS:
+            yield "".join(buf)
+            buf = []
+    if buf:
+        yield "".join(buf)
+
+
+def iter_txt(header_lines, sessions):
+    """固定宽度文本账单: 先输出表头，再逐行输出详单"""
+    yield "".join(header_lines)
+    yield from _chunked(
+        f"{start:<20} | {end:<20} | {dur:<8} | {speed:<5} | {fee:<8.4f} | {total:<8.4f}\n"
+        for _request, start, end, dur, speed, fee, total in sessions
+    )
+
+
+def iter_csv(room_id, sessions):
+    """CSV: 每个详单一行，首行为字段名"""
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator="\n")
+    writer.writerow(["room_id"] + SESSION_FIELDS)
+    yield buf.getvalue()
+
+    def rows():
+        for session in sessions:
+            buf.seek(0)
+            buf.truncate()
+            writer.writerow([room_id, *session])
+            yield buf.getvalue()
+
+    yield from _chunked(rows())
+
+
+def iter_ndjson(room_id, summary, sessions):
+    """NDJSON: 首行为账单汇总 (type=summary)，之后每行一个详单 (type=session)"""
+    yield json.dumps({"type": "summary", "room_id": room_id, **summary}, ensure_ascii=False) + "\n"
+    yield from _chunked(
+        json.dumps({"type": "session", "room_id": room_id, **dict(zip(SESSION_FIELDS, session))},
+                   ensure_ascii=False) + "\n"
+        for session in sessions
+    )
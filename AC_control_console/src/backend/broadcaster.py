@@ -0,0 +1,105 @@
+import json
+import queue
+import threading
+
+# 订阅范围: ('hotel', None) 整栋酒店 / ('floor', 2) 某一层 / ('room', '101') 单个房间
+HOTEL_SCOPE = ('hotel', None)
+
+
+def scope_matches(scope, room_id, floor):
+    kind, value = scope
+    if kind == 'room':
+        return room_id == value
+    if kind == 'floor':
+        return floor == value
+    return True
+
+
+class DeltaEvent:
+    """
+    一次 tick 内所有变化房间的增量事件。
+    每个房间只序列化一次，不同订阅范围的消息体按需拼接并缓存，所有订阅者共享。
+    """
+
+    def __init__(self, version, states, event_type='delta'):
+        # states: [(room_id, floor, state_dict), ...]
+        self.version = version
+        self.event_type = event_type
+        self._fragments = [
+            (room_id, floor, json.dumps(state, ensure_ascii=False))
+            for room_id, floor, state in states
+        ]
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def render(self, scope):
+        """返回该订阅范围的 SSE 消息 (str)，范围内无变化时返回 None"""
+        with self._lock:
+            if scope in self._cache:
+                return self._cache[scope]
+            parts = [frag for room_id, floor, frag in self._fragments
+                     if scope_matches(scope, room_id, floor)]
+            if parts or self.event_type != 'delta':
+                payload = (
+                    f"event: {self.event_type}\n"
+                    f"id: {self.version}\n"
+                    f"data: {{\"version\": {self.version}, \"rooms\": [{', '.join(parts)}]}}\n\n"
+                )
+            else:
+                payload = None
+            self._cache[scope] = payload
+            return payload
+
+
+class Subscription:
+    def __init__(self, scope, max_pending):
+        self.scope = scope
+        self.events = queue.Queue(maxsize=max_pending)
+        # 消费过慢导致丢弃事件后置位，客户端需要重新拉取全量快照
+        self.overflowed = False
+
+    def get(self, timeout):
+        return self.events.get(timeout=timeout)
+
+    def deliver(self, event):
+        """由发布线程调用"""
+        try:
+            self.events.put_nowait(event)
+        except queue.Full:
+            self.overflowed = True
+
+
+class Broadcaster:
+    """
+    房间状态变化的发布/订阅中心 (用于 Server-Sent Events 推送)。
+    订阅者只需实现 deliver(event)；asyncio 服务器以一个订阅者转发给事件循环中的所有连接 (见 aio_server.py)
+    """
+
+    def __init__(self, max_pending=64):
+        self.max_pending = max_pending
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    def subscribe(self, scope=HOTEL_SCOPE):
+        return self.add(Subscription(scope, self.max_pending))
+
+    def add(self, sub):
+        with self._lock:
+            self._subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            self._subscribers.discard(sub)
+
+    def has_subscribers(self):
+        return bool(self._subscribers)
+
+    def subscriber_count(self):
+        return len(self._subscribers)
+
+    def publish(self, event):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for sub in subscribers:
+            sub.deliver(event)
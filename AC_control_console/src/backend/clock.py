@@ -0,0 +1,71 @@
+"""
+时钟: Scheduler 的服务开始时间、空调会话的起止时间 (详单) 都从这里取。
+
+    real        真实时间 (默认)
+    simulated   模拟时间，只随模拟步进前进 (每步 1 秒，/api/test/tick 推进多少秒就前进多少秒)
+    accelerated 模拟时间，后台循环每秒执行 speed 步 (speed 倍速运行，例如 60 倍速 1 天约 24 分钟)
+
+模拟时钟由 Scheduler.check_time_slices / advance_time_slices 推进，
+与温度、费用的逐秒计算完全同步，因此详单中的时长与费用一致。
+测试模式 (/api/test/start 到 /api/test/stop) 期间真实时钟被替换为模拟时钟 (见 simulated_from)。
+"""
+import datetime
+import time
+
+
+class RealClock:
+    # 后台模拟循环的间隔 (真实秒)
+    tick_interval = 1.0
+
+    def time(self):
+        """当前时间戳 (秒)"""
+        return time.time()
+
+    def now(self):
+        """当前时间 (datetime)"""
+        return datetime.datetime.fromtimestamp(self.time())
+
+    def advance(self, seconds):
+        """模拟前进了 seconds 秒 (真实时间不受影响)"""
+        pass
+
+
+class SimulatedClock(RealClock):
+    def __init__(self, start=None, speed=1.0):
+        # start: 起始时间戳，默认当前真实时间
+        self._time = time.time() if start is None else float(start)
+        self.speed = speed
+        self.tick_interval = 1.0 / speed
+
+    def time(self):
+        return self._time
+
+    def advance(self, seconds):
+        self._time += seconds
+
+
+class AcceleratedClock(SimulatedClock):
+    def __init__(self, speed, start=None):
+        if speed <= 0:
+            raise ValueError("Clock speed must be positive")
+        super().__init__(start, speed)
+
+
+def simulated_from(clock):
+    """
+    从 clock 的当前时间开始、只随模拟步进前进的时钟，供测试模式使用:
+    /api/test/tick 推进的秒数计入详单时长。clock 已是模拟时钟时原样返回。
+    """
+    if isinstance(clock, SimulatedClock):
+        return clock
+    return SimulatedClock(start=clock.time())
+
+
+def make_clock(mode='real', speed=1.0, start=None):
+    if mode == 'real':
+        return RealClock()
+    if mode == 'simulated':
+        return SimulatedClock(start)
+    if mode == 'accelerated':
+        return AcceleratedClock(speed, start)
+    raise ValueError(f"Unknown clock mode: {mode}")
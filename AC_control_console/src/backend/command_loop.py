@@ -0,0 +1,115 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class CommandLoop:
+    """
+    单写者循环: 房间与调度队列的所有修改都在这一个线程中执行。
+    请求线程通过 submit() 提交命令并等待结果；循环每秒执行一次 tick，
+    每次 tick 以及每批命令执行完后调用 publish 发布新的只读快照。
+    """
+
+    def __init__(self, tick, publish, interval=1.0):
+        self.tick = tick
+        self.publish = publish
+        self.interval = interval
+        self._commands = queue.Queue()
+        self._thread = None
+        # False: tick 由外部提交 (submit_tick，见 aio_server.py)，循环线程只执行命令
+        self.self_ticking = True
+        self.tick_count = 0
+        self.last_tick_seconds = 0.0
+        # 本次 tick 比计划时刻晚了多少秒 (命令执行或上一次 tick 过长都会造成延迟)
+        self.last_tick_lag = 0.0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, fn, *args):
+        """在循环线程中执行 fn(*args) 并返回其结果 (异常会在调用方重新抛出)"""
+        if threading.current_thread() is self._thread or self._thread is None:
+            # 循环线程内部 (或循环尚未启动) 直接执行，避免自己等待自己
+            return fn(*args)
+        return self.submit_nowait(fn, *args).result()
+
+    def submit_nowait(self, fn, *args):
+        """提交命令，不等待执行，返回 concurrent.futures.Future (可用 asyncio.wrap_future 等待)"""
+        future = Future()
+        self._commands.put((future, fn, args))
+        return future
+
+    def take_over_ticks(self):
+        """此后循环线程不再自行计时，由调用方按 interval 调用 submit_tick (asyncio 服务的 tick 任务)"""
+        self.self_ticking = False
+        # 唤醒正在等待下一次 tick 的循环线程
+        self.submit_nowait(lambda: None)
+
+    def submit_tick(self, lag=0.0):
+        """把一次 tick 作为命令提交 (与同一批命令一起发布快照)，返回 Future"""
+        return self.submit_nowait(self._tick, lag)
+
+    def sync(self):
+        """等待循环发布一次新快照 (用于在其他线程修改状态之后读到最新结果)"""
+        self.submit(lambda: None)
+
+    def pending(self):
+        return self._commands.qsize()
+
+    def _execute(self, command):
+        """执行命令，返回稍后用于通知调用方的 (future, 结果, 异常)"""
+        future, fn, args = command
+        try:
+            return future, fn(*args), None
+        except Exception as e:
+            return future, None, e
+
+    def _publish(self):
+        try:
+            self.publish()
+        except Exception as e:
+            print(f"[CommandLoop] Publish failed: {e}")
+
+    def _tick(self, lag):
+        self.last_tick_lag = lag
+        start = time.perf_counter()
+        try:
+            self.tick()
+        except Exception as e:
+            print(f"[CommandLoop] Tick failed: {e}")
+        self.last_tick_seconds = time.perf_counter() - start
+        self.tick_count += 1
+
+    def _run(self):
+        next_tick = time.monotonic() + self.interval
+        while True:
+            timeout = next_tick - time.monotonic() if self.self_ticking else None
+            if timeout is None or timeout > 0:
+                try:
+                    command = self._commands.get(timeout=timeout)
+                except queue.Empty:
+                    continue
+                # 一次取完已排队的命令，执行后只发布一次；
+                # 快照发布之后才返回结果，调用方随后的查询能看到自己的修改
+                done = [self._execute(command)]
+                while True:
+                    try:
+                        done.append(self._execute(self._commands.get_nowait()))
+                    except queue.Empty:
+                        break
+                self._publish()
+                for future, result, error in done:
+                    if error is not None:
+                        future.set_exception(error)
+                    else:
+                        future.set_result(result)
+                continue
+
+            self._tick(time.monotonic() - next_tick)
+            self._publish()
+            next_tick += self.interval
+            # tick 耗时超过间隔时不追赶，从当前时刻重新计时
+            if next_tick < time.monotonic():
+                next_tick = time.monotonic() + self.interval
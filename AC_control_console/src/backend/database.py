@@ -1,16 +1,147 @@
+import contextlib
 import sqlite3
 import os
+import json
+import threading
+import atexit
+import weakref
+
+import metrics
+import topology
 
 # 数据库文件路径
 DB_PATH = os.path.join(os.path.dirname(__file__), 'hotel.db')
 
-def init_db():
-    """初始化数据库表"""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    
-    # 创建入住记录表
-    # status: 'active' (在住), 'checked_out' (已退房)
+# 连接设置 (可通过环境变量或 configure() 修改)
+DB_SETTINGS = {
+    # WAL 模式下读写互不阻塞，NORMAL 同步级别在 WAL 下仍保证数据库一致性
+    'journal_mode': os.environ.get('HOTEL_DB_JOURNAL_MODE', 'WAL'),
+    'synchronous': os.environ.get('HOTEL_DB_SYNCHRONOUS', 'NORMAL'),
+    # 每个连接缓存的预编译语句数量
+    'cached_statements': int(os.environ.get('HOTEL_DB_CACHED_STATEMENTS', '256')),
+    'busy_timeout_ms': int(os.environ.get('HOTEL_DB_BUSY_TIMEOUT_MS', '5000')),
+}
+
+# 每个公开函数的耗时与异常次数 (GET /metrics)
+DB_CALL_SECONDS = metrics.Histogram('hotel_db_call_seconds', 'Latency of database.py calls', ['function'])
+DB_ERRORS = metrics.Counter('hotel_db_errors_total', 'database.py calls that raised an exception', ['function'])
+_timed = metrics.timed(DB_CALL_SECONDS, DB_ERRORS)
+
+# 每个线程持有一个长连接，避免每次调用都打开/关闭数据库
+_local = threading.local()
+# 只弱引用各线程的连接 (供 close_all 使用)，线程结束时连接随其线程局部数据一起关闭
+_holders = weakref.WeakSet()
+_holders_lock = threading.Lock()
+_generation = 0
+
+def configure(path=None, **settings):
+    """修改数据库路径或连接设置，已打开的连接会被关闭并在下次使用时按新设置重建"""
+    global DB_PATH, _generation
+    if path is not None:
+        DB_PATH = path
+    for key, value in settings.items():
+        if key not in DB_SETTINGS:
+            raise ValueError(f"Unknown database setting: {key}")
+        DB_SETTINGS[key] = value
+    close_all()
+    _generation += 1
+
+def _open_connection():
+    conn = sqlite3.connect(DB_PATH, cached_statements=DB_SETTINGS['cached_statements'],
+                           check_same_thread=False)
+    conn.execute(f"PRAGMA busy_timeout = {int(DB_SETTINGS['busy_timeout_ms'])}")
+    conn.execute(f"PRAGMA journal_mode = {DB_SETTINGS['journal_mode']}")
+    conn.execute(f"PRAGMA synchronous = {DB_SETTINGS['synchronous']}")
+    return conn
+
+class _ThreadConnection:
+    """线程持有的连接: 只被该线程的 _local 强引用，线程结束时被回收并关闭连接"""
+    __slots__ = ('conn', 'generation', '__weakref__')
+
+    def __init__(self, conn, generation):
+        self.conn = conn
+        self.generation = generation
+
+    def close(self):
+        try:
+            self.conn.close()
+        except sqlite3.Error:
+            pass
+
+    def __del__(self):
+        self.close()
+
+def get_connection():
+    """获取当前线程的数据库长连接"""
+    holder = getattr(_local, 'holder', None)
+    if holder is None or holder.generation != _generation:
+        holder = _ThreadConnection(_open_connection(), _generation)
+        _local.holder = holder
+        with _holders_lock:
+            _holders.add(holder)
+    return holder.conn
+
+def close_all():
+    """关闭所有线程的连接 (退出时自动调用)"""
+    with _holders_lock:
+        holders = list(_holders)
+    for holder in holders:
+        holder.close()
+
+atexit.register(close_all)
+
+@contextlib.contextmanager
+def transaction():
+    """
+    把当前线程在 with 块内的写入合并为一个事务 (块结束时提交一次，异常时全部回滚)。
+    嵌套时只有最外层提交。
+    """
+    conn = get_connection()
+    depth = getattr(_local, 'transaction_depth', 0)
+    _local.transaction_depth = depth + 1
+    try:
+        if depth:
+            yield conn
+        else:
+            with conn:
+                yield conn
+    finally:
+        _local.transaction_depth = depth
+
+def _commit(conn):
+    """写入函数的事务范围: 在 transaction() 之内时并入外层事务，否则单独提交"""
+    if getattr(_local, 'transaction_depth', 0):
+        return contextlib.nullcontext()
+    return conn
+
+@contextlib.contextmanager
+def _durable_commit(conn):
+    """
+    单独提交且提交返回时已落盘: WAL + synchronous=NORMAL 下提交只写入 WAL 而不 fsync，掉电可能丢失。
+    事件日志的检查点提交后会截断日志，所以这一次提交临时提高到 FULL。
+    """
+    if getattr(_local, 'transaction_depth', 0):
+        raise RuntimeError("durable commit cannot be nested in transaction()")
+    level = conn.execute('PRAGMA synchronous').fetchone()[0]
+    if level < 2:
+        conn.execute('PRAGMA synchronous = FULL')
+    try:
+        with conn:
+            yield conn
+    finally:
+        if level < 2:
+            conn.execute(f'PRAGMA synchronous = {level}')
+
+# --- Schema migrations ---
+# 按顺序执行，PRAGMA user_version 记录已执行的数量；已是最新版本时启动不再执行任何 DDL。
+# 新的表结构变更只能追加到 MIGRATIONS 末尾，不能修改已发布的迁移。
+
+def _columns(c, table):
+    return {row[1] for row in c.execute(f'PRAGMA table_info({table})')}
+
+def _migrate_base_tables(c):
+    """入住记录、房间状态、空调详单"""
+    # 入住记录表; status: 'active' (在住), 'checked_out' (已退房)
     c.execute('''
         CREATE TABLE IF NOT EXISTS check_ins (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -26,19 +157,14 @@ def init_db():
             food_orders TEXT DEFAULT '[]'
         )
     ''')
-    
-    # 尝试添加新列（如果表已存在但没有这些列）
-    try:
+    # 早期版本创建的表没有押金与餐饮列
+    columns = _columns(c, 'check_ins')
+    if 'deposit' not in columns:
         c.execute('ALTER TABLE check_ins ADD COLUMN deposit REAL DEFAULT 0.0')
-    except sqlite3.OperationalError:
-        pass # 列已存在
-        
-    try:
+    if 'food_orders' not in columns:
         c.execute("ALTER TABLE check_ins ADD COLUMN food_orders TEXT DEFAULT '[]'")
-    except sqlite3.OperationalError:
-        pass # 列已存在
 
-    # 创建房间状态表 (用于保存空调控制信息)
+    # 房间状态表 (用于保存空调控制信息)
     c.execute('''
         CREATE TABLE IF NOT EXISTS room_states (
             room_id TEXT PRIMARY KEY,
@@ -51,7 +177,7 @@ def init_db():
         )
     ''')
 
-    # 创建空调详单表
+    # 空调详单表
     c.execute('''
         CREATE TABLE IF NOT EXISTS ac_sessions (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -65,25 +191,101 @@ def init_db():
             total_fee_snapshot REAL
         )
     ''')
-    
-    conn.commit()
-    conn.close()
-    print(f"Database initialized at {DB_PATH}")
 
+def _migrate_report_rollup(c):
+    """报表汇总表 (只有一行)，随详单和入住记录的写入增量更新"""
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS report_rollup (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            total_stay_fee REAL DEFAULT 0.0,
+            total_ac_fee REAL DEFAULT 0.0,
+            total_food_fee REAL DEFAULT 0.0,
+            total_check_ins INTEGER DEFAULT 0,
+            total_ac_duration INTEGER DEFAULT 0
+        )
+    ''')
+    c.execute('SELECT 1 FROM report_rollup WHERE id = 1')
+    if c.fetchone() is None:
+        # 旧数据库没有汇总数据，从原始记录生成一次
+        _write_report_rollup(c, _compute_report_from_raw(c))
+
+def _migrate_lookup_indexes(c):
+    """启动恢复 (在住记录) 与详单查询使用的索引"""
+    c.execute('CREATE INDEX IF NOT EXISTS idx_check_ins_status_room ON check_ins (status, room_id)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_ac_sessions_room_start ON ac_sessions (room_id, start_time)')
+
+def _migrate_journal_checkpoints(c):
+    """事件日志的检查点: 每个日志 (主进程 main / 各分片 shard-N) 一行，与 room_states 在同一事务中写入"""
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS journal_checkpoints (
+            name TEXT PRIMARY KEY,
+            lsn INTEGER NOT NULL DEFAULT 0,
+            scheduler TEXT
+        )
+    ''')
+
+def _migrate_history_chunks(c):
+    """房间历史曲线的数据块 (history.py): 每个房间、分辨率、对齐的时间窗一行"""
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS history_chunks (
+            room_id TEXT NOT NULL,
+            resolution INTEGER NOT NULL,
+            window_start INTEGER NOT NULL,
+            data BLOB NOT NULL,
+            PRIMARY KEY (room_id, resolution, window_start)
+        ) WITHOUT ROWID
+    ''')
+
+MIGRATIONS = [
+    _migrate_base_tables,
+    _migrate_report_rollup,
+    _migrate_lookup_indexes,
+    _migrate_journal_checkpoints,
+    _migrate_history_chunks,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+def get_schema_version():
+    return get_connection().execute('PRAGMA user_version').fetchone()[0]
+
+@_timed
+def init_db():
+    """按 PRAGMA user_version 执行尚未执行的迁移，返回执行的迁移数量"""
+    conn = get_connection()
+    version = get_schema_version()
+    if version > SCHEMA_VERSION:
+        raise RuntimeError(f"Database schema version {version} is newer than this program ({SCHEMA_VERSION})")
+    for index in range(version, SCHEMA_VERSION):
+        migration = MIGRATIONS[index]
+        with conn:
+            c = conn.cursor()
+            migration(c)
+            c.execute(f'PRAGMA user_version = {index + 1}')
+        print(f"[Database] Migration {index + 1} ({migration.__name__}) applied")
+
+    print(f"Database initialized at {DB_PATH} (schema version {SCHEMA_VERSION})")
+    return SCHEMA_VERSION - version
+
+@_timed
 def log_ac_session(room_id, request_time, start_time, end_time, duration, fan_speed, fee, total_fee_snapshot):
     """记录一次空调使用会话"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection()
     c = conn.cursor()
-    c.execute('''
-        INSERT INTO ac_sessions (room_id, request_time, start_time, end_time, duration, fan_speed, fee, total_fee_snapshot)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (room_id, request_time, start_time, end_time, duration, fan_speed, fee, total_fee_snapshot))
-    conn.commit()
-    conn.close()
+    with _commit(conn):
+        c.execute('''
+            INSERT INTO ac_sessions (room_id, request_time, start_time, end_time, duration, fan_speed, fee, total_fee_snapshot)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (room_id, request_time, start_time, end_time, duration, fan_speed, fee, total_fee_snapshot))
+        c.execute('''
+            UPDATE report_rollup
+            SET total_ac_fee = total_ac_fee + ?, total_ac_duration = total_ac_duration + ?
+            WHERE id = 1
+        ''', (fee, duration))
 
+@_timed
 def get_ac_sessions(room_id):
     """获取房间的所有空调详单"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection()
     c = conn.cursor()
     c.execute('''
         SELECT request_time, start_time, end_time, duration, fan_speed, fee, total_fee_snapshot
@@ -92,45 +294,75 @@ def get_ac_sessions(room_id):
         ORDER BY start_time ASC
     ''', (room_id,))
     rows = c.fetchall()
-    conn.close()
     return rows
 
+@_timed
+def iter_ac_sessions(room_id, batch_size=500):
+    """
+    逐批读取房间的空调详单 (生成器)，导出长账单时不必一次性载入内存。
+    使用自己的连接而不是线程长连接: 生成器可能在另一个线程上被继续读取 (asyncio 模式的线程池)，
+    迭代结束或生成器被关闭 (下载中断) 时关闭连接。
+    """
+    conn = _open_connection()
+    try:
+        c = conn.execute('''
+            SELECT request_time, start_time, end_time, duration, fan_speed, fee, total_fee_snapshot
+            FROM ac_sessions
+            WHERE room_id = ?
+            ORDER BY start_time ASC
+        ''', (room_id,))
+        while True:
+            rows = c.fetchmany(batch_size)
+            if not rows:
+                break
+            yield from rows
+    finally:
+        conn.close()
+
+@_timed
 def add_check_in(room_id, tenant_id, name, phone, days, deposit=0.0, food_orders='[]'):
     """添加入住记录"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection()
     c = conn.cursor()
+    with _commit(conn):
     
-    # 先把该房间之前的 active 记录标记为 checked_out (防止异常状态)
-    c.execute('''
-        UPDATE check_ins 
-        SET status = 'checked_out', check_out_time = CURRENT_TIMESTAMP
-        WHERE room_id = ? AND status = 'active'
-    ''', (room_id,))
+        # 先把该房间之前的 active 记录标记为 checked_out (防止异常状态)
+        c.execute('''
+            UPDATE check_ins 
+            SET status = 'checked_out', check_out_time = CURRENT_TIMESTAMP
+            WHERE room_id = ? AND status = 'active'
+        ''', (room_id,))
     
-    # 插入新记录
-    c.execute('''
-        INSERT INTO check_ins (room_id, tenant_id, tenant_name, tenant_phone, stay_days, status, deposit, food_orders)
-        VALUES (?, ?, ?, ?, ?, 'active', ?, ?)
-    ''', (room_id, tenant_id, name, phone, days, deposit, food_orders))
+        # 插入新记录
+        c.execute('''
+            INSERT INTO check_ins (room_id, tenant_id, tenant_name, tenant_phone, stay_days, status, deposit, food_orders)
+            VALUES (?, ?, ?, ?, ?, 'active', ?, ?)
+        ''', (room_id, tenant_id, name, phone, days, deposit, food_orders))
+        c.execute('''
+            UPDATE report_rollup
+            SET total_check_ins = total_check_ins + 1,
+                total_stay_fee = total_stay_fee + ?,
+                total_food_fee = total_food_fee + ?
+            WHERE id = 1
+        ''', (_stay_fee(room_id, days), _food_fee(food_orders)))
     
-    conn.commit()
-    conn.close()
 
+@_timed
 def check_out_db(room_id):
     """办理退房"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection()
     c = conn.cursor()
-    c.execute('''
-        UPDATE check_ins 
-        SET status = 'checked_out', check_out_time = CURRENT_TIMESTAMP
-        WHERE room_id = ? AND status = 'active'
-    ''', (room_id,))
-    conn.commit()
-    conn.close()
+    with _commit(conn):
+        c.execute('''
+            UPDATE check_ins 
+            SET status = 'checked_out', check_out_time = CURRENT_TIMESTAMP
+            WHERE room_id = ? AND status = 'active'
+        ''', (room_id,))
 
+@_timed
 def get_active_check_ins():
     """获取所有当前在住的记录，用于系统启动时恢复状态"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection()
     c = conn.cursor()
     c.execute('''
         SELECT room_id, tenant_id, tenant_name, tenant_phone, stay_days, deposit, food_orders
@@ -138,7 +370,6 @@ def get_active_check_ins():
         WHERE status = 'active'
     ''')
     rows = c.fetchall()
-    conn.close()
     
     # 转换为字典格式: {room_id: {data...}}
     result = {}
@@ -153,9 +384,10 @@ def get_active_check_ins():
         }
     return result
 
+@_timed
 def get_room_check_in_info(room_id):
     """获取指定房间的当前入住信息"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection()
     c = conn.cursor()
     c.execute('''
         SELECT check_in_time, stay_days, deposit, food_orders
@@ -163,7 +395,6 @@ def get_room_check_in_info(room_id):
         WHERE room_id = ? AND status = 'active'
     ''', (room_id,))
     row = c.fetchone()
-    conn.close()
     
     if row:
         return {
@@ -174,43 +405,102 @@ def get_room_check_in_info(room_id):
         }
     return None
 
+@_timed
 def update_stay_days(room_id, days):
     """更新入住天数"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection()
     c = conn.cursor()
-    c.execute('''
-        UPDATE check_ins 
-        SET stay_days = ?
-        WHERE room_id = ? AND status = 'active'
-    ''', (days, room_id))
-    conn.commit()
-    conn.close()
+    with _commit(conn):
+        c.execute('''
+            SELECT stay_days FROM check_ins
+            WHERE room_id = ? AND status = 'active'
+        ''', (room_id,))
+        old_days = [row[0] for row in c.fetchall()]
+        c.execute('''
+            UPDATE check_ins 
+            SET stay_days = ?
+            WHERE room_id = ? AND status = 'active'
+        ''', (days, room_id))
+        delta = sum(_stay_fee(room_id, days) - _stay_fee(room_id, old) for old in old_days)
+        if delta:
+            c.execute('UPDATE report_rollup SET total_stay_fee = total_stay_fee + ? WHERE id = 1', (delta,))
 
 def update_room_state(room_id, power_on, fan_speed, target_temp, current_temp, total_fee, duration):
-    """更新房间空调状态"""
-    conn = sqlite3.connect(DB_PATH)
+    """更新房间空调状态 (耗时计入 update_room_states)"""
+    update_room_states([(room_id, power_on, fan_speed, target_temp, current_temp, total_fee, duration)])
+
+@_timed
+def update_room_states(rows, checkpoint=None):
+    """
+    批量更新房间空调状态，所有行在同一个事务中写入 (只提交一次)。
+    checkpoint: (日志名, lsn, 调度队列状态)，与状态行一起写入事件日志的检查点 (见 persister.py)；
+    带检查点时单独提交并在返回前落盘，调用方随后会截断日志
+    """
+    conn = get_connection()
     c = conn.cursor()
-    c.execute('''
-        INSERT INTO room_states (room_id, power_on, fan_speed, target_temp, current_temp, total_fee, duration)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-        ON CONFLICT(room_id) DO UPDATE SET
-            power_on=excluded.power_on,
-            fan_speed=excluded.fan_speed,
-            target_temp=excluded.target_temp,
-            current_temp=excluded.current_temp,
-            total_fee=excluded.total_fee,
-            duration=excluded.duration
-    ''', (room_id, int(power_on), fan_speed, target_temp, current_temp, total_fee, duration))
-    conn.commit()
-    conn.close()
+    with _commit(conn) if checkpoint is None else _durable_commit(conn):
+        if checkpoint is not None:
+            name, lsn, scheduler_state = checkpoint
+            c.execute('''
+                INSERT INTO journal_checkpoints (name, lsn, scheduler) VALUES (?, ?, ?)
+                ON CONFLICT(name) DO UPDATE SET lsn=excluded.lsn, scheduler=excluded.scheduler
+            ''', (name, lsn, json.dumps(scheduler_state) if scheduler_state is not None else None))
+        c.executemany('''
+            INSERT INTO room_states (room_id, power_on, fan_speed, target_temp, current_temp, total_fee, duration)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(room_id) DO UPDATE SET
+                power_on=excluded.power_on,
+                fan_speed=excluded.fan_speed,
+                target_temp=excluded.target_temp,
+                current_temp=excluded.current_temp,
+                total_fee=excluded.total_fee,
+                duration=excluded.duration
+        ''', [(room_id, int(power_on), fan_speed, target_temp, current_temp, total_fee, duration)
+              for room_id, power_on, fan_speed, target_temp, current_temp, total_fee, duration in rows])
+
+@_timed
+def load_checkpoint(name):
+    """事件日志 name 的检查点 (lsn, 调度队列状态 或 None)，没有检查点时为 (0, None)"""
+    row = get_connection().execute('SELECT lsn, scheduler FROM journal_checkpoints WHERE name = ?',
+                                   (name,)).fetchone()
+    if row is None:
+        return 0, None
+    return row[0], json.loads(row[1]) if row[1] else None
+
+@_timed
+def write_history_chunks(rows):
+    """写入历史曲线数据块 [(room_id, resolution, window_start, data), ...] (同一时间窗的旧数据块被替换)"""
+    conn = get_connection()
+    with _commit(conn):
+        conn.executemany('''
+            INSERT OR REPLACE INTO history_chunks (room_id, resolution, window_start, data)
+            VALUES (?, ?, ?, ?)
+        ''', rows)
+
+@_timed
+def load_history_chunks(room_id, resolution, start, stop):
+    """房间在 window_start 属于 [start, stop] 的历史曲线数据块 [(window_start, data), ...]"""
+    return get_connection().execute('''
+        SELECT window_start, data FROM history_chunks
+        WHERE room_id = ? AND resolution = ? AND window_start BETWEEN ? AND ?
+        ORDER BY window_start
+    ''', (room_id, resolution, start, stop)).fetchall()
+
+@_timed
+def load_history_chunk(room_id, resolution, window_start):
+    """一个时间窗的数据块 (没有时为 None)"""
+    row = get_connection().execute(
+        'SELECT data FROM history_chunks WHERE room_id = ? AND resolution = ? AND window_start = ?',
+        (room_id, resolution, window_start)).fetchone()
+    return row[0] if row else None
 
+@_timed
 def get_all_room_states():
     """获取所有房间的空调状态"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection()
     c = conn.cursor()
     c.execute('SELECT * FROM room_states')
     rows = c.fetchall()
-    conn.close()
     
     result = {}
     for row in rows:
@@ -225,11 +515,58 @@ def get_all_room_states():
         }
     return result
 
-def get_report_data():
-    """获取统计报表数据"""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    
+@_timed
+def load_room_restore_rows():
+    """
+    启动恢复用的两次整表读取 (在同一个读事务中，两者是同一时刻的数据):
+    (保存的空调状态行 [(room_id, power_on, fan_speed, target_temp, current_temp, total_fee, duration), ...],
+     在住记录 [(room_id, tenant_id, tenant_name, tenant_phone, stay_days, deposit, food_orders), ...])。
+    同一房间有多条在住记录时 (按索引 (status, room_id) 及写入顺序) 依次返回，
+    后面的覆盖前面的，与 get_active_check_ins 一致。
+    分开读取比 LEFT JOIN 的单次查询快: 不必为每个房间做一次索引查找，也不必创建一半为 NULL 的宽行。
+    """
+    conn = get_connection()
+    own = not conn.in_transaction
+    if own:
+        conn.execute('BEGIN')
+    try:
+        states = conn.execute('''
+            SELECT room_id, power_on, fan_speed, target_temp, current_temp, total_fee, duration
+            FROM room_states
+        ''').fetchall()
+        check_ins = conn.execute('''
+            SELECT room_id, tenant_id, tenant_name, tenant_phone, stay_days, deposit, food_orders
+            FROM check_ins
+            WHERE status = 'active'
+        ''').fetchall()
+    finally:
+        if own:
+            conn.commit()
+    return states, check_ins
+
+def _room_price(room_id):
+    """房价 (见拓扑文件中的房型)"""
+    # 注意：check_ins 表中没有记录当时的房价，按当前拓扑中的房型计算
+    return topology.current().room_type(room_id).price
+
+def _stay_fee(room_id, days):
+    try:
+        return _room_price(room_id) * (days if days else 0)
+    except:
+        return 0.0
+
+def _food_fee(food_orders):
+    total = 0.0
+    if food_orders:
+        try:
+            for item in json.loads(food_orders):
+                total += item.get('price', 0) * item.get('count', 0)
+        except:
+            pass
+    return total
+
+def _compute_report_from_raw(c):
+    """从原始详单和入住记录完整计算报表 (用于生成和校验汇总表)"""
     # 1. 统计空调总费用和总时长
     c.execute('SELECT SUM(fee), SUM(duration) FROM ac_sessions')
     ac_row = c.fetchone()
@@ -237,47 +574,44 @@ def get_report_data():
     total_ac_duration = ac_row[1] if ac_row[1] else 0
     
     # 2. 统计入住记录相关 (房费、餐饮费)
-    # 注意：这里需要一些逻辑来计算房费，因为房价可能因房间而异。
-    # 为简化，我们假设标准间220，豪华间350。
-    # 更好的做法是在 check_ins 表中记录当时的房价，但现在我们只能估算或关联查询。
-    # 我们先获取所有 check_ins 记录
     c.execute('SELECT room_id, stay_days, food_orders FROM check_ins')
     rows = c.fetchall()
     
     total_stay_fee = 0.0
     total_food_fee = 0.0
-    total_check_ins = len(rows)
-    
-    import json
+    for r_id, days, f_orders in rows:
+        total_stay_fee += _stay_fee(r_id, days)
+        total_food_fee += _food_fee(f_orders)
     
-    for row in rows:
-        r_id = row[0]
-        days = row[1] if row[1] else 0
-        f_orders = row[2]
-        
-        # 估算房费
-        # 简单逻辑：楼层1且房号>8为豪华(350)，否则标准(220)
-        # 房间ID格式 "101", "205"
-        try:
-            floor = int(r_id[0])
-            num = int(r_id[-2:])
-            price = 220.0
-            if floor == 1 and num > 8:
-                price = 350.0
-            total_stay_fee += price * days
-        except:
-            pass
-            
-        # 计算餐饮费
-        if f_orders:
-            try:
-                orders = json.loads(f_orders)
-                for item in orders:
-                    total_food_fee += item.get('price', 0) * item.get('count', 0)
-            except:
-                pass
-
-    conn.close()
+    return {
+        "total_income": total_stay_fee + total_ac_fee + total_food_fee,
+        "total_stay_fee": total_stay_fee,
+        "total_ac_fee": total_ac_fee,
+        "total_food_fee": total_food_fee,
+        "total_check_ins": len(rows),
+        "total_ac_duration": total_ac_duration
+    }
+
+def _write_report_rollup(c, report):
+    c.execute('''
+        INSERT OR REPLACE INTO report_rollup (id, total_stay_fee, total_ac_fee, total_food_fee, total_check_ins, total_ac_duration)
+        VALUES (1, ?, ?, ?, ?, ?)
+    ''', (report['total_stay_fee'], report['total_ac_fee'], report['total_food_fee'],
+          report['total_check_ins'], report['total_ac_duration']))
+
+@_timed
+def get_report_data():
+    """获取统计报表数据 (读取增量维护的汇总表)"""
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute('''
+        SELECT total_stay_fee, total_ac_fee, total_food_fee, total_check_ins, total_ac_duration
+        FROM report_rollup WHERE id = 1
+    ''')
+    row = c.fetchone()
+    if row is None:
+        return rebuild_report_rollup()
+    total_stay_fee, total_ac_fee, total_food_fee, total_check_ins, total_ac_duration = row
     
     return {
         "total_income": total_stay_fee + total_ac_fee + total_food_fee,
@@ -287,3 +621,34 @@ def get_report_data():
         "total_check_ins": total_check_ins,
         "total_ac_duration": total_ac_duration
     }
+
+@_timed
+def rebuild_report_rollup():
+    """从原始记录重新生成汇总表，返回重新计算的报表"""
+    conn = get_connection()
+    c = conn.cursor()
+    with conn:
+        report = _compute_report_from_raw(c)
+        _write_report_rollup(c, report)
+    return report
+
+@_timed
+def check_report_rollup(repair=False, tolerance=1e-6):
+    """
+    校验汇总表与原始记录是否一致。
+    repair=True 时若不一致则用原始记录重新生成汇总表。
+    """
+    conn = get_connection()
+    c = conn.cursor()
+    rollup = get_report_data()
+    raw = _compute_report_from_raw(c)
+    mismatched = [key for key in raw if abs(raw[key] - rollup[key]) > tolerance]
+    if mismatched and repair:
+        rebuild_report_rollup()
+    return {
+        "consistent": not mismatched,
+        "mismatched": mismatched,
+        "rollup": rollup,
+        "raw": raw,
+        "repaired": bool(mismatched and repair)
+    }
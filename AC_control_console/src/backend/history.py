@@ -0,0 +1,349 @@
+"""
+房间温度与累计费用的历史曲线 (时间序列)。
+
+每个房间按三级分辨率保存在内存中的环形缓冲区 (array 模块，float32):
+    1 秒     最近 raw_seconds 个点      每次模拟步进之后记录一次 (record)
+    1 分钟   最近 minute_points 个点    跨过整分钟时由上一分钟的 1 秒数据压缩得到
+    15 分钟  最近 quarter_points 个点   跨过整 15 分钟时由 1 分钟数据压缩得到
+压缩后的点取区间内温度的平均值与区间末尾的累计费用。所有房间在同一时刻一起记录，
+每一层按时刻分行 (一行为所有房间的值)，时间轴由所有房间共用，每个房间每个点占 8 字节。
+各层的点数由 plan_capacities 按内存预算确定，房间过多、最少的点数也放不下时不记录历史。
+
+record 在命令循环线程中只写入一行 1 秒数据；压缩、按时间窗编码数据块与写入数据库都在后台线程中进行，
+读取的是已经结束、不再变化的区间，因此跨过整分钟 / 时间窗的那一秒不会让模拟步进变慢。
+1 分钟与 15 分钟两层按对齐的时间窗 (1 小时 / 1 天) 写入数据库的 history_chunks 表，
+每个房间每个时间窗一行紧凑的二进制数据 (见 encode_chunk)；
+内存中已经滚出 (或重启前) 的时间段从这些数据块读取。
+查询先二分定位起点，只遍历要返回的点，耗时与返回的点数成正比，与原始采样数无关。
+"""
+import queue
+import struct
+import sys
+import threading
+from array import array
+
+RESOLUTIONS = (1, 60, 900)
+# 写入数据库的时间窗 (秒): 1 分钟层每小时一块，15 分钟层每天一块
+WINDOWS = {60: 3600, 900: 86400}
+# 各层最少的点数: 1 秒层保留 2 分钟 (后台线程压缩上一分钟时这些点还不会被覆盖)，
+# 1 分钟 / 15 分钟层至少容纳一个完整的时间窗
+MIN_POINTS = {1: 120, 60: 60, 900: 96}
+# 每个房间每个点的字节数 (温度 + 费用，float32)；每个点另有 8 字节的时间
+POINT_BYTES = 8
+
+_HEADER = struct.Struct('<H')
+
+
+def plan_capacities(room_count, raw_seconds, minute_points, quarter_points, max_bytes):
+    """
+    按内存预算 max_bytes 确定三层的点数 (raw, minute, quarter): 超出预算时先减少 1 秒层、再减少 1 分钟层
+    (不少于 MIN_POINTS)；最少的点数也超出预算时返回 None (不记录历史)
+    """
+    points = [max(p, MIN_POINTS[r]) for r, p in zip(RESOLUTIONS, (raw_seconds, minute_points, quarter_points))]
+    budget = max_bytes // (POINT_BYTES * max(1, room_count) + 8)
+    for level in (0, 1):
+        excess = sum(points) - budget
+        if excess > 0:
+            points[level] = max(MIN_POINTS[RESOLUTIONS[level]], points[level] - excess)
+    if sum(points) > budget:
+        return None
+    return tuple(points)
+
+
+def encode_chunk(offsets, temps, fees):
+    """一个房间一个时间窗的数据块: 点数 (uint16) + 窗口内的槽位偏移 (uint16) + 温度 / 费用 (float32)，小端序"""
+    columns = [array('H', offsets), array('f', temps), array('f', fees)]
+    if sys.byteorder == 'big':
+        for column in columns:
+            column.byteswap()
+    return _HEADER.pack(len(offsets)) + b''.join(column.tobytes() for column in columns)
+
+
+def decode_chunk(data):
+    """encode_chunk 的逆操作，返回 (offsets, temps, fees) 三个 array"""
+    count, = _HEADER.unpack_from(data)
+    columns = []
+    pos = _HEADER.size
+    for typecode in ('H', 'f', 'f'):
+        column = array(typecode)
+        size = count * column.itemsize
+        column.frombytes(data[pos:pos + size])
+        pos += size
+        if sys.byteorder == 'big':
+            column.byteswap()
+        columns.append(column)
+    return tuple(columns)
+
+
+def merge_chunks(old, new):
+    """合并同一时间窗的两个数据块 (重启前写入的部分数据块)，相同槽位以 new 为准"""
+    points = {}
+    for data in (old, new):
+        offsets, temps, fees = decode_chunk(data)
+        for offset, temp, fee in zip(offsets, temps, fees):
+            points[offset] = (temp, fee)
+    offsets = sorted(points)
+    return encode_chunk(offsets, [points[o][0] for o in offsets], [points[o][1] for o in offsets])
+
+
+class Tier:
+    """
+    一个分辨率的环形缓冲区。times 为各槽位的时间 (秒，所有房间共用)；
+    temps / fees 按槽位分行，槽位 s 的房间 i 在 s * rooms + i。
+    逻辑下标 n (第 n 个写入的点) 位于槽位 n % capacity，保留最近 capacity 个点。
+    """
+
+    def __init__(self, resolution, capacity, room_count):
+        self.resolution = resolution
+        self.capacity = capacity
+        self.rooms = room_count
+        self.window = WINDOWS.get(resolution)
+        self.times = array('q', bytes(8 * capacity))
+        self.temps = array('f', bytes(4 * capacity * room_count))
+        self.fees = array('f', bytes(4 * capacity * room_count))
+        self.count = 0
+        # 本进程写入的第一个时间窗 (可能与重启前写入数据库的部分数据块重叠，写入时需要合并)
+        self.first_window = None
+
+    def first(self):
+        """最早仍在缓冲区中的点的逻辑下标"""
+        return max(0, self.count - self.capacity)
+
+    def last_time(self):
+        return self.times[(self.count - 1) % self.capacity] if self.count else None
+
+    def oldest_time(self):
+        return self.times[self.first() % self.capacity] if self.count else None
+
+    def locate(self, t):
+        """第一个时间不早于 t 的点的逻辑下标 (二分查找)"""
+        lo, hi = self.first(), self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.times[mid % self.capacity] < t:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def append(self, t, temps, fees):
+        """追加时刻 t 的一行 (temps / fees 为按房间排列的 array('f'))"""
+        self.times[self.count % self.capacity] = t
+        self.count += 1
+        self.write_last(temps, fees)
+        if self.first_window is None and self.window:
+            self.first_window = t - t % self.window
+
+    def write_last(self, temps, fees):
+        """覆盖最后一行"""
+        base = (self.count - 1) % self.capacity * self.rooms
+        self.temps[base:base + self.rooms] = temps
+        self.fees[base:base + self.rooms] = fees
+
+    def row(self, values, n):
+        """逻辑下标 n 的一行 (所有房间)"""
+        base = n % self.capacity * self.rooms
+        return values[base:base + self.rooms]
+
+    def column(self, values, room, start, stop):
+        """房间 room 逻辑下标 [start, stop) 的值 (环形缓冲区中可能分为两段)"""
+        if stop <= start:
+            return values[:0]
+        a, b = start % self.capacity, (stop - 1) % self.capacity + 1
+        step = self.rooms
+        if a < b:
+            return values[a * step + room:(b - 1) * step + room + 1:step]
+        return values[a * step + room::step] + values[room:(b - 1) * step + room + 1:step]
+
+    def nbytes(self):
+        return sum(len(buf) * buf.itemsize for buf in (self.times, self.temps, self.fees))
+
+
+class HistoryStore:
+    """
+    所有房间的历史曲线。record 在命令循环线程调用，query 可在任意线程调用；
+    压缩与写入数据库由 start() 启动的后台线程执行 (未启动时在 record 中直接执行)
+    """
+
+    def __init__(self, room_ids, raw_seconds=900, minute_points=360, quarter_points=96,
+                 write_chunks=None, load_chunks=None, load_chunk=None):
+        # write_chunks([(room_id, resolution, window_start, data), ...]) / load_chunks(room_id, resolution, start, stop)
+        # / load_chunk(room_id, resolution, window_start)，见 database.py；为 None 时不写入数据库
+        self.room_ids = list(room_ids)
+        self.index = {room_id: i for i, room_id in enumerate(self.room_ids)}
+        count = len(self.room_ids)
+        self.tiers = (Tier(1, raw_seconds, count), Tier(60, minute_points, count), Tier(900, quarter_points, count))
+        self.by_resolution = {tier.resolution: tier for tier in self.tiers}
+        self.write_chunks = write_chunks
+        self.load_chunks = load_chunks
+        self.load_chunk = load_chunk
+        self._lock = threading.Lock()
+        self._jobs = queue.Queue()
+        self._thread = None
+        self.samples = 0
+        self.chunks_written = 0
+        # 后台线程来不及压缩、已被新的点覆盖而丢弃的区间数
+        self.dropped = 0
+
+    def record(self, t, rooms):
+        """记录所有房间 (rooms 包含构造时给出的全部房间) 在时刻 t (秒) 的温度与累计费用"""
+        second = int(t)
+        temps = array('f', [rooms[room_id].current_temp for room_id in self.room_ids])
+        fees = array('f', [rooms[room_id].total_fee for room_id in self.room_ids])
+        finished = None
+        with self._lock:
+            raw = self.tiers[0]
+            last = raw.last_time()
+            if last is None or second > last:
+                if last is not None and second // 60 != last // 60:
+                    finished = last - last % 60
+                raw.append(second, temps, fees)
+            elif second == last:
+                # 同一秒内的多次步进 (真实时钟下的测试快进) 只保留最后一次
+                raw.write_last(temps, fees)
+            else:
+                return
+            self.samples += 1
+        if finished is not None:
+            # 上一分钟已经结束，由后台线程压缩
+            self._submit(('compact', 0, finished))
+
+    def _submit(self, job):
+        if self._thread is None:
+            self._process(job)
+        else:
+            self._jobs.put(job)
+
+    def _process(self, job):
+        if job[0] == 'compact':
+            self._compact(job[1], job[2])
+        elif job[0] == 'flush':
+            for tier in self.tiers:
+                last = tier.last_time()
+                if tier.window and last is not None:
+                    self._write_window(tier, last - last % tier.window)
+
+    # 以下在后台线程执行。1 分钟 / 15 分钟层只由后台线程写入，1 秒层只读取已经结束的区间
+
+    def _compact(self, level, bucket):
+        """把第 level 层时间落在 [bucket, bucket + 上层分辨率) 的点压缩为上一层的一个点"""
+        src = self.tiers[level]
+        with self._lock:
+            start, stop = src.locate(bucket), src.locate(bucket + self.tiers[level + 1].resolution)
+        if start == stop:
+            return
+        count = stop - start
+        rows = [src.row(src.temps, n) for n in range(start, stop)]
+        temps = array('f', [sum(column) / count for column in zip(*rows)])
+        fees = src.row(src.fees, stop - 1)
+        with self._lock:
+            overwritten = src.first() > start
+        if overwritten:
+            self.dropped += 1
+            print(f"[History] Interval at {bucket} overwritten before compaction, dropped")
+            return
+        self._append(level + 1, bucket, temps, fees)
+
+    def _append(self, level, t, temps, fees):
+        """在第 level 层追加时刻 t 的一行: 先把上一个区间压缩到下一层，时间窗结束时写入数据库"""
+        tier = self.tiers[level]
+        last = tier.last_time()
+        if last is not None:
+            if level + 1 < len(self.tiers):
+                upper = self.tiers[level + 1].resolution
+                if t // upper != last // upper:
+                    self._compact(level, last - last % upper)
+            if tier.window and t // tier.window != last // tier.window:
+                self._write_window(tier, last - last % tier.window)
+        with self._lock:
+            tier.append(t, temps, fees)
+
+    def _write_window(self, tier, window_start):
+        """把 tier 中一个时间窗的点编码为每个房间一个数据块并写入数据库"""
+        if self.write_chunks is None:
+            return
+        start, stop = tier.locate(window_start), tier.locate(window_start + tier.window)
+        if start == stop:
+            return
+        offsets = [(tier.times[n % tier.capacity] - window_start) // tier.resolution for n in range(start, stop)]
+        rows = [(room_id, tier.resolution, window_start,
+                 encode_chunk(offsets, tier.column(tier.temps, i, start, stop), tier.column(tier.fees, i, start, stop)))
+                for i, room_id in enumerate(self.room_ids)]
+        try:
+            if window_start == tier.first_window and self.load_chunk is not None:
+                # 本进程的第一个时间窗可能在重启前已写入了一部分
+                merged = []
+                for room_id, resolution, start_time, data in rows:
+                    old = self.load_chunk(room_id, resolution, start_time)
+                    merged.append((room_id, resolution, start_time,
+                                   merge_chunks(old, data) if old is not None else data))
+                rows = merged
+            self.write_chunks(rows)
+            self.chunks_written += len(rows)
+        except Exception as e:
+            print(f"[History] Writing {len(rows)} chunks failed: {e}")
+
+    def query(self, room_id, start, stop, resolution):
+        """房间在 [start, stop] (秒) 内的点 [(t, 温度, 累计费用), ...]，resolution 为 1 / 60 / 900"""
+        tier = self.by_resolution[resolution]
+        i = self.index[room_id]
+        with self._lock:
+            oldest = tier.oldest_time()
+            a, b = tier.locate(start), tier.locate(int(stop) + 1)
+            times = [tier.times[n % tier.capacity] for n in range(a, b)]
+            points = list(zip(times, tier.column(tier.temps, i, a, b), tier.column(tier.fees, i, a, b)))
+        if tier.window and self.load_chunks is not None and (oldest is None or start < oldest):
+            # 内存中没有的更早部分从数据库读取
+            upto = stop if oldest is None else min(stop, oldest - 1)
+            points = self._stored(room_id, tier, start, upto) + points
+        return points
+
+    def _stored(self, room_id, tier, start, stop):
+        points = []
+        first_window = int(start) - int(start) % tier.window
+        for window_start, data in self.load_chunks(room_id, tier.resolution, first_window, stop):
+            offsets, temps, fees = decode_chunk(data)
+            for offset, temp, fee in zip(offsets, temps, fees):
+                t = window_start + offset * tier.resolution
+                if start <= t <= stop:
+                    points.append((t, temp, fee))
+        return points
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """写入尚未结束的时间窗 (部分数据块) 并停止后台线程 (退出时调用)"""
+        self._submit(('flush',))
+        if self._thread is not None:
+            self._jobs.put(None)
+            self._thread.join(timeout=10)
+            self._thread = None
+
+    def _run(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+            try:
+                self._process(job)
+            except Exception as e:
+                print(f"[History] {job[0]} failed: {e}")
+
+    def nbytes(self):
+        """环形缓冲区占用的字节数"""
+        return sum(tier.nbytes() for tier in self.tiers)
+
+    def stats(self):
+        return {
+            "rooms": len(self.room_ids),
+            "samples": self.samples,
+            "points": {tier.resolution: min(tier.count, tier.capacity) for tier in self.tiers},
+            "capacity": {tier.resolution: tier.capacity for tier in self.tiers},
+            "bytes": self.nbytes(),
+            "pending_jobs": self._jobs.qsize(),
+            "chunks_written": self.chunks_written,
+            "dropped": self.dropped,
+        }
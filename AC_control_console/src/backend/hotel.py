@@ -0,0 +1,922 @@
+import contextlib
+import math
+import heapq
+import itertools
+from array import array
+from enum import IntEnum
+
+import topology
+from clock import make_clock, simulated_from
+
+# --- Configuration ---
+class Config:
+    # 计费费率 (元/秒)
+    FEE_RATES = {
+        "High": 1.0 / 60.0,
+        "Mid":  1.0 / 120.0,
+        "Low":  1.0 / 180.0
+    }
+    # 温度变化速率 (°C/秒)
+    TEMP_RATES = {
+        "High": 1.0 / 60.0,
+        "Mid":  1.0 / 120.0,
+        "Low":  1.0 / 180.0
+    }
+    # 回温速率: 0.5度/分钟
+    RETURN_RATE = 1.0 / 120.0
+    
+    MAX_SERVICE_SLOTS = 3
+    WAIT_DURATION_ALLOC = 120
+    # 调度器补位时机: 'eager' 每次请求/释放服务后立即 rebalance;
+    # 'tick' 模拟步进中服务对象释放后空出的服务位先记下，在下一次依赖队列的判断之前
+    # 或步进结束时一次补足 (同一秒内的多次释放合并为一次 rebalance，调度结果与 'eager' 相同)
+    SCHEDULER_REBALANCE = 'eager'
+
+    # 模拟引擎: 'object' 逐个房间对象计算; 'vector' 使用 NumPy 数组批量计算 (适合大规模房间)
+    SIMULATION_ENGINE = 'object'
+
+    # 房间状态写回数据库的间隔 (秒)，期间的变化合并为一次批量写入
+    PERSIST_INTERVAL = 5
+
+    # 事件日志 (journal.py): 控制、入住/退房、调度队列与每秒的状态变化先追加到日志，
+    # 每 JOURNAL_COMMIT_INTERVAL 秒合并为一次 fsync；每次批量写入 room_states 时记录检查点并截断日志，
+    # 启动时载入检查点后重放日志尾部
+    JOURNAL_ENABLED = True
+    JOURNAL_COMMIT_INTERVAL = 0.005
+
+    # 房间温度/费用历史曲线 (history.py): 内存中保留的 1 秒、1 分钟、15 分钟点数 (每个房间每个点 8 字节)。
+    # 1 分钟与 15 分钟两层按 1 小时 / 1 天的时间窗写入数据库，点数不能少于 60 / 96。
+    # 所有房间的缓冲区合计不超过 HISTORY_MAX_BYTES: 超出时依次减少 1 秒层 (不少于 120) 与 1 分钟层的点数，
+    # 仍然放不下时 (默认约 3 万间房以上) 不记录历史，需要时调大该值
+    HISTORY_ENABLED = True
+    HISTORY_RAW_SECONDS = 900
+    HISTORY_MINUTE_POINTS = 360
+    HISTORY_QUARTER_POINTS = 96
+    HISTORY_MAX_BYTES = 64 * 1024 * 1024
+    # GET /api/room/<id>/history 未指定 resolution 时，选择返回点数不超过该值的最细分辨率
+    HISTORY_MAX_POINTS = 1000
+
+    # 分片模拟: SHARD_COUNT > 1 时房间按 SHARD_KEY ('floor' 按楼层 / 'room' 逐个房间) 划分到多个进程，
+    # 每个分片独立调度 (服务对象上限按分片计算)
+    SHARD_COUNT = 0
+    SHARD_KEY = 'floor'
+
+    # 时钟 (见 clock.py): 'real' 真实时间; 'simulated' 模拟时间只随模拟步进前进;
+    # 'accelerated' 模拟时间以 CLOCK_SPEED 倍速运行
+    CLOCK_MODE = 'real'
+    CLOCK_SPEED = 60
+
+    # 服务方式 (直接运行 app.py 时): 'flask' 为 Flask 开发服务器 (每个连接一个线程);
+    # 'asyncio' 为 aio_server.py 的事件循环 (SSE 长连接与快照查询不占用线程，
+    # 访问数据库的接口在 ASYNC_WORKERS 个线程中执行)
+    SERVER_MODE = 'flask'
+    ASYNC_WORKERS = 8
+    # 请求体上限 (字节)，超过时返回 413
+    MAX_REQUEST_BYTES = 1024 * 1024
+
+    # 账单缓存 (bill_cache.py): 空调服务中的房间费用逐秒变化，GET /bill 每累计该秒数的服务才重新生成
+    BILL_REFRESH_SECONDS = 60
+
+def repeat_add(value, step, count):
+    """
+    Bit-exact result of `value += step` repeated `count` times.
+
+    Within one binade every addition rounds to the same increment on the float
+    grid, so whole runs can be applied at once; only the additions that cross a
+    binade boundary (or round a tie) are done one by one. Cost is proportional to
+    the number of binades crossed, not to `count`.
+    """
+    while count > 0:
+        if step == 0.0:
+            return value
+        if value <= 0.0:
+            value += step
+            count -= 1
+            continue
+        mantissa, exp = math.frexp(value)
+        ulp = math.ldexp(1.0, exp - 53)
+        units = step / ulp
+        if units - math.floor(units) == 0.5:
+            # 恰好落在两个格点中间时按奇偶舍入，只能逐次累加
+            value += step
+            count -= 1
+            continue
+        inc_units = round(units)
+        if inc_units == 0:
+            return value
+        lo = math.ldexp(1.0, exp - 1)
+        hi = math.ldexp(1.0, exp)
+        inc = inc_units * ulp
+        if step > 0:
+            safe = int((hi - value - step) // inc)
+        else:
+            safe = int((value + step - lo) // -inc)
+        jump = min(count, max(0, safe))
+        if jump:
+            value += (jump * inc_units) * ulp
+            count -= jump
+        if count:
+            value += step
+            count -= 1
+    return value
+
+# --- Room ---
+class VersionCounter:
+    """
+    全局单调递增的版本号，任何房间状态变化都会分配一个新版本，latest 为最近分配的版本。
+    保存在实例上而不是 Room 的类属性上: 给类属性赋值会使 Room 实例的属性访问缓存全部失效，
+    每次 touch() 都会拖慢之后的属性读写。
+    """
+    __slots__ = ('latest', '_seq')
+
+    def __init__(self):
+        self.latest = 0
+        self._seq = itertools.count(1)
+
+    def next(self):
+        version = self.latest = next(self._seq)
+        return version
+
+
+class FanSpeed(IntEnum):
+    """风速编码 (Room 内部以小整数保存风速; vector_engine 使用相同编码)"""
+    LOW = 0
+    MID = 1
+    HIGH = 2
+
+# 风速编码 -> 名称。未知风速 (如前端传入的非法值) 动态追加编码，不计入分项统计
+SPEEDS = ['Low', 'Mid', 'High']
+_speed_names = list(SPEEDS)
+_speed_codes = {name: code for code, name in enumerate(SPEEDS)}
+
+
+def speed_code(name):
+    code = _speed_codes.get(name)
+    if code is None:
+        code = len(_speed_names)
+        _speed_names.append(name)
+        _speed_codes[name] = code
+    return code
+
+
+# 分项统计数组 (Room.speed_counters): [Low, Mid, High 的服务时长 (秒), Low, Mid, High 的费用]，
+# 从未服务过的房间为 None
+_ZERO_COUNTERS = array('d', bytes(8 * 2 * len(SPEEDS)))
+_FEE = len(SPEEDS)
+# speed_stats 字典的风速顺序
+_STATS_ORDER = ((FanSpeed.HIGH, 'High'), (FanSpeed.MID, 'Mid'), (FanSpeed.LOW, 'Low'))
+
+
+def speed_stats_dict(counters):
+    """分项统计数组 -> {"High": {"duration", "fee"}, "Mid": ..., "Low": ...}"""
+    counters = counters or _ZERO_COUNTERS
+    return {name: {"duration": int(counters[code]), "fee": counters[_FEE + code]}
+            for code, name in _STATS_ORDER}
+
+# 房间对外可见的状态属性 (不含 room_id / floor / version)，用于跨进程同步和只读快照
+STATE_FIELDS = (
+    'room_type', 'room_price', 'deposit', 'is_free',
+    'power_on', 'is_active', 'fan_speed', 'initial_temp', 'current_temp', 'target_temp',
+    'total_fee', 'duration',
+    'tenant_id', 'tenant_name', 'tenant_phone', 'stay_days', 'food_orders', 'food_fee',
+    'current_session_start_time', 'current_session_fee_start',
+    'dispatch_count', 'speed_counters', 'bill_version',
+)
+
+class Room:
+    """
+    使用 __slots__ 保存属性，不为每个房间创建 __dict__。风速以 FanSpeed 编码保存，
+    分项统计为定长数组 speed_counters；fan_speed / speed_stats 属性仍以名称和嵌套 dict 读写，
+    to_dict 输出不变。
+    """
+    __slots__ = (
+        'room_id', 'floor', 'room_type', 'room_price', 'deposit', 'is_free',
+        'power_on', 'is_active', '_speed', 'initial_temp', 'current_temp', 'target_temp',
+        'total_fee', 'duration',
+        'tenant_id', 'tenant_name', 'tenant_phone', 'stay_days', 'food_orders', 'food_fee',
+        'current_session_start_time', 'current_session_fee_start',
+        'dispatch_count', 'speed_counters', 'bill_version', 'version',
+    )
+
+    # 所有房间共用的版本号 (Room.versions.latest 为最新版本)
+    versions = VersionCounter()
+
+    def __init__(self, room_id, floor, initial_temp=28.0):
+        self.room_id = room_id
+        self.floor = floor
+        
+        # Room Info (房型、房价与押金见拓扑文件 topology.json)
+        room_type = topology.current().room_type(room_id)
+        self.room_type = room_type.name
+        self.room_price = room_type.price
+        self.deposit = room_type.deposit
+            
+        self.is_free = True
+        
+        # State
+        self.power_on = False
+        self.is_active = False  # Serving state
+        self._speed = FanSpeed.MID
+        self.initial_temp = initial_temp
+        self.current_temp = initial_temp
+        self.target_temp = 25.0
+        self.total_fee = 0.0
+        self.duration = 0  # seconds
+        
+        # Tenant Info
+        self.tenant_id = None
+        self.tenant_name = None
+        self.tenant_phone = None
+        self.stay_days = 0
+        self.food_orders = []
+        self.food_fee = 0.0
+        
+        # Session Info
+        self.current_session_start_time = None
+        self.current_session_fee_start = 0.0
+        
+        # Stats
+        self.dispatch_count = 0
+        self.speed_counters = None
+        # 控制、入住、退房时加一 (账单缓存据此判断账单与详单是否变化)
+        self.bill_version = 0
+
+        self.touch()
+
+    @property
+    def fan_speed(self):
+        return _speed_names[self._speed]
+
+    @fan_speed.setter
+    def fan_speed(self, value):
+        self._speed = speed_code(value)
+
+    @property
+    def speed_stats(self):
+        """各风速的服务时长与费用 (每次返回新的 dict)"""
+        return speed_stats_dict(self.speed_counters)
+
+    @speed_stats.setter
+    def speed_stats(self, value):
+        counters = array('d', _ZERO_COUNTERS)
+        for code, name in _STATS_ORDER:
+            s = value.get(name, {"duration": 0, "fee": 0.0})
+            counters[code] = s['duration']
+            counters[_FEE + code] = s['fee']
+        self.speed_counters = counters if any(counters) else None
+
+    def _counters(self):
+        """可原地累加的分项统计数组 (第一次服务时创建)"""
+        counters = self.speed_counters
+        if counters is None:
+            counters = self.speed_counters = array('d', _ZERO_COUNTERS)
+        return counters
+
+    def touch(self):
+        """Mark state as changed so version-aware pollers pick it up"""
+        self.version = Room.versions.next()
+
+    def to_dict(self):
+        return {
+            "room_id": self.room_id,
+            "type": self.room_type,
+            "price": self.room_price,
+            "deposit": self.deposit,
+            "isFree": self.is_free,
+            "power_on": self.power_on,
+            "is_active": self.is_active,
+            "fan_speed": self.fan_speed,
+            "initial_temp": self.initial_temp,
+            "current_temp": self.current_temp,
+            "target_temp": self.target_temp,
+            "total_fee": self.total_fee,
+            "duration": self.duration,
+            "tenant_id": self.tenant_id,
+            "tenant_name": self.tenant_name,
+            "tenant_phone": self.tenant_phone,
+            "stay_days": self.stay_days,
+            "food_orders": self.food_orders,
+            "food_fee": self.food_fee
+        }
+
+    def update_temp_and_fee(self):
+        """Update temperature and fee based on current state"""
+        if not self.power_on:
+            self._handle_return_temp()
+            return
+
+        if self.is_active:
+            # Active: Cooling/Heating and Charging
+            code = self._speed
+            fan_speed = _speed_names[code]
+            current_rate = Config.FEE_RATES.get(fan_speed, 0)
+            temp_change = Config.TEMP_RATES.get(fan_speed, 0)
+            
+            self.total_fee += current_rate
+            self.duration += 1
+            
+            # Update stats
+            if code < _FEE:
+                counters = self._counters()
+                counters[code] += 1
+                counters[_FEE + code] += current_rate
+            
+            diff = self.current_temp - self.target_temp
+            if diff > 0:
+                self.current_temp -= temp_change
+            else:
+                self.current_temp += temp_change
+            self.touch()
+        else:
+            # Inactive (Waiting or Idle): Return temp
+            self._handle_return_temp()
+
+    def _handle_return_temp(self):
+        diff_init = self.current_temp - self.initial_temp
+        if abs(diff_init) > 0.01:
+            if diff_init > 0:
+                self.current_temp -= Config.RETURN_RATE
+            else:
+                self.current_temp += Config.RETURN_RATE
+            self.touch()
+
+    def _return_moves_left(self):
+        """How many more seconds _handle_return_temp will keep moving the temperature"""
+        diff_init = abs(self.current_temp - self.initial_temp)
+        if diff_init <= 0.01:
+            return 0
+        step = -Config.RETURN_RATE if self.current_temp > self.initial_temp else Config.RETURN_RATE
+        moves = math.ceil((diff_init - 0.01) / Config.RETURN_RATE)
+        # 估算值可能因累加舍入差一步，按逐秒累加的真实结果校正
+        while moves > 1 and abs(repeat_add(self.current_temp, step, moves - 1) - self.initial_temp) <= 0.01:
+            moves -= 1
+        while abs(repeat_add(self.current_temp, step, moves) - self.initial_temp) > 0.01:
+            moves += 1
+        return moves
+
+    def seconds_until_event(self, in_waiting):
+        """
+        Number of upcoming seconds run_simulation_step can apply to this room
+        without calling the scheduler (None: no such event ahead)
+        """
+        diff = self.current_temp - self.target_temp
+        if not self.power_on:
+            return 0 if (self.is_active or in_waiting) else None
+
+        if self.is_active:
+            # Target reached
+            if abs(diff) < 0.01:
+                return 0
+            temp_change = Config.TEMP_RATES.get(self.fan_speed, 0)
+            if temp_change <= 0:
+                return None
+            return int((abs(diff) - 0.01) // temp_change) + 1
+
+        if in_waiting:
+            return None
+        # Auto reactivate: drifting back towards initial temp until |diff| > 1.0
+        if abs(diff) > 1.0:
+            return 0
+        moves = self._return_moves_left()
+        if moves == 0:
+            return None
+        direction = -1 if self.current_temp > self.initial_temp else 1
+        distance = (self.target_temp + direction * 1.0 - self.current_temp) * direction
+        seconds = int(distance // Config.RETURN_RATE) + 1
+        return seconds if seconds <= moves else None
+
+    def advance(self, seconds):
+        """Apply `seconds` event-free seconds of update_temp_and_fee in closed form"""
+        if seconds <= 0:
+            return
+        if self.power_on and self.is_active:
+            code = self._speed
+            current_rate = Config.FEE_RATES.get(_speed_names[code], 0)
+            temp_change = Config.TEMP_RATES.get(_speed_names[code], 0)
+
+            self.total_fee = repeat_add(self.total_fee, current_rate, seconds)
+            self.duration += seconds
+
+            if code < _FEE:
+                counters = self._counters()
+                counters[code] += seconds
+                counters[_FEE + code] = repeat_add(counters[_FEE + code], current_rate, seconds)
+
+            if self.current_temp - self.target_temp > 0:
+                temp_change = -temp_change
+            self.current_temp = repeat_add(self.current_temp, temp_change, seconds)
+            self.touch()
+        else:
+            moves = min(seconds, self._return_moves_left())
+            if moves:
+                step = -Config.RETURN_RATE if self.current_temp > self.initial_temp else Config.RETURN_RATE
+                self.current_temp = repeat_add(self.current_temp, step, moves)
+                self.touch()
+
+# --- Scheduler ---
+# 风速优先级: High > Mid > Low
+SPEED_PRIORITY = {'High': 3, 'Mid': 2, 'Low': 1}
+
+class Scheduler:
+    """
+    Service/waiting queues kept as room_id -> entry maps (insertion ordered, so
+    iteration order is still FIFO) plus heaps with lazy deletion:
+      - waiting by (-priority, seq)              -> highest priority waiter
+      - waiting by (expires_at, seq)             -> expired time slices
+      - service by (priority, start_time, seq)   -> preemption victim
+      - service by (start_time, seq)             -> longest served room
+    Heap items are validated against the maps when popped, so updates and
+    removals are O(1) and lookups O(log n).
+    """
+
+    def __init__(self, rooms, clock=None):
+        self.rooms = rooms  # room_id -> Room
+        # 服务开始时间与详单时间的来源，默认按 Config.CLOCK_MODE 创建
+        self.clock = clock if clock is not None else make_clock(Config.CLOCK_MODE, Config.CLOCK_SPEED)
+        self._service = {}  # room_id -> entry dict
+        self._waiting = {}  # room_id -> entry dict
+        self._waiting_by_priority = []
+        self._waiting_by_expiry = []
+        self._service_by_priority = []
+        self._service_by_age = []
+        self._seq = itertools.count()
+        # check_time_slices 调用次数，等待时间片以到期时刻存储，避免每秒遍历等待队列
+        self.ticks = 0
+        # 累计计数 (GET /metrics): 抢占次数、处理过的等待时间片到期次数
+        self.preemptions = 0
+        self.expired_slices = 0
+        self.rebalances = 0
+        # 队列内容 (成员、风速、时间片) 每次变化加一，persister 据此决定是否记录调度队列
+        self.revision = 0
+        # deferred_rebalance() 之内 rebalance 只记下待执行，退出时执行一次;
+        # coalesced() 之内释放服务对象后的补位记下待执行，由 settle() 执行
+        self._defer_depth = 0
+        self._coalesce_depth = 0
+        self._rebalance_pending = False
+        # 等待队列成员变化时调用 waiting_listener(room_id, 是否在等待) (向量引擎据此维护等待掩码)
+        self.waiting_listener = None
+        # 测试模式期间被替换下来的时钟 (见 set_test_mode)
+        self._normal_clock = None
+
+    def set_test_mode(self, enabled):
+        """
+        进入测试模式时换用从当前时间开始的模拟时钟 (真实时钟不随 /api/test/tick 前进，详单时长会是 0)，
+        退出时恢复原来的时钟。
+        """
+        if enabled and self._normal_clock is None:
+            self._normal_clock = self.clock
+            self.clock = simulated_from(self.clock)
+        elif not enabled and self._normal_clock is not None:
+            self.clock = self._normal_clock
+            self._normal_clock = None
+
+    @property
+    def rebalance_pending(self):
+        return self._rebalance_pending
+
+    @property
+    def service_queue(self):
+        return list(self._service.values())
+
+    @property
+    def waiting_queue(self):
+        for item in self._waiting.values():
+            item['wait_duration'] = item['expires_at'] - self.ticks
+        return list(self._waiting.values())
+
+    def is_waiting(self, room_id):
+        return room_id in self._waiting
+
+    def waiting_ids(self):
+        return self._waiting.keys()
+
+    def queue_sizes(self):
+        """队列与堆的长度 (堆为延迟删除，长度可能大于队列本身，用于排查内存增长)"""
+        return {
+            "service": len(self._service),
+            "waiting": len(self._waiting),
+            "heap.waiting_by_priority": len(self._waiting_by_priority),
+            "heap.waiting_by_expiry": len(self._waiting_by_expiry),
+            "heap.service_by_priority": len(self._service_by_priority),
+            "heap.service_by_age": len(self._service_by_age),
+        }
+
+    def get_speed_val(self, speed_str):
+        return SPEED_PRIORITY.get(speed_str, 0)
+
+    def export_state(self):
+        """可 JSON 序列化的队列状态 (按进入队列的顺序)，用于事件日志与检查点"""
+        return {
+            "ticks": self.ticks,
+            "service": [[e['room_id'], e['fan_speed'], e['start_time']] for e in self._service.values()],
+            "waiting": [[e['room_id'], e['fan_speed'], e['expires_at']] for e in self._waiting.values()],
+        }
+
+    def restore_state(self, state, ticks=None):
+        """
+        按 export_state 的结果恢复队列 (启动时，队列为空)。ticks 为状态记录之后最后一次记录的
+        Scheduler.ticks，等待项保留剩余的时间片；已关机或不存在的房间跳过。
+        """
+        elapsed = state['ticks'] if ticks is None else ticks
+        for room_id, fan_speed, start_time in state['service']:
+            room = self.rooms.get(room_id)
+            if room is None or not room.power_on:
+                continue
+            item = {'room_id': room_id, 'fan_speed': fan_speed, 'start_time': start_time, 'seq': next(self._seq)}
+            self._service[room_id] = item
+            self._push_service(item)
+            heapq.heappush(self._service_by_age, (start_time, item['seq'], room_id))
+            room.is_active = True
+            room.touch()
+        for room_id, fan_speed, expires_at in state['waiting']:
+            room = self.rooms.get(room_id)
+            if room is None or not room.power_on or room_id in self._service:
+                continue
+            item = {'room_id': room_id, 'fan_speed': fan_speed, 'seq': next(self._seq)}
+            self._waiting[room_id] = item
+            self._notify_waiting(room_id, True)
+            heapq.heappush(self._waiting_by_priority, (-self.get_speed_val(fan_speed), item['seq'], room_id))
+            self._set_expiry(item, self.ticks + max(0, expires_at - elapsed))
+            room.is_active = False
+            room.touch()
+        self.revision += 1
+
+    def save(self):
+        """队列内容的副本，失败的批量操作用 rollback 恢复 (累计计数不恢复)"""
+        return {
+            'service': {room_id: dict(entry) for room_id, entry in self._service.items()},
+            'waiting': {room_id: dict(entry) for room_id, entry in self._waiting.items()},
+            'heaps': [list(heap) for heap in (self._waiting_by_priority, self._waiting_by_expiry,
+                                              self._service_by_priority, self._service_by_age)],
+            'revision': self.revision,
+            'rebalance_pending': self._rebalance_pending,
+        }
+
+    def rollback(self, saved):
+        """恢复 save() 时的队列 (房间的 is_active 等字段由调用方恢复)"""
+        self._service = saved['service']
+        if self.waiting_listener is not None:
+            for room_id in self._waiting.keys() - saved['waiting'].keys():
+                self.waiting_listener(room_id, False)
+            for room_id in saved['waiting'].keys() - self._waiting.keys():
+                self.waiting_listener(room_id, True)
+        self._waiting = saved['waiting']
+        (self._waiting_by_priority, self._waiting_by_expiry,
+         self._service_by_priority, self._service_by_age) = saved['heaps']
+        self.revision = saved['revision']
+        self._rebalance_pending = saved['rebalance_pending']
+
+    def request_service(self, room_id, fan_speed):
+        """Handle service request"""
+        # 新请求进入服务还是等待取决于空闲服务位，先补位
+        self.settle()
+
+        # 1. Update existing request
+        in_queue = False
+        item = self._service.get(room_id)
+        if item is not None:
+            item['fan_speed'] = fan_speed
+            self._push_service(item)
+            self.revision += 1
+            in_queue = True
+
+        if not in_queue:
+            item = self._waiting.get(room_id)
+            if item is not None:
+                item['fan_speed'] = fan_speed
+                heapq.heappush(self._waiting_by_priority,
+                               (-self.get_speed_val(fan_speed), item['seq'], room_id))
+                self.revision += 1
+                in_queue = True
+
+        # 2. Add to queue if new
+        if not in_queue:
+            if len(self._service) < Config.MAX_SERVICE_SLOTS:
+                self.add_to_service(room_id, fan_speed)
+            else:
+                self.add_to_waiting(room_id, fan_speed)
+
+        # 3. Rebalance
+        self.rebalance()
+
+    @contextlib.contextmanager
+    def deferred_rebalance(self):
+        """批量操作 (POST /api/rooms/control): 期间的多次 rebalance 合并为退出时的一次"""
+        self._defer_depth += 1
+        try:
+            yield self
+        finally:
+            self._defer_depth -= 1
+            if not self._defer_depth and self._rebalance_pending:
+                self._rebalance_pending = False
+                self.rebalance()
+
+    @contextlib.contextmanager
+    def coalesced(self):
+        """
+        一次模拟步进 (Config.SCHEDULER_REBALANCE == 'tick' 时生效): 期间释放服务对象只记下待补位，
+        由 settle() 在下一次依赖队列的判断之前或退出时执行。从平衡状态释放服务对象只会空出服务位，
+        补位时不会发生抢占，先后多次补位与一次补足的结果相同; 凡是可能观察到补位结果的地方
+        (新的请求、释放等待中的房间、时间片检查、读取等待中房间的状态) 都先 settle，因此调度结果与 'eager' 一致。
+        """
+        if Config.SCHEDULER_REBALANCE != 'tick':
+            yield self
+            return
+        self._coalesce_depth += 1
+        try:
+            yield self
+        finally:
+            self._coalesce_depth -= 1
+            if not self._coalesce_depth:
+                self.settle()
+
+    def settle(self, room_id=None):
+        """执行 coalesced() 中记下的补位; 给出 room_id 时只在该房间正在等待 (可能被调入服务) 时执行"""
+        if self._rebalance_pending and not self._defer_depth and (room_id is None or room_id in self._waiting):
+            self._rebalance_pending = False
+            self.rebalance()
+
+    def rebalance(self):
+        """Core scheduling logic"""
+        if self._defer_depth:
+            self._rebalance_pending = True
+            return
+        self.rebalances += 1
+        # 1. Fill empty slots
+        while len(self._service) < Config.MAX_SERVICE_SLOTS and self._waiting:
+            best_waiter = self._get_highest_priority_waiter()
+            if best_waiter:
+                self._remove_waiting(best_waiter['room_id'])
+                self.add_to_service(best_waiter['room_id'], best_waiter['fan_speed'])
+
+        # 2. Preempt if full
+        while len(self._service) >= Config.MAX_SERVICE_SLOTS and self._waiting:
+            min_service_item = self._get_lowest_priority_service()
+            max_wait_item = self._get_highest_priority_waiter()
+            
+            min_service_val = self.get_speed_val(min_service_item['fan_speed'])
+            max_wait_val = self.get_speed_val(max_wait_item['fan_speed'])
+            
+            if max_wait_val > min_service_val:
+                # Preempt
+                self._remove_waiting(max_wait_item['room_id'])
+                self.preempt_service(min_service_item, max_wait_item['room_id'], max_wait_item['fan_speed'])
+            else:
+                break
+
+    def _peek(self, heap, is_valid):
+        """Drop stale heap items and return the live entry on top (or None)"""
+        while heap:
+            entry = is_valid(heap[0])
+            if entry is not None:
+                return entry
+            heapq.heappop(heap)
+        return None
+
+    def _live_waiting(self, heap_item):
+        entry = self._waiting.get(heap_item[-1])
+        if entry is not None and entry['seq'] == heap_item[-2]:
+            return entry
+        return None
+
+    def _live_service(self, heap_item):
+        entry = self._service.get(heap_item[-1])
+        if entry is not None and entry['seq'] == heap_item[-2]:
+            return entry
+        return None
+
+    def _get_highest_priority_waiter(self):
+        # Priority: High > Mid > Low, then FIFO
+        def valid(item):
+            entry = self._live_waiting(item)
+            if entry is not None and -item[0] == self.get_speed_val(entry['fan_speed']):
+                return entry
+            return None
+        return self._peek(self._waiting_by_priority, valid)
+
+    def _get_lowest_priority_service(self):
+        # Priority: Lowest speed, then Longest service time (smallest start_time)
+        def valid(item):
+            entry = self._live_service(item)
+            if entry is not None and item[0] == self.get_speed_val(entry['fan_speed']):
+                return entry
+            return None
+        return self._peek(self._service_by_priority, valid)
+
+    def _get_longest_service(self):
+        return self._peek(self._service_by_age, self._live_service)
+
+    def _push_service(self, item):
+        heapq.heappush(self._service_by_priority,
+                       (self.get_speed_val(item['fan_speed']), item['start_time'], item['seq'], item['room_id']))
+
+    def _remove_waiting(self, room_id):
+        if self._waiting.pop(room_id, None) is not None:
+            self.revision += 1
+            self._notify_waiting(room_id, False)
+        self._compact()
+
+    def _notify_waiting(self, room_id, waiting):
+        if self.waiting_listener is not None:
+            self.waiting_listener(room_id, waiting)
+
+    def _compact(self):
+        """Rebuild heaps once stale items outnumber live entries"""
+        live = len(self._service) + len(self._waiting)
+        heaps = (self._waiting_by_priority, self._waiting_by_expiry,
+                 self._service_by_priority, self._service_by_age)
+        if sum(len(h) for h in heaps) <= 4 * live + 64:
+            return
+        self._waiting_by_priority = [(-self.get_speed_val(e['fan_speed']), e['seq'], r)
+                                     for r, e in self._waiting.items()]
+        self._waiting_by_expiry = [(e['expires_at'], e['seq'], r) for r, e in self._waiting.items()]
+        self._service_by_priority = [(self.get_speed_val(e['fan_speed']), e['start_time'], e['seq'], r)
+                                     for r, e in self._service.items()]
+        self._service_by_age = [(e['start_time'], e['seq'], r) for r, e in self._service.items()]
+        for heap in (self._waiting_by_priority, self._waiting_by_expiry,
+                     self._service_by_priority, self._service_by_age):
+            heapq.heapify(heap)
+
+    def release_service(self, room_id):
+        # 等待中的房间可能正是待补位的对象
+        self.settle(room_id)
+        in_service = self._service.pop(room_id, None)
+        in_waiting = self._waiting.pop(room_id, None)
+        if in_service is not None or in_waiting is not None:
+            self.revision += 1
+        if in_waiting is not None:
+            self._notify_waiting(room_id, False)
+        self._compact()
+        if room_id in self.rooms:
+            self.rooms[room_id].touch()
+        if not self._coalesce_depth:
+            self.rebalance()
+        elif in_service is not None and self._waiting:
+            # 只空出了服务位，补位推迟到 settle (移出等待项不会打破平衡，无需 rebalance)
+            self._rebalance_pending = True
+
+    def check_time_slices(self):
+        self.settle()
+        self.ticks += 1
+        self.clock.advance(1)
+
+        # 取出所有到期的等待项，按进入等待队列的顺序处理
+        expired = {}
+        while self._waiting_by_expiry and self._waiting_by_expiry[0][0] <= self.ticks:
+            item = heapq.heappop(self._waiting_by_expiry)
+            entry = self._live_waiting(item)
+            if entry is not None and entry['expires_at'] == item[0]:
+                expired[entry['room_id']] = entry
+        expired_items = sorted(expired.values(), key=lambda x: x['seq'])
+
+        for waiter in expired_items:
+            if self._service:
+                self.expired_slices += 1
+                victim = self._get_longest_service()
+                
+                if self.get_speed_val(victim['fan_speed']) <= self.get_speed_val(waiter['fan_speed']):
+                    self._remove_waiting(waiter['room_id'])
+                    self.preempt_service(victim, waiter['room_id'], waiter['fan_speed'])
+                else:
+                    self._set_expiry(waiter, self.ticks + Config.WAIT_DURATION_ALLOC)
+            else:
+                # 没有可抢占的服务对象，保持到期状态，下一秒继续检查
+                self._set_expiry(waiter, waiter['expires_at'])
+
+    def _set_expiry(self, item, expires_at):
+        if item.get('expires_at') != expires_at:
+            self.revision += 1
+        item['expires_at'] = expires_at
+        heapq.heappush(self._waiting_by_expiry, (expires_at, item['seq'], item['room_id']))
+
+    def seconds_until_expiry(self):
+        """Seconds check_time_slices can run before a waiting item expires (None: queue empty)"""
+        def valid(item):
+            entry = self._live_waiting(item)
+            if entry is not None and entry['expires_at'] == item[0]:
+                return entry
+            return None
+        entry = self._peek(self._waiting_by_expiry, valid)
+        if entry is None:
+            return None
+        return max(0, entry['expires_at'] - self.ticks - 1)
+
+    def advance_time_slices(self, seconds):
+        """Apply `seconds` calls of check_time_slices during which nothing expires"""
+        self.ticks += seconds
+        self.clock.advance(seconds)
+
+    def add_to_service(self, room_id, fan_speed):
+        item = {
+            'room_id': room_id,
+            'fan_speed': fan_speed,
+            'start_time': self.clock.time(),
+            'seq': next(self._seq)
+        }
+        self._service[room_id] = item
+        self._push_service(item)
+        heapq.heappush(self._service_by_age, (item['start_time'], item['seq'], room_id))
+        self.revision += 1
+        if room_id in self.rooms:
+            self.rooms[room_id].is_active = True
+            self.rooms[room_id].touch()
+        print(f"[Scheduler] Room {room_id} START service.")
+
+    def add_to_waiting(self, room_id, fan_speed):
+        if room_id in self._waiting:
+            return
+        item = {
+            'room_id': room_id,
+            'fan_speed': fan_speed,
+            'seq': next(self._seq)
+        }
+        self._waiting[room_id] = item
+        self._notify_waiting(room_id, True)
+        heapq.heappush(self._waiting_by_priority, (-self.get_speed_val(fan_speed), item['seq'], room_id))
+        self._set_expiry(item, self.ticks + Config.WAIT_DURATION_ALLOC)
+        if room_id in self.rooms:
+            self.rooms[room_id].is_active = False
+            self.rooms[room_id].dispatch_count += 1
+            self.rooms[room_id].touch()
+        print(f"[Scheduler] Room {room_id} ENTER waiting queue.")
+
+    def preempt_service(self, victim, new_room_id, new_fan_speed):
+        print(f"[Scheduler] Preempting Room {victim['room_id']} for Room {new_room_id}")
+        self.preemptions += 1
+        self._service.pop(victim['room_id'], None)
+        self.revision += 1
+        self.add_to_waiting(victim['room_id'], victim['fan_speed'])
+        self.add_to_service(new_room_id, new_fan_speed)
+
+# --- Simulation ---
+def run_simulation_step(rooms, scheduler):
+    """Run one second of simulation (per-object engine)"""
+    coalesce = Config.SCHEDULER_REBALANCE == 'tick'
+    with scheduler.coalesced():
+        scheduler.check_time_slices()
+
+        for room_id, room in rooms.items():
+            # 待执行的补位可能把该房间调入服务
+            if coalesce and scheduler.rebalance_pending:
+                scheduler.settle(room_id)
+
+            # Auto-reactivate logic for Idle rooms
+            if room.power_on and not room.is_active:
+                in_waiting = scheduler.is_waiting(room_id)
+                if not in_waiting:
+                    diff = room.current_temp - room.target_temp
+                    if abs(diff) > 1.0:
+                        # print(f"[Auto Reactivate] Room {room_id} temp diff > 1.0. Requesting service.")
+                        scheduler.request_service(room_id, room.fan_speed)
+
+            # Check if target reached
+            if room.is_active:
+                diff = room.current_temp - room.target_temp
+                if abs(diff) < 0.01:
+                    # print(f"[Reached Target] Room {room_id} reached target temp. Releasing service.")
+                    scheduler.release_service(room_id)
+                    room.is_active = False
+
+            # Update state
+            room.update_temp_and_fee()
+
+            # Ensure consistency if room is off
+            if not room.power_on:
+                if room.is_active or scheduler.is_waiting(room_id):
+                    scheduler.release_service(room_id)
+                    room.is_active = False
+
+def seconds_until_event(rooms, scheduler):
+    """Seconds until the next scheduler-visible event anywhere in the hotel (None: never)"""
+    horizon = scheduler.seconds_until_expiry()
+    for room_id, room in rooms.items():
+        seconds = room.seconds_until_event(scheduler.is_waiting(room_id))
+        if seconds is not None and (horizon is None or seconds < horizon):
+            horizon = seconds
+            if horizon == 0:
+                break
+    return horizon
+
+def fast_forward(rooms, scheduler, seconds, step=None):
+    """
+    Event-driven equivalent of calling run_simulation_step `seconds` times.
+    Stretches in which no room reaches its target, drifts past the 1.0°C
+    reactivation threshold or has its wait slice expire are applied in closed
+    form (bit-exact, see repeat_add); the seconds around each event go through
+    the normal per-second step.
+    """
+    if step is None:
+        step = lambda: run_simulation_step(rooms, scheduler)
+    remaining = seconds
+    while remaining > 0:
+        horizon = seconds_until_event(rooms, scheduler)
+        # 留出一秒余量，事件时刻的估算误差不会跳过事件本身
+        jump = remaining if horizon is None else min(remaining, max(0, horizon - 1))
+        if jump:
+            for room in rooms.values():
+                room.advance(jump)
+            scheduler.advance_time_slices(jump)
+            remaining -= jump
+        if remaining:
+            step()
+            remaining -= 1
@@ -0,0 +1,205 @@
+"""
+追加写入的事件日志 (write-ahead journal)，与 persister.py 的定期检查点配合使用。
+
+每个事件占一行 JSON 数组 [lsn, kind, ...]，lsn 为单调递增的序号。
+append() 只把编码后的事件放进内存缓冲区并立即返回；提交线程被唤醒后再等待 commit_interval 秒，
+把期间积累的所有事件一次写入文件并 fsync (group commit)，需要确认持久化的调用方 (wait) 共享同一次 fsync。
+检查点 (room_states 与调度队列) 写入数据库之后，truncate(lsn) 删除已被检查点覆盖的事件，
+文件中只保留检查点之后的尾部。启动时 read_events() 读出尾部事件重放 (见 room_service.open_journal)；
+崩溃时只写了一半的最后一行会被丢弃。
+"""
+import json
+import os
+import threading
+import time
+
+
+def journal_path(db_path, name):
+    """数据库 db_path 对应的日志文件 (与数据库放在同一目录，如 hotel.main.journal)"""
+    base, _ = os.path.splitext(db_path)
+    return f"{base}.{name}.journal"
+
+
+def _scan(path):
+    """读取日志文件，返回 (完整的事件行, 完整部分的字节数)，遇到不完整或无法解析的行即停止"""
+    events = []
+    size = 0
+    try:
+        f = open(path, 'rb')
+    except FileNotFoundError:
+        return events, size
+    with f:
+        for line in f:
+            if not line.endswith(b'\n'):
+                break
+            try:
+                events.append(json.loads(line))
+            except ValueError:
+                break
+            size += len(line)
+    return events, size
+
+
+def read_events(path, after_lsn=0):
+    """日志中 lsn 大于 after_lsn 的事件 [[lsn, kind, ...], ...] (按写入顺序)"""
+    events, _ = _scan(path)
+    return [event for event in events if event[0] > after_lsn]
+
+
+def _lsn(line):
+    """编码后的事件行开头的序号"""
+    return int(line[1:line.index(b',')])
+
+
+def _fsync_dir(path):
+    # 替换文件后同步目录项 (Windows 不支持打开目录，跳过)
+    if os.name != 'posix':
+        return
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class Journal:
+    """
+    事件日志。append() 线程安全；事件应经由 StatePersister 写入 (与脏行登记在同一把锁内)，
+    检查点的 lsn 才能与房间状态对齐。
+    """
+
+    def __init__(self, path, lsn=0, commit_interval=0.005, name=None):
+        # lsn: 数据库中检查点已覆盖的序号，新事件从其后开始编号 (日志可能已被截断为空)
+        self.path = path
+        self.name = name or os.path.basename(path)
+        self.commit_interval = commit_interval
+        events, size = _scan(path)
+        # 丢弃崩溃时写了一半的末尾，之后的事件从完整的行之后追加
+        if os.path.exists(path) and os.path.getsize(path) != size:
+            with open(path, 'r+b') as f:
+                f.truncate(size)
+        self.lsn = max([lsn] + [event[0] for event in events[-1:]])
+        self.durable_lsn = self.lsn
+        self._file = open(path, 'ab')
+        self._buffer = []
+        self._lock = threading.Lock()
+        # 写文件与截断互斥
+        self._file_lock = threading.Lock()
+        self._durable = threading.Condition()
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._thread = None
+        self.commits = 0
+        self.events_written = 0
+        self.bytes_written = 0
+        self.last_commit_events = 0
+        self.last_commit_seconds = 0.0
+
+    def append(self, kind, *fields):
+        """追加一个事件，返回其 lsn (尚未持久化，需要确认时调用 wait)"""
+        with self._lock:
+            self.lsn += 1
+            lsn = self.lsn
+            self._buffer.append(json.dumps([lsn, kind, *fields], separators=(',', ':')).encode('utf-8') + b'\n')
+        self._wakeup.set()
+        return lsn
+
+    def commit(self):
+        """把缓冲区中的事件写入文件并 fsync，返回写入的事件数"""
+        with self._file_lock:
+            with self._lock:
+                lines = self._buffer
+                lsn = self.lsn
+                self._buffer = []
+            if not lines:
+                return 0
+            start = time.perf_counter()
+            data = b''.join(lines)
+            try:
+                self._file.write(data)
+                self._file.flush()
+                os.fsync(self._file.fileno())
+            except OSError as e:
+                # 写入失败时放回缓冲区，下次提交重试
+                with self._lock:
+                    self._buffer[:0] = lines
+                print(f"[Journal] Commit of {len(lines)} events failed: {e}")
+                return 0
+            self.commits += 1
+            self.events_written += len(lines)
+            self.bytes_written += len(data)
+            self.last_commit_events = len(lines)
+            self.last_commit_seconds = time.perf_counter() - start
+        with self._durable:
+            self.durable_lsn = max(self.durable_lsn, lsn)
+            self._durable.notify_all()
+        return len(lines)
+
+    def wait(self, lsn, timeout=5.0):
+        """等待 lsn 之前的事件全部持久化，超时返回 False"""
+        if self._thread is None:
+            # 提交线程未运行 (启动前或已关闭) 时直接提交
+            self.commit()
+        with self._durable:
+            return self._durable.wait_for(lambda: self.durable_lsn >= lsn, timeout)
+
+    def truncate(self, lsn):
+        """删除 lsn 及之前的事件 (已被数据库中的检查点覆盖)，包括缓冲区中尚未提交的"""
+        with self._file_lock:
+            with self._lock:
+                self._buffer = [line for line in self._buffer if _lsn(line) > lsn]
+            self._file.close()
+            # 文件由本进程按 lsn 顺序写入，只需解析每行开头的序号，保留的行原样复制
+            with open(self.path, 'rb') as f:
+                tail = [line for line in f if _lsn(line) > lsn]
+            tmp = self.path + '.tmp'
+            with open(tmp, 'wb') as f:
+                f.write(b''.join(tail))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+            _fsync_dir(self.path)
+            self._file = open(self.path, 'ab')
+        # 从缓冲区删除的事件已由检查点持久化
+        with self._durable:
+            self.durable_lsn = max(self.durable_lsn, lsn)
+            self._durable.notify_all()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def close(self):
+        """停止提交线程，提交剩余事件并关闭文件"""
+        self._closed = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self.commit()
+        with self._file_lock:
+            self._file.close()
+
+    def _run(self):
+        while not self._closed:
+            self._wakeup.wait()
+            self._wakeup.clear()
+            # 等待一个提交间隔，让同一时间段内的事件合并为一次 fsync
+            time.sleep(self.commit_interval)
+            self.commit()
+
+    def stats(self):
+        return {
+            "path": self.path,
+            "lsn": self.lsn,
+            "durable_lsn": self.durable_lsn,
+            "pending_events": len(self._buffer),
+            "commit_interval": self.commit_interval,
+            "commits": self.commits,
+            "events_written": self.events_written,
+            "bytes_written": self.bytes_written,
+            "events_per_commit": self.events_written / self.commits if self.commits else 0.0,
+            "last_commit_events": self.last_commit_events,
+            "last_commit_seconds": self.last_commit_seconds,
+        }
@@ -0,0 +1,271 @@
+"""
+运行指标，以 Prometheus 文本格式输出 (GET /metrics)。
+
+实现了 prometheus_client 中 Counter / Gauge / Histogram 的常用接口 (labels / inc / set / observe)，
+不需要额外依赖。热路径上只做一次计数或一次分桶查找；队列长度等状态在抓取时由
+on_collect 注册的函数计算，不占用模拟循环的时间。
+"""
+from bisect import bisect_left
+import functools
+import inspect
+import math
+import threading
+import time
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# 默认耗时分桶 (秒)
+DEFAULT_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_metrics = []
+_collectors = []
+
+
+def _format_value(value):
+    if isinstance(value, int):
+        return str(value)
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    if math.isnan(value):
+        return 'NaN'
+    return repr(float(value))
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children = {}
+        # 无标签指标直接使用这一个值，inc / set / observe 不必每次查找
+        self._default = self.labels() if not self.labelnames else None
+        _metrics.append(self)
+
+    def labels(self, *values):
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}")
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _samples(self):
+        """[(后缀, 标签值, 额外标签, 数值), ...]"""
+        with self._lock:
+            children = list(self._children.items())
+        samples = []
+        for values, child in sorted(children):
+            samples.extend(child._samples(values))
+        return samples
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for suffix, values, extra, value in self._samples():
+            labels = _format_labels(self.labelnames, values, extra)
+            lines.append(f"{self.name}{suffix}{labels} {_format_value(value)}")
+        return lines
+
+
+class _Value:
+    def __init__(self, lock):
+        self._lock = lock
+        self._function = None
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def set_function(self, function):
+        """抓取时调用 function() 取值 (值由其他对象维护时使用，例如 Scheduler 的计数)"""
+        self._function = function
+
+    def _samples(self, values):
+        value = self._function() if self._function is not None else self.value
+        return [('', values, (), value)]
+
+
+class _GaugeValue(_Value):
+    def set(self, value):
+        self.value = value
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+
+class _HistogramValue:
+    def __init__(self, lock, buckets):
+        self._lock = lock
+        self._buckets = buckets
+        self._counts = [0] * (len(buckets) + 1)
+        self._sum = 0.0
+
+    def observe(self, value):
+        index = bisect_left(self._buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    def _samples(self, values):
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        samples = []
+        cumulative = 0
+        for bound, count in zip(self._buckets, counts):
+            cumulative += count
+            samples.append(('_bucket', values, (('le', _format_value(float(bound))),), cumulative))
+        cumulative += counts[-1]
+        samples.append(('_bucket', values, (('le', '+Inf'),), cumulative))
+        samples.append(('_sum', values, (), total))
+        samples.append(('_count', values, (), cumulative))
+        return samples
+
+
+class _UnlockedHistogramValue(_HistogramValue):
+    def observe(self, value):
+        self._counts[bisect_left(self._buckets, value)] += 1
+        self._sum += value
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def _new_child(self):
+        return _Value(self._lock)
+
+    def inc(self, amount=1):
+        self._default.inc(amount)
+
+    def set_function(self, function):
+        self._default.set_function(function)
+
+
+class Gauge(_Metric):
+    type = 'gauge'
+
+    def _new_child(self):
+        return _GaugeValue(self._lock)
+
+    def set(self, value):
+        self._default.set(value)
+
+    def inc(self, amount=1):
+        self._default.inc(amount)
+
+    def dec(self, amount=1):
+        self._default.dec(amount)
+
+    def set_function(self, function):
+        self._default.set_function(function)
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, single_writer=False):
+        # single_writer: 只在一个线程中 observe (例如命令循环的 tick)，省去每次加锁
+        self.buckets = tuple(sorted(buckets))
+        self.single_writer = single_writer
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        if self.single_writer:
+            return _UnlockedHistogramValue(self._lock, self.buckets)
+        return _HistogramValue(self._lock, self.buckets)
+
+    def observe(self, value):
+        self._default.observe(value)
+
+
+def timed(histogram, errors=None):
+    """
+    装饰器: 按函数名记录每次调用的耗时，抛出异常时 errors 计数加一。
+    histogram / errors 需要有且只有一个标签 (函数名)。
+    生成器函数记录的是整个迭代过程中在生成器内部花费的时间 (不含调用方处理每一项的时间)，
+    在迭代结束或生成器被关闭时记录一次。
+    """
+    def decorate(fn):
+        observe = histogram.labels(fn.__name__).observe
+        failed = errors.labels(fn.__name__).inc if errors is not None else None
+
+        if inspect.isgeneratorfunction(fn):
+            @functools.wraps(fn)
+            def generator(*args, **kwargs):
+                elapsed = 0.0
+                start = time.perf_counter()
+                try:
+                    inner = fn(*args, **kwargs)
+                    while True:
+                        try:
+                            item = next(inner)
+                        except StopIteration:
+                            return
+                        elapsed += time.perf_counter() - start
+                        try:
+                            yield item
+                        finally:
+                            start = time.perf_counter()
+                except GeneratorExit:
+                    inner.close()
+                    raise
+                except Exception:
+                    if failed is not None:
+                        failed()
+                    raise
+                finally:
+                    observe(elapsed + time.perf_counter() - start)
+            return generator
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            except Exception:
+                if failed is not None:
+                    failed()
+                raise
+            finally:
+                observe(time.perf_counter() - start)
+        return wrapper
+    return decorate
+
+
+def on_collect(function):
+    """注册在每次抓取前调用的函数 (用于刷新由当前状态计算的 Gauge)"""
+    _collectors.append(function)
+    return function
+
+
+def render():
+    """所有指标的 Prometheus 文本格式"""
+    for collect in _collectors:
+        try:
+            collect()
+        except Exception as e:
+            print(f"[Metrics] Collector failed: {e}")
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,171 @@
+import threading
+import time
+
+
+class StatePersister:
+    """
+    房间状态的延迟批量写入 (write-behind)。
+    房间变化时只登记到脏集合 (同一房间多次变化只保留最新一行)，
+    由独立的写线程按固定间隔把脏行一次性写入数据库，每次写入只提交一个事务。
+
+    设置 journal (journal.py) 时，每次登记同时把状态行追加到事件日志 (group commit)，
+    每次写入就是一个检查点: 脏行与检查点 (日志序号、调度队列) 在同一事务中写入，之后截断日志。
+    登记与读取检查点序号在同一把锁内，检查点之前的事件一定已包含在写入的脏行中。
+    """
+
+    def __init__(self, write_rows, flush_interval=5, journal=None):
+        # write_rows: 接收 [(room_id, power_on, fan_speed, target_temp, current_temp, total_fee, duration), ...]；
+        # 设置 journal 时以 (rows, (日志名, lsn, 调度队列状态)) 调用 (database.update_room_states)
+        self.write_rows = write_rows
+        self.flush_interval = flush_interval
+        self.journal = journal
+        self._dirty = {}
+        # 最近一次登记的调度队列 (Scheduler.export_state) 与当时的 Scheduler.revision
+        self._scheduler_state = None
+        self._scheduler_revision = None
+        self._ticks = None
+        self._checkpoint_lsn = journal.lsn if journal is not None else 0
+        self._lock = threading.Lock()
+        # 保证同一时刻只有一次写入 (写线程与退出时的最后一次写入可能重叠)
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.flush_count = 0
+        self.rows_written = 0
+        self.last_flush_rows = 0
+        self.last_flush_seconds = 0.0
+
+    @staticmethod
+    def _row(room):
+        return (room.room_id, room.power_on, room.fan_speed,
+                room.target_temp, room.current_temp,
+                room.total_fee, room.duration)
+
+    def mark_dirty(self, room, kind='control'):
+        """登记一个房间，返回日志事件的 lsn (kind 为事件类型; 未启用日志时返回 None)"""
+        row = self._row(room)
+        with self._lock:
+            self._dirty[room.room_id] = row
+            if self.journal is not None:
+                return self.journal.append(kind, row)
+        return None
+
+    def mark_changed(self, rooms, since_version, ticks=None):
+        """
+        登记 since_version 之后变化过的房间 (只记录开过空调或产生过费用的房间)，
+        返回检查时的最新版本号，作为下次调用的 since_version。
+        启用日志时所有变化的行合并为一个 tick 事件，ticks 为当时的 Scheduler.ticks (恢复等待时间片用)
+        """
+        version = since_version
+        rows = []
+        for room in rooms.values():
+            if room.version > since_version:
+                version = max(version, room.version)
+                if room.power_on or room.total_fee > 0:
+                    rows.append(self._row(room))
+        if rows or self._has_waiting(ticks):
+            with self._lock:
+                for row in rows:
+                    self._dirty[row[0]] = row
+                if self.journal is not None:
+                    self._ticks = ticks
+                    self.journal.append('tick', ticks, rows)
+        return version
+
+    def _has_waiting(self, ticks):
+        # 没有状态变化但有等待中的房间时仍记录 tick，恢复时等待时间片的剩余时长准确
+        state = self._scheduler_state
+        return self.journal is not None and ticks is not None and state is not None and bool(state['waiting'])
+
+    def mark_scheduler(self, scheduler):
+        """调度队列有变化 (Scheduler.revision) 时登记，随下一个检查点保存；返回日志事件的 lsn 或 None"""
+        if self.journal is None or scheduler.revision == self._scheduler_revision:
+            return None
+        state = scheduler.export_state()
+        with self._lock:
+            self._scheduler_revision = scheduler.revision
+            self._scheduler_state = state
+            self._ticks = state['ticks']
+            return self.journal.append('scheduler', state)
+
+    def wait_durable(self, lsn):
+        """等待 lsn 之前的日志事件写入磁盘 (lsn 为 None 或未启用日志时立即返回)"""
+        if self.journal is not None and lsn is not None:
+            self.journal.wait(lsn)
+
+    def queue_depth(self):
+        """等待写入的房间数"""
+        return len(self._dirty)
+
+    def flush(self):
+        """立即写入所有脏行，返回写入的行数"""
+        with self._flush_lock:
+            with self._lock:
+                lsn = self.journal.lsn if self.journal is not None else 0
+                if not self._dirty and lsn == self._checkpoint_lsn:
+                    return 0
+                rows = list(self._dirty.values())
+                self._dirty = {}
+                if self.journal is not None:
+                    scheduler_state = self._scheduler_state
+                    if scheduler_state is not None and self._ticks is not None:
+                        scheduler_state = dict(scheduler_state, ticks=self._ticks)
+                    checkpoint = (self.journal.name, lsn, scheduler_state)
+            start = time.perf_counter()
+            try:
+                if self.journal is not None:
+                    self.write_rows(rows, checkpoint)
+                else:
+                    self.write_rows(rows)
+            except Exception as e:
+                # 写入失败时放回脏集合 (不覆盖期间产生的更新行)，下次重试
+                with self._lock:
+                    for row in rows:
+                        self._dirty.setdefault(row[0], row)
+                print(f"[Persister] Flush of {len(rows)} rows failed: {e}")
+                return 0
+            if self.journal is not None:
+                # 检查点已提交并落盘 (update_room_states)，之前的事件不再需要
+                self._checkpoint_lsn = lsn
+                try:
+                    self.journal.truncate(lsn)
+                except OSError as e:
+                    print(f"[Persister] Journal truncation failed: {e}")
+            self.flush_count += 1
+            self.rows_written += len(rows)
+            self.last_flush_rows = len(rows)
+            self.last_flush_seconds = time.perf_counter() - start
+            return len(rows)
+
+    def start(self):
+        if self.journal is not None:
+            self.journal.start()
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """停止写线程并写入剩余的脏行 (退出时调用)"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.flush_interval + 5)
+            self._thread = None
+        self.flush()
+        if self.journal is not None:
+            self.journal.close()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def stats(self):
+        return {
+            "queue_depth": self.queue_depth(),
+            "flush_interval": self.flush_interval,
+            "flush_count": self.flush_count,
+            "rows_written": self.rows_written,
+            "last_flush_rows": self.last_flush_rows,
+            "last_flush_seconds": self.last_flush_seconds,
+            "checkpoint_lsn": self._checkpoint_lsn,
+            "journal": self.journal.stats() if self.journal is not None else None,
+        }
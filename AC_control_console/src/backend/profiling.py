@@ -0,0 +1,359 @@
+"""
+按需性能分析: 在运行中的服务上对模拟步进和/或指定接口做 N 秒的分析，不需要重启。
+
+    cprofile  确定性分析，输出 pstats 文件 (可用 snakeviz / pstats 查看) 和可读摘要；
+              折叠栈由调用图按耗时比例推算 (近似)
+    sampling  采样分析，每 interval 秒记录一次目标线程的调用栈，开销小，输出精确的折叠栈
+
+折叠栈文件 (.collapsed) 每行为 "栈;帧;帧 数值"，可直接交给 flamegraph.pl / speedscope。
+开启 tracemalloc 时额外输出会话前后的内存分配差异，以及房间与调度队列的规模变化。
+memory_report 按抽样估算每个房间对象 (及其只读快照副本) 占用的字节数。
+
+分析目标通过替换函数实现 (会话结束后恢复)，不在分析时没有任何额外开销。
+"""
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+
+PROFILE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'profiles')
+
+MODES = ('cprofile', 'sampling')
+MAX_SECONDS = 300
+# 推算折叠栈时忽略小于该值的路径 (秒) 以及超过该深度的路径
+MIN_PATH_SECONDS = 1e-6
+MAX_DEPTH = 64
+
+
+def _slot_names(cls):
+    return [name for klass in cls.__mro__ for name in getattr(klass, '__slots__', ())]
+
+
+def deep_size(obj, seen, expand=True):
+    """
+    obj 及其引用的容器与值占用的字节数。seen 中的对象不重复计算，多个房间共用的对象
+    (常量字符串、空值等) 只计一次。expand 为 True 时展开 obj 的 __slots__ / __dict__，
+    其属性中的普通对象 (如 NumPy 引擎) 只计本身大小；list / tuple / dict 等容器总是展开。
+    """
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_size(k, seen, False) + deep_size(v, seen, False) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_size(item, seen, False) for item in obj)
+    elif expand:
+        for name in _slot_names(type(obj)):
+            if name not in ('__dict__', '__weakref__'):
+                size += deep_size(getattr(obj, name, None), seen, False)
+        if hasattr(obj, '__dict__'):
+            size += deep_size(obj.__dict__, seen, False)
+    return size
+
+
+def memory_report(rooms, snapshot=None, sample=1000, history=None):
+    """每个房间对象 / 快照副本的平均字节数 (均匀抽样 sample 个房间) 与历史曲线缓冲区 (history.py) 的字节数"""
+    room_ids = list(rooms)
+    step = max(1, len(room_ids) // max(1, sample))
+    picked = room_ids[::step][:sample]
+    report = {"rooms": len(room_ids), "sampled": len(picked)}
+    if history is not None:
+        report["history_bytes"] = history.nbytes()
+        report["history_bytes_per_room"] = round(history.nbytes() / max(1, len(room_ids)), 1)
+    if not picked:
+        return report
+    cls = type(rooms[picked[0]])
+    seen = set()
+    per_room = sum(deep_size(rooms[room_id], seen) for room_id in picked) / len(picked)
+    report.update({
+        "room_class": f"{cls.__module__}.{cls.__name__}",
+        "uses_slots": not hasattr(rooms[picked[0]], '__dict__'),
+        "bytes_per_room": round(per_room, 1),
+        "estimated_room_bytes": int(per_room * len(room_ids)),
+    })
+    if snapshot is not None:
+        seen = set()
+        views = [snapshot.rooms[room_id] for room_id in picked if room_id in snapshot.rooms]
+        if views:
+            per_view = sum(deep_size(view, seen) for view in views) / len(views)
+            report["snapshot_bytes_per_room"] = round(per_view, 1)
+            report["estimated_snapshot_bytes"] = int(per_view * len(snapshot.rooms))
+    return report
+
+
+class ProfilerBusy(Exception):
+    pass
+
+
+def frame_label(filename, funcname):
+    if filename == '~':
+        # 内置函数: ('~', 0, "<built-in method time.sleep>")
+        return funcname
+    return f"{os.path.basename(filename)}:{funcname}"
+
+
+def collapsed_from_stats(stats):
+    """
+    由 cProfile 调用图推算折叠栈 (微秒)。cProfile 只记录调用边，
+    函数在某条路径上的耗时按该路径上各调用边的累计耗时比例分摊。
+    """
+    callees = defaultdict(list)
+    roots = []
+    for func, (cc, nc, tt, ct, callers) in stats.items():
+        known = [caller for caller in callers if caller in stats and caller != func]
+        # runcall 结束时调用的 Profiler.disable 本身不是分析目标
+        if not known and '_lsprof.Profiler' not in func[2]:
+            roots.append(func)
+        for caller in known:
+            callees[caller].append(func)
+
+    lines = Counter()
+
+    def walk(func, path, share, depth):
+        cc, nc, tt, ct, callers = stats[func]
+        path = path + (frame_label(func[0], func[2]),)
+        if tt * share >= MIN_PATH_SECONDS:
+            lines[';'.join(path)] += tt * share
+        if depth >= MAX_DEPTH:
+            return
+        for callee in callees[func]:
+            callee_ct = stats[callee][3]
+            edge_ct = stats[callee][4][func][3]
+            spent = edge_ct * share
+            if callee_ct <= 0 or spent < MIN_PATH_SECONDS or frame_label(callee[0], callee[2]) in path:
+                continue
+            walk(callee, path, spent / callee_ct, depth + 1)
+
+    for root in roots:
+        walk(root, (), 1.0, 0)
+    return {stack: int(round(seconds * 1e6)) for stack, seconds in lines.items() if seconds * 1e6 >= 0.5}
+
+
+def _get(owner, name):
+    return owner[name] if isinstance(owner, dict) else getattr(owner, name)
+
+
+def _set(owner, name, value):
+    if isinstance(owner, dict):
+        owner[name] = value
+    else:
+        setattr(owner, name, value)
+
+
+class ProfileSession:
+    def __init__(self, session_id, hooks, seconds, mode, interval, trace_memory, state):
+        self.id = session_id
+        self.hooks = hooks          # {目标名: (owner, 属性名)}
+        self.seconds = seconds
+        self.mode = mode
+        self.interval = interval
+        self.trace_memory = trace_memory
+        self.state = state          # 可选: 返回房间/队列规模 dict 的函数
+        self.status = 'running'
+        self.started_at = None
+        self.calls = Counter()
+        self.files = {}
+        self.error = None
+        self._originals = {}
+        self._profile = cProfile.Profile()
+        self._profile_lock = threading.Lock()
+        self._active = {}           # 线程 id -> 正在执行的目标名
+        self._samples = Counter()
+        self._wrapper_code = None
+        self._thread = None
+
+    # --- 替换目标函数 ---
+    def _wrap(self, target, fn):
+        session = self
+
+        def profiled(*args, **kwargs):
+            session.calls[target] += 1
+            if session.mode == 'cprofile':
+                # cProfile 每次只能跟踪一个线程，并发的目标调用依次执行
+                with session._profile_lock:
+                    return session._profile.runcall(fn, *args, **kwargs)
+            ident = threading.get_ident()
+            outer = session._active.get(ident)
+            if outer is None:
+                session._active[ident] = target
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                if outer is None:
+                    session._active.pop(ident, None)
+        profiled.__wrapped__ = fn
+        profiled.__name__ = getattr(fn, '__name__', target)
+        self._wrapper_code = profiled.__code__
+        return profiled
+
+    def _install(self):
+        for target, (owner, name) in self.hooks.items():
+            original = _get(owner, name)
+            self._originals[target] = original
+            _set(owner, name, self._wrap(target, original))
+
+    def _uninstall(self):
+        for target, (owner, name) in self.hooks.items():
+            _set(owner, name, self._originals[target])
+
+    # --- 采样 ---
+    def _sample(self):
+        frames = sys._current_frames()
+        for ident, target in list(self._active.items()):
+            frame = frames.get(ident)
+            stack = []
+            # 只保留替换函数以内的帧
+            while frame is not None and frame.f_code is not self._wrapper_code:
+                stack.append(frame_label(frame.f_code.co_filename, frame.f_code.co_name))
+                frame = frame.f_back
+            if stack:
+                self._samples[';'.join([target] + stack[::-1])] += 1
+        del frames
+
+    def run(self):
+        self.started_at = time.time()
+        started_tracing = False
+        try:
+            if self.trace_memory:
+                if not tracemalloc.is_tracing():
+                    tracemalloc.start(16)
+                    started_tracing = True
+                before = tracemalloc.take_snapshot()
+                state_before = self.state() if self.state else {}
+            self._install()
+            deadline = time.monotonic() + self.seconds
+            try:
+                if self.mode == 'sampling':
+                    while time.monotonic() < deadline:
+                        self._sample()
+                        time.sleep(self.interval)
+                else:
+                    time.sleep(self.seconds)
+            finally:
+                self._uninstall()
+                # 等待进行中的目标调用结束
+                with self._profile_lock:
+                    pass
+            if self.trace_memory:
+                after = tracemalloc.take_snapshot()
+                state_after = self.state() if self.state else {}
+                self._write_memory(before, after, state_before, state_after)
+            self._write_results()
+            self.status = 'done'
+        except Exception as e:
+            self.status = 'failed'
+            self.error = f"{type(e).__name__}: {e}"
+            print(f"[Profiler] Session {self.id} failed: {self.error}")
+        finally:
+            if started_tracing:
+                tracemalloc.stop()
+
+    # --- 输出 ---
+    def _path(self, suffix):
+        return os.path.join(PROFILE_DIR, f"{self.id}.{suffix}")
+
+    def _write_results(self):
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        if self.mode == 'cprofile':
+            self._profile.create_stats()
+            path = self._path('pstats')
+            self._profile.dump_stats(path)
+            self.files['pstats'] = path
+            # 先推算折叠栈: pstats.Stats 会取走 profile.stats
+            collapsed = collapsed_from_stats(self._profile.stats)
+            summary = io.StringIO()
+            if self._profile.stats:
+                pstats.Stats(self._profile, stream=summary).sort_stats('cumulative').print_stats(40)
+            else:
+                summary.write("No profiled calls.\n")
+            self.files['txt'] = self._write_text('txt', summary.getvalue())
+        else:
+            collapsed = self._samples
+        lines = [f"{stack} {count}" for stack, count in sorted(collapsed.items())]
+        self.files['collapsed'] = self._write_text('collapsed', '\n'.join(lines) + '\n' if lines else '')
+
+    def _write_memory(self, before, after, state_before, state_after):
+        out = io.StringIO()
+        out.write(f"tracemalloc over {self.seconds}s\n\n")
+        if state_before or state_after:
+            out.write("State sizes (before -> after):\n")
+            for name in sorted(set(state_before) | set(state_after)):
+                out.write(f"  {name:<32} {state_before.get(name, '-')!s:>10} -> {state_after.get(name, '-')!s:<10}\n")
+            out.write("\n")
+        backend = os.path.dirname(os.path.abspath(__file__))
+        diff = after.compare_to(before, 'lineno')
+        out.write("Top allocation growth (backend modules):\n")
+        own = [stat for stat in diff if stat.traceback[0].filename.startswith(backend)]
+        for stat in own[:25]:
+            out.write(f"  {stat}\n")
+        out.write("\nTop allocation growth (all):\n")
+        for stat in diff[:25]:
+            out.write(f"  {stat}\n")
+        self.files['tracemalloc'] = self._write_text('tracemalloc.txt', out.getvalue())
+
+    def _write_text(self, suffix, text):
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = self._path(suffix)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        return path
+
+    def wait(self, timeout=None):
+        self._thread.join(timeout)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "status": self.status,
+            "mode": self.mode,
+            "seconds": self.seconds,
+            "targets": sorted(self.hooks),
+            "trace_memory": self.trace_memory,
+            "started_at": self.started_at,
+            "calls": dict(self.calls),
+            "files": sorted(self.files),
+            "error": self.error,
+        }
+
+
+class Profiler:
+    """同一时刻只允许一个分析会话"""
+
+    def __init__(self):
+        self.sessions = {}
+        self.current = None
+        self._lock = threading.Lock()
+        self._count = 0
+
+    def start(self, hooks, seconds, mode='cprofile', interval=0.005, trace_memory=False, state=None):
+        if mode not in MODES:
+            raise ValueError(f"Unknown profiling mode: {mode}")
+        if not hooks:
+            raise ValueError("No profiling targets")
+        if not 0 < seconds <= MAX_SECONDS:
+            raise ValueError(f"seconds must be in (0, {MAX_SECONDS}]")
+        if not 0 < interval <= 1:
+            raise ValueError("interval must be in (0, 1]")
+        with self._lock:
+            if self.current is not None and self.current.status == 'running':
+                raise ProfilerBusy(f"Session {self.current.id} is still running")
+            self._count += 1
+            session_id = time.strftime('%Y%m%d-%H%M%S') + f"-{self._count}"
+            session = ProfileSession(session_id, hooks, seconds, mode, interval, trace_memory, state)
+            self.sessions[session_id] = session
+            self.current = session
+        session.start()
+        return session
+
+    def get(self, session_id):
+        return self.sessions.get(session_id)
@@ -0,0 +1,397 @@
+"""
+房间业务操作: 房间初始化与状态恢复、空调控制、入住、退房。
+这些函数只操作传入的 rooms / scheduler，既可以在 Flask 进程内直接调用，
+也可以在分片模式下由持有房间的工作进程执行 (见 sharding.py)。
+返回值均为 (响应数据 dict, HTTP 状态码)。
+db 参数默认为 database 模块，离线场景测试可传入不落盘的替身 (见 scenario.py)。
+空调会话的起止时间取自 scheduler.clock (见 clock.py)，模拟模式下详单记录的是模拟时间。
+"""
+import json
+import numbers
+from itertools import starmap
+from operator import itemgetter
+
+import database
+import journal
+import topology
+from hotel import SPEED_PRIORITY
+
+
+# 测试用例: room_id -> (初始温度, 房价)
+TEST_CASES = {
+    # Cooling cases
+    "101": (32.0, 100.0),
+    "102": (28.0, 125.0),
+    "103": (30.0, 150.0),
+    "104": (29.0, 200.0),
+    "105": (35.0, 100.0),
+    # Heating cases
+    "106": (10.0, 100.0),
+    "107": (15.0, 125.0),
+    "108": (18.0, 150.0),
+    "109": (12.0, 200.0),
+    "110": (14.0, 100.0),
+}
+
+
+def room_keys():
+    """酒店的全部房间 [(room_id, floor), ...]，见拓扑文件 (topology.py)"""
+    return topology.current().keys()
+
+
+def load_rooms(rooms, make_room, keys):
+    """创建 keys 中的房间，并从数据库恢复空调状态与入住信息 (一个读事务中的两次整表读取)"""
+    rooms.update(zip(map(itemgetter(0), keys), starmap(make_room, keys)))
+
+    # Test Cases
+    for room_id, (temp, price) in TEST_CASES.items():
+        set_test_case(rooms, room_id, temp, price)
+
+    # 保存的空调状态覆盖测试用例的温度
+    state_rows, check_in_rows = database.load_room_restore_rows()
+    get = rooms.get
+    for room_id, power_on, fan_speed, target_temp, current_temp, total_fee, duration in state_rows:
+        room = get(room_id)
+        if room is not None:
+            apply_state_row(room, power_on, fan_speed, target_temp, current_temp, total_fee, duration)
+    for row in check_in_rows:
+        room = get(row[0])
+        if room is not None:
+            restore_check_in(room, row)
+    return rooms
+
+
+def restore_check_in(room, row):
+    """按 database.load_room_restore_rows 的一行在住记录恢复入住信息"""
+    _, tenant_id, tenant_name, tenant_phone, stay_days, deposit, food_orders = row
+    room.is_free = False
+    room.tenant_id = tenant_id
+    room.tenant_name = tenant_name
+    room.tenant_phone = tenant_phone
+    room.stay_days = stay_days
+    room.deposit = deposit
+    room.food_orders = []
+    room.food_fee = 0.0
+    # 大多数房间没有点餐，跳过 JSON 解析
+    if food_orders != '[]':
+        try:
+            room.food_orders = json.loads(food_orders)
+            # Calculate food fee
+            room.food_fee = sum(item.get('price', 0) * item.get('count', 0) for item in room.food_orders)
+        except (TypeError, ValueError, AttributeError):
+            room.food_orders = []
+            room.food_fee = 0.0
+
+
+def apply_state_row(room, power_on, fan_speed, target_temp, current_temp, total_fee, duration):
+    """恢复一行保存的空调状态 (room_states 或事件日志中的状态行)"""
+    room.power_on = bool(power_on)
+    room.fan_speed = fan_speed
+    room.target_temp = target_temp
+    room.current_temp = current_temp
+    room.total_fee = total_fee
+    room.duration = duration
+    # 开机的房间不在这里申请服务，避免启动时集中请求；
+    # 由模拟循环的自动重新激活逻辑 (或日志中记录的调度队列) 处理
+
+
+def replay_journal(rooms, scheduler, scheduler_state, events):
+    """
+    在检查点 (load_rooms 载入的 room_states 与 scheduler_state) 之上按顺序重放日志事件，
+    恢复房间状态与调度队列。返回状态被恢复的房间号集合。
+    事件: [lsn, 'tick', ticks, [状态行, ...]] / [lsn, 'scheduler', 队列状态] /
+          [lsn, 'control' | 'check_in' | 'check_out', 状态行]
+    """
+    restored = set()
+    ticks = scheduler_state['ticks'] if scheduler_state else None
+
+    def apply(row):
+        room = rooms.get(row[0])
+        if room is not None:
+            apply_state_row(room, *row[1:])
+            restored.add(row[0])
+
+    for event in events:
+        kind = event[1]
+        if kind == 'tick':
+            ticks = event[2]
+            for row in event[3]:
+                apply(row)
+        elif kind == 'scheduler':
+            scheduler_state = event[2]
+            ticks = scheduler_state['ticks']
+        else:
+            apply(event[2])
+
+    if scheduler_state is not None:
+        scheduler.restore_state(scheduler_state, ticks)
+    return restored
+
+
+def open_journal(name, rooms, scheduler, commit_interval):
+    """
+    重放事件日志 name 在检查点之后的事件 (在 load_rooms 之后调用)，
+    返回 (继续追加的 Journal, 状态被恢复的房间号集合, 重放的事件数)
+    """
+    checkpoint_lsn, scheduler_state = database.load_checkpoint(name)
+    path = journal.journal_path(database.DB_PATH, name)
+    events = journal.read_events(path, checkpoint_lsn)
+    restored = replay_journal(rooms, scheduler, scheduler_state, events)
+    return journal.Journal(path, checkpoint_lsn, commit_interval, name), restored, len(events)
+
+
+def set_test_case(rooms, room_id, temp, price=None):
+    if room_id in rooms:
+        rooms[room_id].initial_temp = temp
+        # Only set current_temp if not restored from DB (we'll handle this by re-applying DB state after)
+        rooms[room_id].current_temp = temp
+        rooms[room_id].room_price = price
+
+
+def log_session_segment(room_id, room, end_time, db=database):
+    """把当前空调会话 (从 current_session_start_time 到 end_time) 记为一条详单"""
+    duration = int((end_time - room.current_session_start_time).total_seconds())
+    session_fee = room.total_fee - room.current_session_fee_start
+
+    db.log_ac_session(
+        room_id,
+        room.current_session_start_time, # Request time (approx)
+        room.current_session_start_time, # Start time
+        end_time,
+        duration,
+        room.fan_speed, # Log with the speed of the ending segment
+        session_fee,
+        room.total_fee
+    )
+
+
+def control_error(rooms, room_id):
+    """房间不存在或未入住时返回 (错误, 状态码)，否则返回 None"""
+    if room_id not in rooms:
+        return {"error": "Room not found"}, 404
+
+    # Check if room is occupied
+    if rooms[room_id].is_free:
+        return {"error": "Room is not checked in. AC control disabled."}, 403
+    return None
+
+
+def validate_control(rooms, command):
+    """批量控制中的一条命令 {"room_id", "power_on"?, "target_temp"?, "fan_speed"?}，无效时返回 (错误, 状态码)"""
+    if not isinstance(command, dict) or not isinstance(command.get('room_id'), str):
+        return {"error": "Each command needs a room_id"}, 400
+    error = control_error(rooms, command['room_id'])
+    if error is not None:
+        return error
+    if not any(field in command for field in ('power_on', 'target_temp', 'fan_speed')):
+        return {"error": "Nothing to change (power_on / target_temp / fan_speed)"}, 400
+    if 'power_on' in command and not isinstance(command['power_on'], bool):
+        return {"error": "power_on must be true or false"}, 400
+    if 'target_temp' in command and (isinstance(command['target_temp'], bool)
+                                     or not isinstance(command['target_temp'], numbers.Real)):
+        return {"error": "target_temp must be a number"}, 400
+    if 'fan_speed' in command and command['fan_speed'] not in SPEED_PRIORITY:
+        return {"error": f"fan_speed must be one of {', '.join(SPEED_PRIORITY)}"}, 400
+    return None
+
+
+def control_room(rooms, scheduler, room_id, data, db=database):
+    error = control_error(rooms, room_id)
+    if error is not None:
+        return error
+    room = rooms[room_id]
+    apply_control(room, scheduler, room_id, data, db)
+    return {"status": "success", "current_state": room.to_dict()}, 200
+
+
+def apply_control(room, scheduler, room_id, data, db=database):
+    """执行一条控制命令 (已检查房间存在且已入住)"""
+    if 'power_on' in data:
+        new_power_state = data['power_on']
+
+        # Logic: Manual ON -> OFF cycle counts as 1 day stay
+        if room.power_on and not new_power_state:
+            room.stay_days += 1
+            print(f"[Billing] Room {room_id} stay_days increased to {room.stay_days}")
+            db.update_stay_days(room_id, room.stay_days)
+
+            # Log AC Session
+            if room.current_session_start_time:
+                log_session_segment(room_id, room, scheduler.clock.now(), db)
+                room.current_session_start_time = None
+
+        room.power_on = new_power_state
+
+        # Reset target temp to default (25.0) and fan speed to Mid on power switch
+        room.target_temp = 25.0
+        room.fan_speed = "Mid"
+
+        print(f"[Control] Room {room_id} Power -> {room.power_on}")
+        if room.power_on:
+            scheduler.request_service(room_id, room.fan_speed)
+            # Start Session Logging
+            room.current_session_start_time = scheduler.clock.now()
+            room.current_session_fee_start = room.total_fee
+        else:
+            scheduler.release_service(room_id)
+            room.is_active = False
+        room.touch()
+
+    if 'target_temp' in data:
+        room.target_temp = data['target_temp']
+        print(f"[Control] Room {room_id} Target Temp -> {room.target_temp}")
+        room.touch()
+        if room.power_on and not room.is_active:
+            diff = room.current_temp - room.target_temp
+            if abs(diff) > 1.0:
+                scheduler.request_service(room_id, room.fan_speed)
+
+    if 'fan_speed' in data:
+        new_speed = data['fan_speed']
+
+        # If speed changes while ON, log the previous session segment
+        if room.power_on and room.fan_speed != new_speed:
+            if room.current_session_start_time:
+                end_time = scheduler.clock.now()
+                log_session_segment(room_id, room, end_time, db)
+                # Start new session segment
+                room.current_session_start_time = end_time
+                room.current_session_fee_start = room.total_fee
+
+        room.fan_speed = new_speed
+        print(f"[Control] Room {room_id} Fan Speed -> {room.fan_speed}")
+        room.touch()
+        if room.power_on:
+            scheduler.request_service(room_id, room.fan_speed)
+
+    room.bill_version += 1
+
+
+# apply_control 及其引起的调度 (抢占、补位) 可能修改的房间字段，批量控制失败时恢复
+CONTROL_FIELDS = (
+    'power_on', 'is_active', 'fan_speed', 'target_temp', 'stay_days',
+    'current_session_start_time', 'current_session_fee_start',
+    'dispatch_count', 'bill_version', 'version',
+)
+
+
+def save_rooms(rooms, room_ids):
+    return [(rooms[room_id], [getattr(rooms[room_id], field) for field in CONTROL_FIELDS]) for room_id in room_ids]
+
+
+def restore_rooms(saved):
+    for room, values in saved:
+        for field, value in zip(CONTROL_FIELDS, values):
+            setattr(room, field, value)
+
+
+def rejected_batch(commands, errors):
+    """有无效命令时的批量控制响应: 每条命令的检查结果 (errors 与 commands 一一对应)，都未执行"""
+    results = []
+    for command, error in zip(commands, errors):
+        result = {"room_id": command.get('room_id') if isinstance(command, dict) else None,
+                  "status": error[1] if error else 200, "applied": False}
+        if error:
+            result["error"] = error[0]["error"]
+        results.append(result)
+    return {"error": "Invalid commands, nothing applied", "results": results}, 400
+
+
+def control_rooms(rooms, scheduler, commands, db=database):
+    """
+    批量控制 (POST /api/rooms/control)。先检查全部命令，有一条无效时都不执行；
+    否则按顺序执行，调度器在最后统一重新分配一次 (而不是每条命令之后)，
+    详单与入住天数的写入合并为一个事务。写入失败时事务回滚，涉及的房间 (批量中的房间与原先在队列中的房间)
+    和调度队列恢复到执行前的状态，异常继续抛出。返回 ({"results": [每条命令的结果]}, 状态码)
+    """
+    errors = [validate_control(rooms, command) for command in commands]
+    if any(errors):
+        return rejected_batch(commands, errors)
+
+    affected = {command['room_id'] for command in commands}
+    affected.update(entry['room_id'] for entry in scheduler.service_queue)
+    affected.update(scheduler.waiting_ids())
+    saved_rooms = save_rooms(rooms, [room_id for room_id in affected if room_id in rooms])
+    saved_queues = scheduler.save()
+    try:
+        with db.transaction(), scheduler.deferred_rebalance():
+            for command in commands:
+                apply_control(rooms[command['room_id']], scheduler, command['room_id'], command, db)
+    except Exception:
+        scheduler.rollback(saved_queues)
+        restore_rooms(saved_rooms)
+        raise
+    # 结果在重新分配之后生成，is_active 反映最终的服务队列
+    return {"status": "success", "results": [
+        {"room_id": command['room_id'], "status": 200, "applied": True,
+         "current_state": rooms[command['room_id']].to_dict()}
+        for command in commands]}, 200
+
+
+def check_in(rooms, data, db=database):
+    room_id = data.get('room_id')
+    id_card = data.get('id_card')
+    name = data.get('name')
+    phone = data.get('phone')
+    deposit = float(data.get('deposit', 0))
+    food_orders = data.get('food_orders', []) # List of {name, price, count}
+    # days is no longer required from frontend, default to 0
+    days = 0
+
+    if not all([room_id, id_card, name]):
+        return {"error": "Missing required fields"}, 400
+
+    if room_id not in rooms:
+        return {"error": "Room not found"}, 404
+
+    room = rooms[room_id]
+    # Check if room is already occupied (optional, but good practice)
+    # For now, we assume we can overwrite or check-in
+
+    room.tenant_id = id_card
+    room.tenant_name = name
+    room.tenant_phone = phone
+    room.stay_days = days
+    room.deposit = deposit
+    room.food_orders = food_orders
+    room.is_free = False # Mark as occupied
+
+    # Calculate food fee
+    total_food = 0
+    for item in food_orders:
+        total_food += item.get('price', 0) * item.get('count', 0)
+    room.food_fee = total_food
+    room.bill_version += 1
+    room.touch()
+
+    # Save to DB
+    db.add_check_in(room_id, id_card, name, phone, days, deposit, json.dumps(food_orders))
+
+    print(f"[CheckIn] Room {room_id} checked in by {name}. Deposit: {deposit}, Food Fee: {total_food}")
+
+    return {"status": "success", "message": "Check-in successful"}, 200
+
+
+def check_out(rooms, scheduler, room_id, db=database):
+    if not room_id or room_id not in rooms:
+        return {"error": "Room not found"}, 404
+
+    room = rooms[room_id]
+
+    # Clear memory state
+    room.is_free = True
+    room.tenant_id = None
+    room.tenant_name = None
+    room.tenant_phone = None
+    room.stay_days = 0
+    room.power_on = False # Turn off AC
+    room.is_active = False
+    scheduler.release_service(room_id) # Stop service
+    room.bill_version += 1
+    room.touch()
+
+    # Update DB
+    db.check_out_db(room_id)
+
+    print(f"[CheckOut] Room {room_id} checked out.")
+    return {"status": "success", "message": "Check-out successful"}, 200
@@ -0,0 +1,202 @@
+"""
+离线场景测试引擎
+
+从数据文件 (默认 AC_control_console/scenarios.json) 读取测试场景: 房间初始温度与房价、
+每分钟的控制操作。场景直接在进程内用 Room / Scheduler 运行，不需要启动后端服务，
+也不写数据库；每分钟记录一次目标房间的当前温度、目标温度、风速、费用以及服务/等待队列，
+输出与 test_runner_for_*.py 相同的表格 (CSV 或 xlsx)。
+
+用法:
+    python scenario.py                          # 运行数据文件中的全部场景，输出 CSV
+    python scenario.py --only hot --format xlsx # 只运行 hot 场景，输出 xlsx (需要 pandas + openpyxl)
+    python scenario.py --workers 4              # 多进程并行运行
+    python scenario.py --rebalance tick         # 调度器按步进合并补位 (Config.SCHEDULER_REBALANCE)
+    python scenario.py --check-rebalance        # 分别以 eager / tick 运行，检查两种补位方式的结果是否一致
+"""
+import argparse
+import contextlib
+import csv
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import hotel
+import room_service
+from clock import SimulatedClock
+from hotel import Room, Scheduler
+
+DEFAULT_SCENARIO_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'scenarios.json')
+
+# 操作类型 -> 控制接口字段
+ACTIONS = {
+    'power': 'power_on',
+    'temp': 'target_temp',
+    'speed': 'fan_speed',
+}
+
+
+class NullDatabase:
+    """不落盘的数据库替身，只在内存中记录详单"""
+
+    def __init__(self):
+        self.sessions = []
+
+    def log_ac_session(self, *row):
+        self.sessions.append(row)
+
+    def update_stay_days(self, room_id, days):
+        pass
+
+    def add_check_in(self, *args):
+        pass
+
+    def check_out_db(self, room_id):
+        pass
+
+
+def load_scenarios(path=DEFAULT_SCENARIO_FILE):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def action_payload(action_type, value):
+    if action_type not in ACTIONS:
+        raise ValueError(f"Unknown action type: {action_type}")
+    return {ACTIONS[action_type]: value}
+
+
+def build_rooms(scenario):
+    """按场景创建已入住的房间和调度器 (模拟时钟，详单时长与逐秒模拟一致)"""
+    rooms = {}
+    for room_id, spec in scenario['rooms'].items():
+        room = Room(room_id, int(room_id[0]), spec['initial_temp'])
+        if 'price' in spec:
+            room.room_price = spec['price']
+        room.is_free = False
+        rooms[room_id] = room
+    return rooms, Scheduler(rooms, SimulatedClock())
+
+
+def snapshot_row(minute, rooms, scheduler, target_rooms):
+    """与 HTTP 测试脚本相同的一行: 各房间状态 + 服务队列 + 等待队列"""
+    row = {"Time (min)": minute}
+    service_queue = []
+    waiting_queue = []
+    for rid in target_rooms:
+        room = rooms[rid]
+        prefix = f"Room {rid}"
+        row[f"{prefix} Current"] = round(room.current_temp, 2)
+        row[f"{prefix} Target"] = room.target_temp
+        row[f"{prefix} Speed"] = room.fan_speed if room.power_on else "OFF"
+        row[f"{prefix} Fee"] = round(room.total_fee, 2)
+        if room.is_active:
+            service_queue.append(rid)
+        elif scheduler.is_waiting(rid):
+            waiting_queue.append(rid)
+    row["Service Queue"] = ", ".join(service_queue)
+    row["Waiting Queue"] = ", ".join(waiting_queue)
+    return row
+
+
+def run_scenario(scenario, verbose=False):
+    """运行一个场景，返回每分钟一行的表格 [dict, ...]"""
+    rooms, scheduler = build_rooms(scenario)
+    db = NullDatabase()
+    actions = {int(minute): items for minute, items in scenario.get('actions', {}).items()}
+    target_rooms = scenario.get('target_rooms', list(scenario['rooms']))
+    rows = []
+
+    with contextlib.ExitStack() as stack:
+        if not verbose:
+            stack.enter_context(contextlib.redirect_stdout(stack.enter_context(open(os.devnull, 'w'))))
+        for minute in range(scenario.get('minutes', 26)):
+            for room_id, action_type, value in actions.get(minute, []):
+                _, status = room_service.control_room(rooms, scheduler, room_id,
+                                                      action_payload(action_type, value), db)
+                if status != 200:
+                    print(f"  Action: Room {room_id} {action_type}={value} rejected ({status})")
+            rows.append(snapshot_row(minute, rooms, scheduler, target_rooms))
+            # 前进 1 分钟 (与 /api/test/tick 逐秒推进结果一致)
+            hotel.fast_forward(rooms, scheduler, 60)
+    return rows
+
+
+def _run_named(args):
+    name, scenario, verbose, rebalance = args
+    if rebalance is not None:
+        hotel.Config.SCHEDULER_REBALANCE = rebalance
+    start = time.perf_counter()
+    rows = run_scenario(scenario, verbose)
+    return name, rows, time.perf_counter() - start
+
+
+def run_scenarios(scenarios, workers=1, verbose=False, rebalance=None):
+    """
+    运行多个场景 {name: scenario}，workers > 1 时多进程并行；返回 {name: (rows, 耗时秒)}。
+    rebalance 为 'eager' / 'tick' 时以该补位方式运行 (见 Config.SCHEDULER_REBALANCE)
+    """
+    jobs = [(name, scenario, verbose, rebalance) for name, scenario in scenarios.items()]
+    if workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            finished = list(pool.map(_run_named, jobs))
+    else:
+        finished = [_run_named(job) for job in jobs]
+    return {name: (rows, elapsed) for name, rows, elapsed in finished}
+
+
+def write_csv(rows, path):
+    with open(path, 'w', newline='', encoding='utf-8-sig') as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def write_xlsx(rows, path):
+    import pandas as pd
+    pd.DataFrame(rows).to_excel(path, index=False)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run AC scheduling scenarios in-process")
+    parser.add_argument('file', nargs='?', default=DEFAULT_SCENARIO_FILE, help="scenario data file (JSON)")
+    parser.add_argument('--only', help="comma separated scenario names")
+    parser.add_argument('--format', choices=['csv', 'xlsx'], default='csv')
+    parser.add_argument('--out-dir', default='.')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--verbose', action='store_true', help="show scheduler output")
+    parser.add_argument('--rebalance', choices=['eager', 'tick'], help="scheduler rebalance mode")
+    parser.add_argument('--check-rebalance', action='store_true',
+                        help="run with both rebalance modes and check that the results match")
+    args = parser.parse_args(argv)
+
+    scenarios = load_scenarios(args.file)
+    if args.only:
+        names = args.only.split(',')
+        missing = [name for name in names if name not in scenarios]
+        if missing:
+            parser.error(f"unknown scenarios: {', '.join(missing)}")
+        scenarios = {name: scenarios[name] for name in names}
+
+    if args.check_rebalance:
+        eager = run_scenarios(scenarios, args.workers, args.verbose, 'eager')
+        tick = run_scenarios(scenarios, args.workers, args.verbose, 'tick')
+        mismatched = [name for name in scenarios if eager[name][0] != tick[name][0]]
+        for name in scenarios:
+            print(f"{name}: eager {eager[name][1] * 1000:.1f} ms, tick {tick[name][1] * 1000:.1f} ms, "
+                  f"{'MISMATCH' if name in mismatched else 'identical'}")
+        return 1 if mismatched else 0
+
+    # 在运行场景之前创建输出目录，目录无法创建时不必等场景跑完才失败
+    os.makedirs(args.out_dir, exist_ok=True)
+    writer = write_xlsx if args.format == 'xlsx' else write_csv
+    for name, (rows, elapsed) in run_scenarios(scenarios, args.workers, args.verbose, args.rebalance).items():
+        path = os.path.join(args.out_dir, f"{scenarios[name].get('output', name)}.{args.format}")
+        writer(rows, path)
+        print(f"{name}: {len(rows)} minutes in {elapsed * 1000:.1f} ms -> {path}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
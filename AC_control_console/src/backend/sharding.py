@@ -0,0 +1,397 @@
+"""
+分片模拟: 把房间按楼层 (或逐个房间轮流) 划分到多个工作进程，
+每个工作进程持有自己的房间、Scheduler 和逐秒模拟循环，不再与 Flask 争用同一个 GIL。
+
+Flask 进程通过本地 socket (multiprocessing.connection) 把控制、入住、退房等请求
+转发给房间所在的分片；分片在每次 tick 和每个请求之后把变化的房间状态推送回来，
+Flask 进程据此维护一份只读的房间镜像，供查询接口和 SSE 推送使用。
+
+注意: 每个分片独立调度，服务对象上限 Config.MAX_SERVICE_SLOTS 按分片计算。
+每个分片记录自己的事件日志 (shard-N，见 journal.py)，启动时重放后再开始模拟。
+"""
+import os
+import secrets
+import subprocess
+import sys
+import threading
+import time
+import queue
+from multiprocessing.connection import Listener, Client
+
+import database
+import hotel
+import room_service
+from hotel import Config, Room, Scheduler, STATE_FIELDS
+from persister import StatePersister
+
+AUTHKEY_ENV = 'HOTEL_SHARD_AUTHKEY'
+
+
+class ShardError(RuntimeError):
+    pass
+
+
+def partition_rooms(keys, shard_count, key='floor'):
+    """
+    把 [(room_id, floor), ...] 划分为 shard_count 份。
+    key='floor': 同一楼层的房间在同一分片 (楼层轮流分配); key='room': 房间逐个轮流分配
+    """
+    if shard_count < 1:
+        raise ValueError("shard_count must be at least 1")
+    if key not in ('floor', 'room'):
+        raise ValueError(f"Unknown shard key: {key}")
+    parts = [[] for _ in range(shard_count)]
+    floors = {}
+    for i, (room_id, floor) in enumerate(keys):
+        if key == 'floor':
+            index = floors.setdefault(floor, len(floors) % shard_count)
+        else:
+            index = i % shard_count
+        parts[index].append((room_id, floor))
+    return [part for part in parts if part]
+
+
+def room_fields(room):
+    return {name: getattr(room, name) for name in STATE_FIELDS}
+
+
+# --- Worker process ---
+class ShardWorker:
+    """在工作进程中运行: 持有一个分片的房间并逐秒模拟"""
+
+    def __init__(self, shard_id, keys, conn):
+        self.shard_id = shard_id
+        self.conn = conn
+        if Config.SIMULATION_ENGINE == 'vector':
+            from vector_engine import VectorEngine
+            self.engine = VectorEngine()
+            self.rooms = self.engine.rooms
+            make_room = self.engine.add_room
+        else:
+            self.engine = None
+            self.rooms = {}
+            make_room = Room
+        room_service.load_rooms(self.rooms, make_room, keys)
+        self.scheduler = Scheduler(self.rooms)
+        self.is_simulation_mode = False
+        self.sent_version = 0
+        journal = None
+        recovered = ()
+        if Config.JOURNAL_ENABLED:
+            journal, recovered, replayed = room_service.open_journal(
+                f"shard-{shard_id}", self.rooms, self.scheduler, Config.JOURNAL_COMMIT_INTERVAL)
+            if replayed:
+                print(f"[Shard {shard_id}] Replayed {replayed} journal events")
+        self.persister = StatePersister(database.update_room_states, Config.PERSIST_INTERVAL, journal)
+        for room_id in sorted(recovered):
+            self.persister.mark_dirty(self.rooms[room_id], 'recovered')
+        self.persister.mark_scheduler(self.scheduler)
+        self.persisted_version = Room.versions.latest
+        self.last_tick_seconds = 0.0
+        self.running = True
+
+    def changes(self):
+        """自上次发送以来变化的房间 [(room_id, version, fields), ...]"""
+        changed = [(room_id, room.version, room_fields(room))
+                   for room_id, room in self.rooms.items() if room.version > self.sent_version]
+        if changed:
+            self.sent_version = max(version for _, version, _ in changed)
+        return changed
+
+    def run_simulation_step(self):
+        if self.engine is not None:
+            self.engine.step(self.scheduler)
+        else:
+            hotel.run_simulation_step(self.rooms, self.scheduler)
+
+    def fast_forward(self, seconds):
+        if self.engine is not None:
+            self.engine.fast_forward(self.scheduler, seconds)
+        else:
+            hotel.fast_forward(self.rooms, self.scheduler, seconds)
+
+    def tick(self):
+        if not self.is_simulation_mode:
+            start = time.perf_counter()
+            self.run_simulation_step()
+            self.last_tick_seconds = time.perf_counter() - start
+            self.persisted_version = self.persister.mark_changed(self.rooms, self.persisted_version,
+                                                                 self.scheduler.ticks)
+            self.persister.mark_scheduler(self.scheduler)
+        changed = self.changes()
+        if changed:
+            self.conn.send(('update', changed, list(self.scheduler.waiting_ids()), self.stats()))
+
+    def stats(self):
+        return {"last_tick_seconds": self.last_tick_seconds,
+                "preemptions": self.scheduler.preemptions,
+                "expired_slices": self.scheduler.expired_slices,
+                "rebalances": self.scheduler.rebalances}
+
+    # 请求处理: op_<name>(*args) 的返回值随变化的房间状态一起回复给 Flask 进程
+    def op_snapshot(self):
+        self.sent_version = 0
+        return None
+
+    def record_change(self, kind, room_id, outcome):
+        """成功的操作写入事件日志，日志提交后才回复 Flask 进程"""
+        return self.record_changes(kind, [room_id], outcome)
+
+    def record_changes(self, kind, room_ids, outcome):
+        if outcome[1] == 200:
+            self.persister.mark_scheduler(self.scheduler)
+            lsn = None
+            for room_id in dict.fromkeys(room_ids):
+                lsn = self.persister.mark_dirty(self.rooms[room_id], kind)
+            self.persister.wait_durable(lsn)
+        return outcome
+
+    def op_control(self, room_id, data):
+        return self.record_change('control', room_id,
+                                  room_service.control_room(self.rooms, self.scheduler, room_id, data))
+
+    def op_validate_controls(self, batch):
+        return [room_service.validate_control(self.rooms, command) for command in batch]
+
+    def op_control_batch(self, batch):
+        return self.record_changes('control', [command['room_id'] for command in batch],
+                                   room_service.control_rooms(self.rooms, self.scheduler, batch))
+
+    def op_check_in(self, data):
+        return self.record_change('check_in', data.get('room_id'), room_service.check_in(self.rooms, data))
+
+    def op_check_out(self, room_id):
+        return self.record_change('check_out', room_id,
+                                  room_service.check_out(self.rooms, self.scheduler, room_id))
+
+    def op_set_simulation_mode(self, enabled):
+        self.is_simulation_mode = enabled
+        self.scheduler.set_test_mode(enabled)
+
+    def op_tick(self, seconds, fast):
+        if fast:
+            self.fast_forward(seconds)
+        else:
+            for _ in range(seconds):
+                self.run_simulation_step()
+
+    def op_stop(self):
+        self.running = False
+        self.persister.stop()
+
+    def handle(self, message):
+        op, args = message
+        try:
+            result = getattr(self, f"op_{op}")(*args)
+        except Exception as e:
+            self.conn.send(('error', f"{type(e).__name__}: {e}"))
+            return
+        self.conn.send(('reply', result, self.changes(), list(self.scheduler.waiting_ids()), self.stats()))
+
+    def run(self):
+        self.persister.start()
+        interval = self.scheduler.clock.tick_interval
+        next_tick = time.monotonic() + interval
+        try:
+            while self.running:
+                timeout = next_tick - time.monotonic()
+                if timeout > 0 and self.conn.poll(timeout):
+                    self.handle(self.conn.recv())
+                    continue
+                self.tick()
+                next_tick += interval
+                # tick 耗时超过间隔时不追赶，从当前时刻重新计时
+                if next_tick < time.monotonic():
+                    next_tick = time.monotonic() + interval
+        except (EOFError, OSError):
+            # Flask 进程已退出
+            self.persister.stop()
+
+
+def worker_main(argv):
+    shard_id, port = int(argv[1]), int(argv[2])
+    authkey = bytes.fromhex(os.environ[AUTHKEY_ENV])
+    conn = Client(('127.0.0.1', port), authkey=authkey)
+    conn.send(('hello', shard_id))
+    keys = conn.recv()
+    worker = ShardWorker(shard_id, keys, conn)
+    print(f"[Shard {shard_id}] Serving {len(keys)} rooms")
+    conn.send(('ready', shard_id))
+    worker.run()
+
+
+# --- Flask side ---
+class ShardRouter:
+    """
+    在 Flask 进程中运行: 启动分片进程，把房间请求转发给所属分片，
+    并把分片推送的状态写入本进程的房间镜像 (rooms)。
+    提供 is_waiting / waiting_ids，可代替 Scheduler 供查询接口使用。
+    """
+
+    def __init__(self, rooms, keys, shard_count, key='floor', lock=None):
+        self.rooms = rooms
+        self.lock = lock if lock is not None else threading.RLock()
+        self.partitions = partition_rooms(keys, shard_count, key)
+        self.shard_of = {room_id: index
+                         for index, part in enumerate(self.partitions) for room_id, _ in part}
+        for room_id, floor in keys:
+            self.rooms[room_id] = Room(room_id, floor)
+        self._seen = {}
+        self._waiting = [set() for _ in self.partitions]
+        # 各分片最近一次推送的统计 (ShardWorker.stats)
+        self.shard_stats = [{"last_tick_seconds": 0.0, "preemptions": 0, "expired_slices": 0, "rebalances": 0}
+                            for _ in self.partitions]
+        self._conns = []
+        self._replies = []
+        self._call_locks = []
+        self._processes = []
+
+    def start(self, timeout=30):
+        authkey = secrets.token_bytes(16)
+        env = dict(os.environ, **{AUTHKEY_ENV: authkey.hex()})
+        script = os.path.abspath(__file__)
+        with Listener(('127.0.0.1', 0), authkey=authkey) as listener:
+            port = listener.address[1]
+            for index in range(len(self.partitions)):
+                self._processes.append(subprocess.Popen(
+                    [sys.executable, script, str(index), str(port)],
+                    cwd=os.path.dirname(script), env=env))
+            conns = {}
+            for _ in self.partitions:
+                conn = listener.accept()
+                _, index = conn.recv()
+                conn.send(self.partitions[index])
+                conns[index] = conn
+        for index in range(len(self.partitions)):
+            conn = conns[index]
+            if not conn.poll(timeout):
+                raise ShardError(f"Shard {index} did not start")
+            conn.recv()
+            self._conns.append(conn)
+            self._replies.append(queue.Queue())
+            self._call_locks.append(threading.Lock())
+        for index in range(len(self.partitions)):
+            threading.Thread(target=self._read, args=(index,), daemon=True).start()
+        self.broadcast('snapshot')
+
+    def _read(self, index):
+        conn = self._conns[index]
+        while True:
+            try:
+                message = conn.recv()
+            except (EOFError, OSError):
+                self._replies[index].put(('error', f"Shard {index} exited"))
+                return
+            if message[0] == 'update':
+                _, changed, waiting, stats = message
+                self.shard_stats[index] = stats
+                self._apply(index, changed, waiting)
+            else:
+                self._replies[index].put(message)
+
+    def _apply(self, index, changed, waiting):
+        with self.lock:
+            for room_id, version, fields in changed:
+                # 回复与推送经同一连接按顺序到达，但仍只接受更新的版本
+                if version <= self._seen.get(room_id, 0):
+                    continue
+                self._seen[room_id] = version
+                room = self.rooms[room_id]
+                for name, value in fields.items():
+                    setattr(room, name, value)
+                room.touch()
+            self._waiting[index] = set(waiting)
+
+    def _finish(self, index):
+        reply = self._replies[index].get()
+        if reply[0] == 'error':
+            raise ShardError(reply[1])
+        _, result, changed, waiting, stats = reply
+        self.shard_stats[index] = stats
+        self._apply(index, changed, waiting)
+        return result
+
+    def call(self, index, op, *args):
+        with self._call_locks[index]:
+            self._conns[index].send((op, args))
+            return self._finish(index)
+
+    def call_room(self, room_id, op, *args):
+        return self.call(self.shard_of[room_id], op, *args)
+
+    def broadcast(self, op, *args):
+        """向所有分片发送同一请求，分片并行执行，返回各分片的结果"""
+        return list(self.scatter(op, {index: args for index in range(len(self._conns))}).values())
+
+    def scatter(self, op, args_by_shard):
+        """向部分分片各发送一个请求 ({分片: 参数})，分片并行执行，返回 {分片: 结果}"""
+        indexes = sorted(args_by_shard)
+        for index in indexes:
+            self._call_locks[index].acquire()
+        try:
+            for index in indexes:
+                self._conns[index].send((op, args_by_shard[index]))
+            return {index: self._finish(index) for index in indexes}
+        finally:
+            for index in indexes:
+                self._call_locks[index].release()
+
+    def control_rooms(self, batch):
+        """
+        批量控制 (见 room_service.control_rooms): 各分片先检查自己的命令，全部有效后再并行执行，
+        每个分片只重新分配一次。返回 (结果, 状态码)，results 的顺序与命令相同
+        """
+        positions = {}
+        for position, command in enumerate(batch):
+            room_id = command.get('room_id') if isinstance(command, dict) else None
+            positions.setdefault(self.shard_of.get(room_id), []).append(position)
+        # 不属于任何分片的命令 (格式错误或房间不存在) 直接在本进程检查
+        errors = {position: room_service.validate_control({}, batch[position]) for position in positions.pop(None, [])}
+        checked = self.scatter('validate_controls', {index: ([batch[p] for p in group],)
+                                                     for index, group in positions.items()})
+        for index, group in positions.items():
+            errors.update(zip(group, checked[index]))
+        if any(errors.values()):
+            return room_service.rejected_batch(batch, [errors[position] for position in range(len(batch))])
+
+        outcomes = self.scatter('control_batch', {index: ([batch[p] for p in group],)
+                                                  for index, group in positions.items()})
+        results = [None] * len(batch)
+        status = 200
+        for index, group in positions.items():
+            result, shard_status = outcomes[index]
+            status = max(status, shard_status)
+            for position, item in zip(group, result['results']):
+                results[position] = item
+        return {"status": "success" if status == 200 else "partially applied", "results": results}, status
+
+    def is_waiting(self, room_id):
+        index = self.shard_of.get(room_id)
+        return index is not None and room_id in self._waiting[index]
+
+    def waiting_ids(self):
+        return set().union(*self._waiting)
+
+    def stats(self):
+        return [
+            dict({"shard": index, "rooms": len(part),
+                  "alive": self._processes[index].poll() is None if self._processes else False},
+                 **self.shard_stats[index])
+            for index, part in enumerate(self.partitions)
+        ]
+
+    def stop(self, timeout=10):
+        """通知分片写入剩余状态并退出"""
+        try:
+            self.broadcast('stop')
+        except (ShardError, OSError):
+            pass
+        for process in self._processes:
+            try:
+                process.wait(timeout)
+            except subprocess.TimeoutExpired:
+                process.terminate()
+
+
+if __name__ == '__main__':
+    worker_main(sys.argv)
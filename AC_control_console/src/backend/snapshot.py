@@ -0,0 +1,94 @@
+from array import array
+from functools import partial
+from operator import add, attrgetter, itemgetter
+from types import MappingProxyType
+
+from hotel import Room, STATE_FIELDS, speed_stats_dict
+
+# RoomView 的全部属性按此顺序保存在一个元组中。需要拷贝的容器排在最后，其余属性一次批量取值
+_CONTAINERS = ('food_orders', 'speed_counters')
+VIEW_FIELDS = (('room_id', 'floor', 'version') + tuple(name for name in STATE_FIELDS if name not in _CONTAINERS)
+               + _CONTAINERS + ('is_waiting',))
+_fields_of = attrgetter(*VIEW_FIELDS[:-3])
+_food_orders_of = attrgetter('food_orders')
+_counters_of = attrgetter('speed_counters')
+
+
+class RoomView(tuple):
+    """
+    房间在某次发布时的只读副本，属性与 Room 相同 (to_dict 输出一致)。
+    查询接口只读取副本，不会与模拟循环争用房间对象。
+    副本本身就是按 VIEW_FIELDS 排列的属性值元组，第一份快照可以不经 Python 代码批量创建 (见 build_snapshot)。
+    """
+
+    def __new__(cls, room, is_waiting):
+        # 模拟循环会原地修改这些容器，副本需要自己的拷贝 (从未服务过的房间分项统计为 None)
+        counters = room.speed_counters
+        return _new_view(_fields_of(room) + (list(room.food_orders),
+                                             None if counters is None else array('d', counters), is_waiting))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("RoomView is read-only")
+
+    to_dict = Room.to_dict
+
+    @property
+    def speed_stats(self):
+        return speed_stats_dict(self.speed_counters)
+
+    def state(self):
+        """房间状态接口与 SSE 推送共用的数据 (to_dict + is_waiting + version)，只生成一次"""
+        cache = self.__dict__
+        state = cache.get('_state')
+        if state is None:
+            state = self.to_dict()
+            state['is_waiting'] = self.is_waiting
+            state['version'] = self.version
+            cache['_state'] = state
+        return state
+
+
+# 由属性值元组创建副本
+_new_view = partial(tuple.__new__, RoomView)
+
+for _index, _name in enumerate(VIEW_FIELDS):
+    setattr(RoomView, _name, property(itemgetter(_index)))
+del _index, _name
+
+
+class StateSnapshot:
+    """所有房间在同一时刻的一致只读快照"""
+
+    def __init__(self, version, rooms, waiting_ids):
+        self.version = version
+        self.rooms = MappingProxyType(rooms)
+        self._waiting_ids = frozenset(waiting_ids)
+
+    def is_waiting(self, room_id):
+        return room_id in self._waiting_ids
+
+    def waiting_ids(self):
+        return self._waiting_ids
+
+
+def build_snapshot(rooms, scheduler, previous=None):
+    """生成新快照: 只为 previous 之后变化过的房间创建副本，其余房间沿用上一份快照中的副本"""
+    waiting_ids = set(scheduler.waiting_ids())
+    if previous is None:
+        # 第一份快照 (启动时) 没有可沿用的副本: 与 RoomView() 相同的值，全部由 map / zip 批量生成
+        values = rooms.values()
+        counters = list(map(_counters_of, values))
+        if counters.count(None) != len(counters):
+            counters = [None if c is None else array('d', c) for c in counters]
+        tails = zip(map(list, map(_food_orders_of, values)), counters, map(waiting_ids.__contains__, rooms))
+        views = dict(zip(rooms, map(_new_view, map(add, map(_fields_of, values), tails))))
+        return StateSnapshot(Room.versions.latest, views, waiting_ids)
+    old = previous.rooms
+    views = {}
+    for room_id, room in rooms.items():
+        is_waiting = room_id in waiting_ids
+        view = old.get(room_id)
+        if view is None or view.version != room.version or view.is_waiting != is_waiting:
+            view = RoomView(room, is_waiting)
+        views[room_id] = view
+    return StateSnapshot(Room.versions.latest, views, waiting_ids)
@@ -0,0 +1,22 @@
+"""
+后端测试 (pytest)。在 AC_control_console/src/backend 下运行: python -m pytest -q tests
+测试只使用临时数据库 (tmp_db)，不会修改 hotel.db。
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database  # noqa: E402
+
+
+@pytest.fixture
+def tmp_db(tmp_path):
+    """切换到临时数据库并建表，结束后恢复原来的路径"""
+    old_path = database.DB_PATH
+    database.configure(path=str(tmp_path / 'test.db'))
+    database.init_db()
+    yield database
+    database.configure(path=old_path)
@@ -0,0 +1,49 @@
+"""账单缓存 (bill_cache.BillCache): 详单太多不缓存时的流式读取"""
+import sqlite3
+import threading
+
+import pytest
+
+from bill_cache import BillCache
+
+
+def _log_sessions(db, room_id, count):
+    with db.transaction():
+        for i in range(count):
+            db.log_ac_session(room_id, f"r{i:05d}", f"s{i:05d}", f"e{i:05d}", 60, 'Mid', 0.5, 0.5 * (i + 1))
+
+
+def test_streamed_sessions_read_on_another_thread(tmp_db):
+    _log_sessions(tmp_db, '101', 50)
+    bills = BillCache(tmp_db.get_room_check_in_info, tmp_db.iter_ac_sessions, max_sessions=10)
+    sessions = bills.sessions('101', 1)
+
+    # asyncio 模式下响应体由线程池中的另一个线程继续读取
+    result = []
+    reader = threading.Thread(target=lambda: result.extend(sessions))
+    reader.start()
+    reader.join()
+
+    assert [row[1] for row in result] == [f"s{i:05d}" for i in range(50)]
+    assert bills.stats()['sessions'] == 0
+
+
+def test_abandoned_stream_closes_its_connection(tmp_db, monkeypatch):
+    _log_sessions(tmp_db, '101', 50)
+    opened = []
+    open_connection = tmp_db._open_connection
+
+    def tracking_open():
+        conn = open_connection()
+        opened.append(conn)
+        return conn
+
+    monkeypatch.setattr(tmp_db, '_open_connection', tracking_open)
+    bills = BillCache(tmp_db.get_room_check_in_info, tmp_db.iter_ac_sessions, max_sessions=10)
+    sessions = bills.sessions('101', 1)
+    next(sessions)
+    sessions.close()   # 下载中断
+
+    assert len(opened) == 1
+    with pytest.raises(sqlite3.ProgrammingError):
+        opened[0].execute('SELECT 1')   # 连接已关闭
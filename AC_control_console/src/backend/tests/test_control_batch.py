@@ -0,0 +1,106 @@
+"""批量控制 (room_service.control_rooms): 写入数据库失败时内存中的房间与调度队列整体回滚"""
+import contextlib
+import io
+
+import pytest
+
+import room_service
+from clock import SimulatedClock
+from hotel import Config, Room, Scheduler
+
+
+class FailingDatabase:
+    """委托给真实数据库模块，第 fail_at 次写入 (详单 / 入住天数) 时抛出异常"""
+
+    def __init__(self, db, fail_at):
+        self.db = db
+        self.fail_at = fail_at
+        self.writes = 0
+
+    def transaction(self):
+        return self.db.transaction()
+
+    def _write(self, name, *args):
+        self.writes += 1
+        if self.writes == self.fail_at:
+            raise RuntimeError("disk full")
+        return getattr(self.db, name)(*args)
+
+    def log_ac_session(self, *args):
+        return self._write('log_ac_session', *args)
+
+    def update_stay_days(self, *args):
+        return self._write('update_stay_days', *args)
+
+
+def build_hotel():
+    rooms = {}
+    for i, temp in enumerate([32.0, 28.0, 30.0, 29.0, 35.0, 10.0]):
+        room_id = f"1{i + 1:02d}"
+        room = Room(room_id, 1, temp)
+        room.is_free = False
+        rooms[room_id] = room
+    scheduler = Scheduler(rooms, SimulatedClock(start=1_000_000))
+    return rooms, scheduler
+
+
+def room_state(rooms):
+    return {room_id: [getattr(room, field) for field in room_service.CONTROL_FIELDS]
+            for room_id, room in rooms.items()}
+
+
+def queue_state(scheduler):
+    return scheduler.export_state(), scheduler.revision
+
+
+@pytest.mark.parametrize('fail_at', [1, 2, 3])
+def test_failed_batch_restores_rooms_and_queues(tmp_db, fail_at):
+    rooms, scheduler = build_hotel()
+    with contextlib.redirect_stdout(io.StringIO()):
+        # 4 间房开机: 服务队列已满 (3)，一间在等待
+        for room_id in ['101', '102', '103', '104']:
+            room_service.control_room(rooms, scheduler, room_id, {'power_on': True}, tmp_db)
+        for _ in range(30):
+            scheduler.check_time_slices()
+        assert len(scheduler.service_queue) == Config.MAX_SERVICE_SLOTS
+        before_rooms, before_queues = room_state(rooms), queue_state(scheduler)
+        sessions = len(tmp_db.get_ac_sessions('101'))
+
+        # 三条关机命令各写两行 (入住天数 + 详单)，加上开机与调风速引起的抢占
+        batch = [
+            {'room_id': '105', 'power_on': True, 'fan_speed': 'High'},
+            {'room_id': '101', 'power_on': False},
+            {'room_id': '102', 'power_on': False},
+            {'room_id': '106', 'power_on': True},
+            {'room_id': '103', 'power_on': False},
+        ]
+        db = FailingDatabase(tmp_db, fail_at)
+        with pytest.raises(RuntimeError):
+            room_service.control_rooms(rooms, scheduler, batch, db)
+
+    assert room_state(rooms) == before_rooms
+    assert queue_state(scheduler) == before_queues
+    # 事务回滚: 失败之前的写入也没有提交
+    assert len(tmp_db.get_ac_sessions('101')) == sessions
+    assert tmp_db.get_connection().execute('SELECT COUNT(*) FROM ac_sessions').fetchone()[0] == 0
+
+
+def test_scheduler_keeps_working_after_rollback(tmp_db):
+    rooms, scheduler = build_hotel()
+    reference_rooms, reference = build_hotel()
+    batch = [{'room_id': room_id, 'power_on': True} for room_id in ['101', '102', '103', '104', '105']]
+    with contextlib.redirect_stdout(io.StringIO()):
+        room_service.control_room(rooms, scheduler, '106', {'power_on': True}, tmp_db)
+        room_service.control_room(reference_rooms, reference, '106', {'power_on': True}, tmp_db)
+        with pytest.raises(RuntimeError):
+            room_service.control_rooms(rooms, scheduler, batch + [{'room_id': '106', 'power_on': False}],
+                                       FailingDatabase(tmp_db, 1))
+        # 回滚后再执行同样的 (不失败的) 批量，结果与从未失败过相同
+        room_service.control_rooms(rooms, scheduler, batch, tmp_db)
+        room_service.control_rooms(reference_rooms, reference, batch, tmp_db)
+        for _ in range(200):
+            scheduler.check_time_slices()
+            reference.check_time_slices()
+    assert scheduler.export_state()['service'] == reference.export_state()['service']
+    assert scheduler.export_state()['waiting'] == reference.export_state()['waiting']
+    assert [rooms[r].is_active for r in rooms] == [reference_rooms[r].is_active for r in reference_rooms]
@@ -0,0 +1,53 @@
+"""数据库连接 (database.get_connection): 每个线程一个长连接，线程结束时关闭"""
+import gc
+import sqlite3
+import threading
+
+import pytest
+
+
+def test_connections_closed_when_threads_exit(tmp_db, monkeypatch):
+    opened = []
+    open_connection = tmp_db._open_connection
+
+    def tracking_open():
+        conn = open_connection()
+        opened.append(conn)
+        return conn
+
+    monkeypatch.setattr(tmp_db, '_open_connection', tracking_open)
+    # 线程模式的 Flask 每个请求一个线程
+    for _ in range(200):
+        worker = threading.Thread(target=lambda: tmp_db.get_connection().execute('SELECT 1'))
+        worker.start()
+        worker.join()
+    gc.collect()
+
+    assert len(opened) == 200
+    for conn in opened:
+        with pytest.raises(sqlite3.ProgrammingError):
+            conn.execute('SELECT 1')   # 连接已关闭
+    assert len(tmp_db._holders) <= 1
+
+
+def test_close_all_closes_live_thread_connections(tmp_db):
+    ready = threading.Event()
+    done = threading.Event()
+    conns = []
+
+    def worker():
+        conns.append(tmp_db.get_connection())
+        ready.set()
+        done.wait()
+        conns.append(tmp_db.get_connection())
+
+    thread = threading.Thread(target=worker)
+    thread.start()
+    ready.wait()
+    tmp_db.configure()   # 关闭所有连接，下次使用时重建
+    done.set()
+    thread.join()
+
+    with pytest.raises(sqlite3.ProgrammingError):
+        conns[0].execute('SELECT 1')
+    assert conns[1] is not conns[0]
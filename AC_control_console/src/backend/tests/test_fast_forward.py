@@ -0,0 +1,182 @@
+"""事件驱动快进 (hotel.fast_forward / VectorEngine.fast_forward) 与逐秒推进的结果逐位一致"""
+import contextlib
+import io
+import random
+
+import pytest
+
+import hotel
+from clock import SimulatedClock
+
+SEEDS = range(6)
+
+
+@pytest.mark.parametrize('seed', SEEDS)
+def test_repeat_add_matches_loop(seed):
+    rnd = random.Random(seed)
+    for _ in range(200):
+        value = rnd.choice([0.0, 10.0, 25.0, 28.0, 0.5, 1e-3]) + rnd.random() * 40
+        step = rnd.choice([0.5, 1 / 3, 1 / 6, 0.01, 0.1, 1e-9]) * rnd.choice([1, -1])
+        count = rnd.randrange(5000)
+        expected = value
+        for _ in range(count):
+            expected += step
+        assert hotel.repeat_add(value, step, count).hex() == expected.hex()
+
+
+def build_hotel(seed, engine):
+    rnd = random.Random(seed)
+    vector = None
+    if engine == 'vector':
+        vector_engine = pytest.importorskip('vector_engine')
+        vector = vector_engine.VectorEngine()
+    rooms = {}
+    for i in range(40):
+        floor = i // 10 + 1
+        room_id = f"{floor}{i % 10 + 1:02d}"
+        temp = rnd.choice([10.0, 15.0, 28.0, 32.0, 35.0, 25.3, 26.1, 23.9, 24.6])
+        rooms[room_id] = vector.add_room(room_id, floor, temp) if vector else hotel.Room(room_id, floor, temp)
+    return rooms, hotel.Scheduler(rooms, SimulatedClock(start=1_000_000)), vector
+
+
+def control(rnd, rooms, scheduler):
+    """随机的开关机 / 调温 / 调风速，与 room_service.control_room 对调度器的调用相同"""
+    room_id = rnd.choice(list(rooms))
+    room = rooms[room_id]
+    action = rnd.random()
+    if action < 0.4:
+        room.power_on = not room.power_on
+        if room.power_on:
+            scheduler.request_service(room_id, room.fan_speed)
+        else:
+            scheduler.release_service(room_id)
+            room.is_active = False
+    elif action < 0.7:
+        room.target_temp = rnd.choice([18.0, 22.0, 24.0, 26.0, 30.0, 25.5, 24.5])
+        if room.power_on and not room.is_active and abs(room.current_temp - room.target_temp) > 1.0:
+            scheduler.request_service(room_id, room.fan_speed)
+    else:
+        room.fan_speed = rnd.choice(['High', 'Mid', 'Low'])
+        if room.power_on:
+            scheduler.request_service(room_id, room.fan_speed)
+
+
+def state(rooms, scheduler):
+    return (
+        [(room_id, room.power_on, room.is_active, room.fan_speed, room.current_temp.hex(),
+          room.total_fee.hex(), room.duration, room.dispatch_count, room.speed_stats)
+         for room_id, room in rooms.items()],
+        scheduler.export_state(),
+    )
+
+
+def run(seed, engine, fast):
+    """随机控制与长短不一的推进交替进行，返回每段推进之后的状态"""
+    rnd = random.Random(seed)
+    rooms, scheduler, vector = build_hotel(seed, engine)
+    trace = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(20):
+            for _ in range(rnd.randrange(1, 6)):
+                control(rnd, rooms, scheduler)
+            seconds = rnd.choice([1, 2, 30, 61, 240, 900])
+            if fast:
+                if vector:
+                    vector.fast_forward(scheduler, seconds)
+                else:
+                    hotel.fast_forward(rooms, scheduler, seconds)
+            else:
+                for _ in range(seconds):
+                    if vector:
+                        vector.step(scheduler)
+                    else:
+                        hotel.run_simulation_step(rooms, scheduler)
+            if vector:
+                assert_waiting_mask(vector, scheduler)
+            trace.append(state(rooms, scheduler))
+    return trace
+
+
+def assert_waiting_mask(vector, scheduler):
+    """向量引擎随调度器维护的等待掩码与等待队列一致"""
+    expected = sorted(vector.rooms[room_id]._idx for room_id in scheduler.waiting_ids())
+    assert vector._waiting_mask(scheduler).nonzero()[0].tolist() == expected
+
+
+@pytest.mark.parametrize('engine', ['object', 'vector'])
+@pytest.mark.parametrize('seed', SEEDS)
+def test_fast_forward_matches_stepping(seed, engine):
+    assert run(seed, engine, fast=True) == run(seed, engine, fast=False)
+
+
+@pytest.mark.parametrize('seed', SEEDS[:3])
+def test_vector_engine_matches_object_engine(seed):
+    pytest.importorskip('numpy')
+    assert run(seed, 'vector', fast=True) == run(seed, 'object', fast=False)
+
+
+def test_waiting_mask_follows_rollback():
+    rooms, scheduler, vector = build_hotel(0, 'vector')
+    with contextlib.redirect_stdout(io.StringIO()):
+        for room_id in ['101', '102', '103', '104']:
+            rooms[room_id].power_on = True
+            scheduler.request_service(room_id, 'Mid')
+        vector.step(scheduler)
+        saved = scheduler.save()
+        scheduler.release_service('104')
+        rooms['105'].power_on = True
+        scheduler.request_service('105', 'Mid')
+        scheduler.request_service('106', 'Mid')
+        assert_waiting_mask(vector, scheduler)
+        scheduler.rollback(saved)
+    assert_waiting_mask(vector, scheduler)
+    assert scheduler.is_waiting('104')
+
+
+def burst_trace(engine, seconds=120):
+    """所有房间在同一秒开机 (风速各不相同): 后面的高风速房间会抢占同一秒内已处理过的房间"""
+    rooms, scheduler, vector = build_hotel(1, engine)
+    speeds = ['Low', 'Mid', 'High']
+    for i, room in enumerate(rooms.values()):
+        room.power_on = True
+        room.fan_speed = speeds[i % 3]
+    trace = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(seconds):
+            if vector:
+                vector.step(scheduler)
+            else:
+                hotel.run_simulation_step(rooms, scheduler)
+            trace.append(state(rooms, scheduler))
+    return trace
+
+
+def test_burst_step_matches_object_engine():
+    pytest.importorskip('numpy')
+    assert burst_trace('vector') == burst_trace('object')
+
+
+def pulled_in_trace(engine):
+    """101 在这一秒到达目标温度并释放服务，等待中的 104 被调入服务; 104 已在目标温度，同一秒内应随即释放"""
+    rooms, scheduler, vector = build_hotel(2, engine)
+    with contextlib.redirect_stdout(io.StringIO()):
+        for room_id in ['101', '102', '103', '104']:
+            rooms[room_id].power_on = True
+            rooms[room_id].current_temp = 30.0
+            scheduler.request_service(room_id, 'Mid')
+        assert scheduler.is_waiting('104')
+        rooms['101'].target_temp = rooms['101'].current_temp
+        rooms['104'].target_temp = rooms['104'].current_temp
+        trace = []
+        for _ in range(3):
+            if vector:
+                vector.step(scheduler)
+            else:
+                hotel.run_simulation_step(rooms, scheduler)
+            trace.append(state(rooms, scheduler))
+    return trace
+
+
+def test_room_pulled_into_service_is_rechecked_in_same_step():
+    pytest.importorskip('numpy')
+    assert pulled_in_trace('vector') == pulled_in_trace('object')
@@ -0,0 +1,174 @@
+"""事件日志 (journal.py): 进程被杀后在检查点之上重放日志，以及检查点之后的截断"""
+import contextlib
+import io
+
+import hotel
+import journal
+import room_service
+from clock import SimulatedClock
+from hotel import Room, Scheduler
+from persister import StatePersister
+
+KEYS = [(f"1{i:02d}", 1) for i in range(1, 7)]
+
+
+def start_hotel(db):
+    """与 app.py 启动时相同: 载入检查点中的房间状态，再重放日志尾部"""
+    rooms = room_service.load_rooms({}, Room, KEYS)
+    for room in rooms.values():
+        room.is_free = False
+    scheduler = Scheduler(rooms, SimulatedClock(start=1_000_000))
+    log, restored, replayed = room_service.open_journal('main', rooms, scheduler, 0.001)
+    persister = StatePersister(db.update_room_states, 3600, log)
+    return rooms, scheduler, persister
+
+
+class Driver:
+    """按 app.py 的方式登记变化: 每次控制一个事件，每秒一个 tick 事件"""
+
+    def __init__(self, db, rooms, scheduler, persister):
+        self.db = db
+        self.rooms = rooms
+        self.scheduler = scheduler
+        self.persister = persister
+        self.version = 0
+
+    def control(self, room_id, data):
+        with contextlib.redirect_stdout(io.StringIO()):
+            result, status = room_service.control_room(self.rooms, self.scheduler, room_id, data, self.db)
+        assert status == 200, result
+        self.persister.mark_scheduler(self.scheduler)
+        self.persister.wait_durable(self.persister.mark_dirty(self.rooms[room_id], 'control'))
+
+    def run(self, seconds):
+        with contextlib.redirect_stdout(io.StringIO()):
+            for _ in range(seconds):
+                hotel.run_simulation_step(self.rooms, self.scheduler)
+                self.version = self.persister.mark_changed(self.rooms, self.version, self.scheduler.ticks)
+                self.persister.mark_scheduler(self.scheduler)
+
+
+def state(rooms, scheduler):
+    queues = scheduler.export_state()
+    return {
+        "rooms": {room_id: [room.power_on, room.fan_speed, room.target_temp, room.current_temp,
+                            room.total_fee, room.duration, room.is_active]
+                  for room_id, room in rooms.items()},
+        "service": queues['service'],
+        # 等待项比较剩余的时间片 (新进程的 ticks 从 0 开始)
+        "waiting": [[room_id, speed, expires_at - queues['ticks']] for room_id, speed, expires_at in queues['waiting']],
+    }
+
+
+def test_replay_after_kill_restores_state(tmp_db):
+    rooms, scheduler, persister = start_hotel(tmp_db)
+    driver = Driver(tmp_db, rooms, scheduler, persister)
+    for room_id in ['101', '102', '103', '104', '105']:
+        driver.control(room_id, {'power_on': True})
+    driver.run(60)
+    assert persister.flush() > 0   # 检查点
+    driver.control('102', {'fan_speed': 'High'})
+    driver.control('104', {'target_temp': 22.0})
+    driver.run(45)
+    driver.control('105', {'fan_speed': 'Low'})
+    driver.control('101', {'power_on': False})
+    driver.run(20)
+    expected = state(rooms, scheduler)
+    assert expected['waiting'], "scenario should leave rooms waiting"
+
+    # 进程被杀: 已提交的事件在文件中，没有最后一次检查点，最后一行只写了一半
+    log = persister.journal
+    log.commit()
+    log.close()
+    with open(log.path, 'ab') as f:
+        f.write(b'[999999,"control",["101",')
+
+    rooms, scheduler, persister = start_hotel(tmp_db)
+    assert state(rooms, scheduler) == expected
+    # 继续追加的事件从最后一个完整事件之后编号
+    assert persister.journal.lsn == log.lsn
+    persister.journal.close()
+
+
+def test_checkpoint_truncates_covered_events(tmp_db):
+    rooms, scheduler, persister = start_hotel(tmp_db)
+    driver = Driver(tmp_db, rooms, scheduler, persister)
+    log = persister.journal
+    for room_id in ['101', '102', '103', '104']:
+        driver.control(room_id, {'power_on': True})
+    driver.run(30)
+    checkpoint_lsn = log.lsn
+    persister.flush()
+
+    assert tmp_db.load_checkpoint('main')[0] == checkpoint_lsn
+    assert journal.read_events(log.path) == []
+
+    driver.control('102', {'target_temp': 20.0})
+    driver.run(10)
+    log.commit()
+    assert [event[0] for event in journal.read_events(log.path)] == list(range(checkpoint_lsn + 1, log.lsn + 1))
+    expected = state(rooms, scheduler)
+    log.close()
+
+    rooms, scheduler, persister = start_hotel(tmp_db)
+    assert state(rooms, scheduler) == expected
+    persister.journal.close()
+
+
+def test_truncate_only_after_durable_checkpoint(tmp_db, monkeypatch):
+    monkeypatch.setitem(tmp_db.DB_SETTINGS, 'synchronous', 'NORMAL')
+    tmp_db.configure()
+    rooms, scheduler, persister = start_hotel(tmp_db)
+    driver = Driver(tmp_db, rooms, scheduler, persister)
+    log = persister.journal
+    for room_id in ['101', '102']:
+        driver.control(room_id, {'power_on': True})
+    driver.run(5)
+
+    # 记录检查点提交的 SQL 与截断的先后顺序 (flush 与测试在同一线程，使用同一连接)
+    calls = []
+    tmp_db.get_connection().set_trace_callback(lambda sql: calls.append(sql.strip().upper()))
+    truncate = log.truncate
+    monkeypatch.setattr(log, 'truncate', lambda lsn: (calls.append('TRUNCATE'), truncate(lsn)))
+    persister.flush()
+    tmp_db.get_connection().set_trace_callback(None)
+
+    assert calls[-1] == 'TRUNCATE'
+    commit = calls.index('COMMIT')
+    assert 'PRAGMA SYNCHRONOUS = FULL' in calls[:commit]
+    # 提交之后才恢复同步级别，截断在这之后
+    assert calls[commit + 1:-1] == ['PRAGMA SYNCHRONOUS = 1']
+    assert tmp_db.get_connection().execute('PRAGMA synchronous').fetchone()[0] == 1
+    log.close()
+
+
+def test_truncate_keeps_tail_and_pending_events(tmp_path):
+    path = str(tmp_path / 'hotel.main.journal')
+    log = journal.Journal(path)
+    for i in range(10):
+        log.append('control', ['101', i])
+    log.commit()
+    with open(path, 'rb') as f:
+        lines = f.readlines()
+    log.append('control', ['101', 10])   # 截断时尚未提交
+
+    log.truncate(6)
+    with open(path, 'rb') as f:
+        assert f.read() == b''.join(lines[6:])
+    log.commit()
+    assert [event[0] for event in journal.read_events(path)] == [7, 8, 9, 10, 11]
+    log.close()
+
+    # 重新打开: 序号接在文件中最后一个事件之后
+    log = journal.Journal(path, lsn=6)
+    assert log.lsn == 11
+    assert log.append('control', ['101', 11]) == 12
+    log.commit()
+    log.truncate(12)
+    log.close()
+
+    # 日志已被检查点完全覆盖 (文件为空): 序号接在检查点之后
+    log = journal.Journal(path, lsn=12)
+    assert journal.read_events(path) == []
+    assert log.append('control', ['101', 12]) == 13
+    log.close()
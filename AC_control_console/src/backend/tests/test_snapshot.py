@@ -0,0 +1,55 @@
+"""只读快照 (snapshot.build_snapshot): 第一份快照批量创建的副本与逐个创建的副本相同"""
+import contextlib
+import io
+
+import hotel
+from clock import SimulatedClock
+from hotel import Room, Scheduler
+from snapshot import RoomView, build_snapshot
+
+
+def served_hotel():
+    """部分房间服务过 (有分项统计)、部分在等待、部分点过餐"""
+    rooms = {f"1{i:02d}": Room(f"1{i:02d}", 1, 32.0 if i % 2 else 10.0) for i in range(1, 13)}
+    scheduler = Scheduler(rooms, SimulatedClock(start=1_000_000))
+    with contextlib.redirect_stdout(io.StringIO()):
+        for i, (room_id, room) in enumerate(rooms.items()):
+            if i % 4 != 3:
+                room.power_on = True
+                room.fan_speed = ['Low', 'Mid', 'High'][i % 3]
+                scheduler.request_service(room_id, room.fan_speed)
+            if i % 3 == 0:
+                room.food_orders = [{"name": "noodles", "price": 18.0, "count": 1}]
+        for _ in range(20):
+            hotel.run_simulation_step(rooms, scheduler)
+    return rooms, scheduler
+
+
+def test_first_snapshot_matches_room_views():
+    rooms, scheduler = served_hotel()
+    assert scheduler.waiting_ids()
+    snapshot = build_snapshot(rooms, scheduler)
+
+    for room_id, room in rooms.items():
+        view = snapshot.rooms[room_id]
+        assert isinstance(view, RoomView)
+        assert view == RoomView(room, scheduler.is_waiting(room_id))
+        assert view.state() == dict(room.to_dict(), is_waiting=scheduler.is_waiting(room_id), version=room.version)
+        # 容器是副本，模拟循环原地修改房间不影响快照
+        assert view.food_orders is not room.food_orders
+        assert room.speed_counters is None or view.speed_counters is not room.speed_counters
+
+
+def test_views_keep_published_state():
+    rooms, scheduler = served_hotel()
+    first = build_snapshot(rooms, scheduler)
+    expected = {room_id: view.state() for room_id, view in first.rooms.items()}
+    with contextlib.redirect_stdout(io.StringIO()):
+        hotel.run_simulation_step(rooms, scheduler)
+    second = build_snapshot(rooms, scheduler, first)
+
+    assert {room_id: view.to_dict() for room_id, view in first.rooms.items()} == \
+        {room_id: {k: v for k, v in state.items() if k not in ('is_waiting', 'version')}
+         for room_id, state in expected.items()}
+    changed = [room_id for room_id in rooms if second.rooms[room_id] is not first.rooms[room_id]]
+    assert changed and all(second.rooms[room_id].version == rooms[room_id].version for room_id in changed)
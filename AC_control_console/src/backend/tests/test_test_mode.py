@@ -0,0 +1,43 @@
+"""测试模式 (/api/test/start、/api/test/tick): 推进的模拟时间计入导出的详单时长"""
+import json
+import os
+import subprocess
+import sys
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 导入 app 会启动命令循环与写线程 (退出时写回数据库)，放在子进程中运行，只使用临时数据库
+SCRIPT = '''
+import contextlib, io, json, sys
+import database
+database.configure(path=sys.argv[1])
+with contextlib.redirect_stdout(io.StringIO()):
+    import app
+    client = app.app.test_client()
+    client.post('/api/test/start')
+    client.post('/api/check_in', json={'room_id': '101', 'id_card': 'a', 'name': 'A'})
+    client.post('/api/room/101/control', json={'power_on': True})
+    client.post('/api/test/tick', json={'seconds': 120})
+    client.post('/api/room/101/control', json={'fan_speed': 'High'})
+    client.post('/api/test/tick', json={'seconds': 45, 'fast_forward': True})
+    client.post('/api/room/101/control', json={'power_on': False})
+    bill = client.get('/api/room/101/export/detailed_bill?format=ndjson').get_data(as_text=True)
+    client.post('/api/test/stop')
+    restored = type(app.scheduler.clock).__name__
+print(json.dumps({"bill": bill, "clock": restored}))
+'''
+
+
+def test_bill_after_test_tick_has_simulated_durations(tmp_path):
+    db_path = str(tmp_path / 'test.db')
+    result = subprocess.run([sys.executable, '-c', SCRIPT, db_path], cwd=BACKEND,
+                            capture_output=True, text=True, timeout=120)
+    assert result.returncode == 0, result.stderr
+    output = json.loads(result.stdout.strip().splitlines()[-1])
+
+    lines = [json.loads(line) for line in output['bill'].splitlines()]
+    sessions = [line for line in lines if line['type'] == 'session']
+    assert [session['duration'] for session in sessions] == [120, 45]
+    assert all(session['fee'] > 0 for session in sessions)
+    # 退出测试模式后恢复真实时钟
+    assert output['clock'] == 'RealClock'
@@ -0,0 +1,135 @@
+"""
+酒店房间拓扑: 楼栋、楼层、房间以及房型 (名称、房价、押金)。
+
+拓扑从数据文件 (默认 AC_control_console/topology.json，可用环境变量 HOTEL_TOPOLOGY_FILE
+指定，分片进程同样读取该变量) 读取，建立按房间号与楼栋/楼层索引的只读注册表。
+房间初始化、房型房价 (Room)、报表中的房费 (database) 以及房间列表接口都从这里取值。
+
+文件格式:
+    {
+      "room_types": {"standard": {"name": "标准间", "price": 220.0, "deposit": 100.0}, ...},
+      "default_type": "standard",          # 不在拓扑中的房间 (如基准测试生成的房间) 使用的房型
+      "buildings": [{
+        "id": "main", "name": "主楼",
+        "room_id": "{floor}{number:02d}",  # 房间号格式
+        "floors": [
+          {"level": 1, "rooms": [{"numbers": [1, 8], "type": "standard"}, {"numbers": [9, 10], "type": "deluxe"}]},
+          {"levels": [2, 4], "rooms": [{"numbers": [1, 10], "type": "standard"}]}
+        ]
+      }]
+    }
+"numbers" / "levels" 为闭区间 [起, 止]。
+"""
+import json
+import os
+from collections import namedtuple
+
+DEFAULT_TOPOLOGY_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'topology.json')
+DEFAULT_ROOM_ID_FORMAT = "{floor}{number:02d}"
+
+RoomType = namedtuple('RoomType', 'key name price deposit')
+RoomSpec = namedtuple('RoomSpec', 'room_id building floor number room_type')
+Building = namedtuple('Building', 'id name')
+
+
+class TopologyError(ValueError):
+    pass
+
+
+class Topology:
+    """只读的房间注册表，房间按拓扑文件中的顺序排列"""
+
+    def __init__(self, room_types, default_type, buildings, rooms):
+        self.room_types = room_types        # 房型 key -> RoomType
+        self.default_type = default_type    # RoomType
+        self.buildings = buildings          # [Building, ...]
+        self.rooms = rooms                  # room_id -> RoomSpec
+        self._floors = {}                   # (楼栋, 楼层) -> [room_id, ...]
+        for spec in rooms.values():
+            self._floors.setdefault((spec.building, spec.floor), []).append(spec.room_id)
+
+    def __len__(self):
+        return len(self.rooms)
+
+    def keys(self):
+        """[(room_id, floor), ...]，供 room_service.load_rooms 与分片划分使用"""
+        return [(spec.room_id, spec.floor) for spec in self.rooms.values()]
+
+    def room_type(self, room_id):
+        spec = self.rooms.get(room_id)
+        return spec.room_type if spec is not None else self.default_type
+
+    def floors(self, building=None, floor=None):
+        """[(楼栋 id, 楼层, [room_id, ...]), ...]，可按楼栋/楼层过滤"""
+        return [(b, f, room_ids) for (b, f), room_ids in self._floors.items()
+                if (building is None or b == building) and (floor is None or f == floor)]
+
+
+def _span(entry, single, pair, where):
+    if pair in entry:
+        start, stop = entry[pair]
+    elif single in entry:
+        start = stop = entry[single]
+    else:
+        raise TopologyError(f"{where}: '{single}' or '{pair}' is required")
+    if not (isinstance(start, int) and isinstance(stop, int)) or start > stop:
+        raise TopologyError(f"{where}: invalid range {start!r}..{stop!r}")
+    return range(start, stop + 1)
+
+
+def parse_topology(data):
+    """由拓扑文件内容 (dict) 生成 Topology，内容有误时抛出 TopologyError"""
+    try:
+        room_types = {key: RoomType(key, spec['name'], float(spec['price']), float(spec.get('deposit', 0.0)))
+                      for key, spec in data['room_types'].items()}
+    except (KeyError, TypeError, ValueError) as e:
+        raise TopologyError(f"Invalid room_types: {e}") from e
+    default_key = data.get('default_type', next(iter(room_types), None))
+    if default_key not in room_types:
+        raise TopologyError(f"Unknown default_type: {default_key}")
+
+    buildings = []
+    rooms = {}
+    for building in data.get('buildings', []):
+        if 'id' not in building:
+            raise TopologyError("Building without id")
+        building_id = building['id']
+        buildings.append(Building(building_id, building.get('name', building_id)))
+        id_format = building.get('room_id', DEFAULT_ROOM_ID_FORMAT)
+        for floor_entry in building.get('floors', []):
+            where = f"building {building_id}"
+            for level in _span(floor_entry, 'level', 'levels', where):
+                for group in floor_entry.get('rooms', []):
+                    type_key = group.get('type', default_key)
+                    if type_key not in room_types:
+                        raise TopologyError(f"{where} floor {level}: unknown room type {type_key}")
+                    for number in _span(group, 'number', 'numbers', f"{where} floor {level}"):
+                        room_id = id_format.format(building=building_id, floor=level, number=number)
+                        if room_id in rooms:
+                            raise TopologyError(f"Duplicate room id: {room_id}")
+                        rooms[room_id] = RoomSpec(room_id, building_id, level, number, room_types[type_key])
+    return Topology(room_types, room_types[default_key], buildings, rooms)
+
+
+def load_topology(path):
+    with open(path, encoding='utf-8') as f:
+        return parse_topology(json.load(f))
+
+
+_path = os.environ.get('HOTEL_TOPOLOGY_FILE') or DEFAULT_TOPOLOGY_FILE
+_current = None
+
+
+def configure(path=None):
+    """改用另一个拓扑文件 (None: 恢复默认)，下次调用 current() 时重新读取"""
+    global _path, _current
+    _path = path or os.environ.get('HOTEL_TOPOLOGY_FILE') or DEFAULT_TOPOLOGY_FILE
+    _current = None
+
+
+def current():
+    """当前拓扑 (第一次调用时读取文件)"""
+    global _current
+    if _current is None:
+        _current = load_topology(_path)
+    return _current
@@ -0,0 +1,493 @@
+from array import array
+import heapq
+
+import numpy as np
+
+from hotel import Config, Room, SPEEDS
+
+# 风速编码与 hotel.FanSpeed 相同: 已知风速固定编码，未知风速 (如前端传入的非法值) 动态追加且费率/温度变化率为 0
+
+
+def repeat_add(values, steps, counts):
+    """Vectorized hotel.repeat_add: bit-exact `values += steps` repeated `counts` times"""
+    values = np.array(values, dtype=np.float64)
+    steps = np.broadcast_to(np.asarray(steps, dtype=np.float64), values.shape)
+    counts = np.array(np.broadcast_to(counts, values.shape), dtype=np.int64)
+    while True:
+        todo = np.flatnonzero((counts > 0) & (steps != 0.0))
+        if not todo.size:
+            return values
+        x = values[todo]
+        st = steps[todo]
+        n = counts[todo]
+
+        mantissa, exp = np.frexp(x)
+        ulp = np.ldexp(1.0, exp - 53)
+        units = st / ulp
+        inc_units = np.rint(units)
+        single = (x <= 0.0) | (units - np.floor(units) == 0.5)
+        inc = inc_units * ulp
+        lo = np.ldexp(1.0, exp - 1)
+        hi = np.ldexp(1.0, exp)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            safe = np.where(st > 0, (hi - x - st) // inc, (x + st - lo) // -inc)
+        safe = np.where(single | ~np.isfinite(safe), 0, np.maximum(safe, 0))
+        jump = np.minimum(n, safe).astype(np.int64)
+        x = x + (jump * inc_units) * ulp
+        n = n - jump
+        # 跳过后若仍有剩余，跨越分界 (或舍入平局) 的那一次逐次累加
+        rest = n > 0
+        x = np.where(rest, x + st, x)
+        n = n - rest
+        # 增量小于半个 ulp 时数值不再变化
+        n = np.where(~single & (inc_units == 0), 0, n)
+        values[todo] = x
+        counts[todo] = n
+
+
+class _ArrayField:
+    """Descriptor mapping a Room attribute onto one slot of an engine array"""
+
+    def __init__(self, name, cast):
+        self.name = name
+        self.cast = cast
+
+    def __get__(self, room, owner=None):
+        if room is None:
+            return self
+        return self.cast(getattr(room._engine, self.name)[room._idx])
+
+    def __set__(self, room, value):
+        getattr(room._engine, self.name)[room._idx] = value
+
+
+class _ActiveField(_ArrayField):
+    """is_active: step() 期间调度器改变房间的服务状态时通知引擎 (见 VectorEngine._active_changing)"""
+
+    def __set__(self, room, value):
+        engine = room._engine
+        if engine._pos is not None:
+            engine._active_changing(room._idx)
+        engine.is_active[room._idx] = value
+
+
+class ArrayRoom(Room):
+    """
+    Room whose simulated state lives in the engine's NumPy arrays.
+    It exposes exactly the Room interface, so Scheduler and the Flask routes
+    work on it unchanged.
+    """
+    __slots__ = ('_engine', '_idx')
+
+    power_on = _ArrayField('power_on', bool)
+    is_active = _ActiveField('is_active', bool)
+    initial_temp = _ArrayField('initial_temp', float)
+    current_temp = _ArrayField('current_temp', float)
+    target_temp = _ArrayField('target_temp', float)
+    total_fee = _ArrayField('total_fee', float)
+    duration = _ArrayField('duration', int)
+    version = _ArrayField('version', int)
+    # Room.__init__ 直接写入风速编码
+    _speed = _ArrayField('speed', int)
+
+    def __init__(self, engine, idx, room_id, floor, initial_temp=28.0):
+        self._engine = engine
+        self._idx = idx
+        super().__init__(room_id, floor, initial_temp)
+
+    @property
+    def fan_speed(self):
+        return self._engine.speed_names[self._engine.speed[self._idx]]
+
+    @fan_speed.setter
+    def fan_speed(self, value):
+        self._engine.speed[self._idx] = self._engine.speed_code(value)
+
+    @property
+    def speed_counters(self):
+        e = self._engine
+        counters = array('d', e.speed_duration[self._idx].tolist() + e.speed_fee[self._idx].tolist())
+        return counters if any(counters) else None
+
+    @speed_counters.setter
+    def speed_counters(self, counters):
+        e = self._engine
+        n = len(SPEEDS)
+        e.speed_duration[self._idx] = counters[:n] if counters else 0
+        e.speed_fee[self._idx] = counters[n:] if counters else 0.0
+
+    def touch(self):
+        self._engine.version[self._idx] = Room.versions.next()
+
+    def update_temp_and_fee(self):
+        self._engine.advance(self._idx, self._idx + 1)
+
+    def advance(self, seconds):
+        self._engine.advance_many(seconds, self._idx, self._idx + 1)
+
+
+class VectorEngine:
+    """
+    Struct-of-arrays simulation engine.
+
+    Temperature, fee and return-to-ambient rules are applied to whole ranges of
+    rooms at once. Scheduler interactions (auto reactivate, target reached,
+    power-off cleanup) are order dependent, so they are handled one room at a
+    time exactly as run_simulation_step does; all other rooms are advanced as
+    one array operation at the end of the step, with the serving state each
+    had when the per-object loop would have reached it. The results therefore
+    match the per-object engine bit for bit.
+    """
+
+    def __init__(self, capacity=64):
+        self.size = 0
+        self.rooms = {}      # room_id -> ArrayRoom (可直接作为 Scheduler 的 rooms)
+        self.room_list = []  # index -> ArrayRoom
+        self.speed_names = list(SPEEDS)
+        self._speed_codes = {name: code for code, name in enumerate(SPEEDS)}
+        self._build_rate_tables()
+        self._allocate(capacity)
+        # 维护 waiting 掩码的调度器 (第一次使用时挂接，见 _waiting_mask)
+        self._scheduler = None
+        # step() 期间的逐房间处理状态 (见 step):
+        #   _pos: 下标小于 _pos 的房间已被逐房间循环经过; None 表示不在 step 中
+        #   _current: 正在处理的房间; _candidates: 可能需要调用调度器的房间 (小顶堆，可重复)
+        #   _frozen: 已经过的房间中服务状态可能与当前不同的 -> 经过时的 is_active (推进时使用)
+        #   _waiting_ahead: 等待中房间下标的大顶堆 (取负，延迟删除)，只在有待执行的补位时建立
+        self._pos = None
+        self._current = None
+        self._candidates = None
+        self._frozen = None
+        self._waiting_ahead = None
+
+    # --- Storage ---
+    def _allocate(self, capacity):
+        old = self.size
+        fields = {
+            'power_on': (np.bool_, ()),
+            'is_active': (np.bool_, ()),
+            'speed': (np.int64, ()),
+            'initial_temp': (np.float64, ()),
+            'current_temp': (np.float64, ()),
+            'target_temp': (np.float64, ()),
+            'total_fee': (np.float64, ()),
+            'duration': (np.int64, ()),
+            'version': (np.int64, ()),
+            # 是否在调度器的等待队列中 (由 Scheduler.waiting_listener 逐项更新)
+            'waiting': (np.bool_, ()),
+            'speed_duration': (np.int64, (len(SPEEDS),)),
+            'speed_fee': (np.float64, (len(SPEEDS),)),
+        }
+        for name, (dtype, shape) in fields.items():
+            arr = np.zeros((capacity,) + shape, dtype=dtype)
+            if old:
+                arr[:old] = getattr(self, name)[:old]
+            setattr(self, name, arr)
+        self.capacity = capacity
+
+    def _build_rate_tables(self):
+        self.fee_table = np.array([Config.FEE_RATES.get(s, 0) for s in self.speed_names], dtype=np.float64)
+        self.temp_table = np.array([Config.TEMP_RATES.get(s, 0) for s in self.speed_names], dtype=np.float64)
+
+    def speed_code(self, name):
+        code = self._speed_codes.get(name)
+        if code is None:
+            code = len(self.speed_names)
+            self.speed_names.append(name)
+            self._speed_codes[name] = code
+            self._build_rate_tables()
+        return code
+
+    def add_room(self, room_id, floor, initial_temp=28.0):
+        if self.size == self.capacity:
+            self._allocate(self.capacity * 2)
+        idx = self.size
+        self.size += 1
+        room = ArrayRoom(self, idx, room_id, floor, initial_temp)
+        self.rooms[room_id] = room
+        self.room_list.append(room)
+        return room
+
+    # --- Simulation ---
+    def advance(self, start, stop):
+        """Apply one second of temperature/fee/return-temp rules to rooms [start, stop)"""
+        if start >= stop:
+            return
+        serving = self.power_on[start:stop] & self.is_active[start:stop]
+        self._advance_rooms(np.flatnonzero(serving) + start, np.flatnonzero(~serving) + start)
+
+    def _advance_rooms(self, idx, ridx):
+        """One second for the serving rooms `idx` and the inactive rooms `ridx`"""
+        # Active: Cooling/Heating and Charging
+        if idx.size:
+            codes = self.speed[idx]
+            rate = self.fee_table[codes]
+            temp_change = self.temp_table[codes]
+            self.total_fee[idx] += rate
+            self.duration[idx] += 1
+            known = codes < len(SPEEDS)
+            self.speed_duration[idx[known], codes[known]] += 1
+            self.speed_fee[idx[known], codes[known]] += rate[known]
+            cur = self.current_temp[idx]
+            diff = cur - self.target_temp[idx]
+            self.current_temp[idx] = np.where(diff > 0, cur - temp_change, cur + temp_change)
+
+        # Inactive (Off, Waiting or Idle): Return temp
+        if ridx.size:
+            cur = self.current_temp[ridx]
+            diff_init = cur - self.initial_temp[ridx]
+            moving = np.abs(diff_init) > 0.01
+            ridx = ridx[moving]
+            cur = cur[moving]
+            self.current_temp[ridx] = np.where(diff_init[moving] > 0, cur - Config.RETURN_RATE, cur + Config.RETURN_RATE)
+        else:
+            ridx = idx[:0]
+
+        if idx.size or ridx.size:
+            version = Room.versions.next()
+            self.version[idx] = version
+            self.version[ridx] = version
+
+    def advance_many(self, seconds, start=0, stop=None):
+        """Closed-form equivalent of Room.advance for rooms [start, stop)"""
+        stop = self.size if stop is None else stop
+        if seconds <= 0 or start >= stop:
+            return
+        serving = self.power_on[start:stop] & self.is_active[start:stop]
+
+        idx = np.flatnonzero(serving) + start
+        if idx.size:
+            codes = self.speed[idx]
+            rate = self.fee_table[codes]
+            temp_change = self.temp_table[codes]
+            self.total_fee[idx] = repeat_add(self.total_fee[idx], rate, seconds)
+            self.duration[idx] += seconds
+            known = codes < len(SPEEDS)
+            self.speed_duration[idx[known], codes[known]] += seconds
+            self.speed_fee[idx[known], codes[known]] = repeat_add(
+                self.speed_fee[idx[known], codes[known]], rate[known], seconds)
+            cur = self.current_temp[idx]
+            diff = cur - self.target_temp[idx]
+            self.current_temp[idx] = repeat_add(cur, np.where(diff > 0, -temp_change, temp_change), seconds)
+
+        ridx = np.flatnonzero(~serving) + start
+        if ridx.size:
+            moves = np.minimum(self._return_moves_left(ridx), seconds)
+            moving = moves > 0
+            ridx = ridx[moving]
+            cur = self.current_temp[ridx]
+            step = np.where(cur > self.initial_temp[ridx], -Config.RETURN_RATE, Config.RETURN_RATE)
+            self.current_temp[ridx] = repeat_add(cur, step, moves[moving])
+
+        if idx.size or ridx.size:
+            version = Room.versions.next()
+            self.version[idx] = version
+            self.version[ridx] = version
+
+    def _return_moves_left(self, idx):
+        """Vectorized Room._return_moves_left for the rooms at `idx`"""
+        cur = self.current_temp[idx]
+        init = self.initial_temp[idx]
+        abs_diff = np.abs(cur - init)
+        step = np.where(cur > init, -Config.RETURN_RATE, Config.RETURN_RATE)
+        moves = np.where(abs_diff > 0.01, np.ceil((abs_diff - 0.01) / Config.RETURN_RATE), 0).astype(np.int64)
+        # 估算值可能因累加舍入差一步，按逐秒累加的真实结果校正
+        while True:
+            fix = (moves > 1) & (np.abs(repeat_add(cur, step, moves - 1) - init) <= 0.01)
+            if not fix.any():
+                break
+            moves -= fix
+        while True:
+            fix = (moves > 0) & (np.abs(repeat_add(cur, step, moves) - init) > 0.01)
+            if not fix.any():
+                break
+            moves += fix
+        return moves
+
+    def seconds_until_event(self, scheduler):
+        """Vectorized hotel.seconds_until_event"""
+        n = self.size
+        power = self.power_on[:n]
+        active = self.is_active[:n]
+        waiting = self._waiting_mask(scheduler)
+        cur = self.current_temp[:n]
+        target = self.target_temp[:n]
+        abs_diff = np.abs(cur - target)
+        horizon = np.full(n, np.inf)
+
+        # Powered off but still queued: cleaned up on the next step
+        horizon[~power & (active | waiting)] = 0
+
+        # Serving: target reached
+        serving = power & active
+        temp_change = self.temp_table[self.speed[:n]]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            reach = np.where(temp_change > 0, (abs_diff - 0.01) // temp_change + 1, np.inf)
+        reach = np.where(abs_diff < 0.01, 0, reach)
+        horizon[serving] = reach[serving]
+
+        # Idle: auto reactivate once the drift pushes |diff| past 1.0
+        idle = power & ~active & ~waiting
+        moves = self._return_moves_left(np.arange(n))
+        direction = np.where(cur > self.initial_temp[:n], -1.0, 1.0)
+        distance = (target + direction * 1.0 - cur) * direction
+        drift = distance // Config.RETURN_RATE + 1
+        drift = np.where((moves > 0) & (drift <= moves), drift, np.inf)
+        drift = np.where(abs_diff > 1.0, 0, drift)
+        horizon[idle] = drift[idle]
+
+        result = scheduler.seconds_until_expiry()
+        if n:
+            nearest = horizon.min()
+            if nearest != np.inf and (result is None or nearest < result):
+                result = int(nearest)
+        return result
+
+    def fast_forward(self, scheduler, seconds):
+        """Vectorized hotel.fast_forward"""
+        remaining = seconds
+        while remaining > 0:
+            self._build_rate_tables()
+            horizon = self.seconds_until_event(scheduler)
+            jump = remaining if horizon is None else min(remaining, max(0, horizon - 1))
+            if jump:
+                self.advance_many(jump)
+                scheduler.advance_time_slices(jump)
+                remaining -= jump
+            if remaining:
+                self.step(scheduler)
+                remaining -= 1
+
+    def _waiting_mask(self, scheduler):
+        """等待队列成员的掩码 (视图)，随调度器的每次入队/出队更新，不再每次按等待队列重建"""
+        if self._scheduler is not scheduler:
+            self._attach(scheduler)
+        return self.waiting[:self.size]
+
+    def _attach(self, scheduler):
+        if self._scheduler is not None:
+            self._scheduler.waiting_listener = None
+        self._scheduler = scheduler
+        scheduler.waiting_listener = self._set_waiting
+        self.waiting[:] = False
+        for room_id in scheduler.waiting_ids():
+            self._set_waiting(room_id, True)
+
+    def _set_waiting(self, room_id, waiting):
+        room = self.rooms.get(room_id)
+        if room is not None:
+            idx = room._idx
+            self.waiting[idx] = waiting
+            if self._pos is not None:
+                if idx >= self._pos:
+                    heapq.heappush(self._candidates, idx)
+                if waiting and self._waiting_ahead is not None:
+                    heapq.heappush(self._waiting_ahead, -idx)
+
+    def _active_changing(self, idx):
+        """step() 期间房间 idx 的 is_active 即将被改变"""
+        if idx == self._current:
+            return
+        if idx >= self._pos:
+            # 尚未经过: 经过时按新的状态重新判断
+            heapq.heappush(self._candidates, idx)
+        elif idx not in self._frozen:
+            # 已经过 (逐对象循环已按当时的状态推进过它): 记下经过时的状态，最后统一推进时使用
+            self._frozen[idx] = bool(self.is_active[idx])
+
+    def _scheduler_events(self):
+        """Rooms for which run_simulation_step would call the scheduler (judged on the current state)"""
+        n = self.size
+        power = self.power_on[:n]
+        active = self.is_active[:n]
+        waiting = self.waiting[:n]
+        diff = np.abs(self.current_temp[:n] - self.target_temp[:n])
+        reactivate = power & ~active & ~waiting & (diff > 1.0)
+        reached = active & (diff < 0.01)
+        powered_off = ~power & (active | waiting)
+        return reactivate | reached | powered_off
+
+    def _has_waiting_ahead(self):
+        """是否有下标不小于 _pos 的等待中房间"""
+        heap = self._waiting_ahead
+        if heap is None:
+            heap = self._waiting_ahead = (-np.flatnonzero(self.waiting[:self.size])[::-1]).tolist()
+        while heap and not self.waiting[-heap[0]]:
+            heapq.heappop(heap)
+        return bool(heap) and -heap[0] >= self._pos
+
+    def _step_room(self, room, scheduler):
+        """
+        Same sequence as one iteration of hotel.run_simulation_step (字段直接按下标读取数组)。
+        温度与费用不在这里推进: 记下此时的服务状态，由 step 结束时与其余房间一起推进。
+        返回是否调用了调度器。
+        """
+        room_id = room.room_id
+        idx = room._idx
+        called = False
+        power_on = self.power_on[idx]
+        if power_on and not self.is_active[idx]:
+            in_waiting = scheduler.is_waiting(room_id)
+            if not in_waiting:
+                diff = self.current_temp[idx] - self.target_temp[idx]
+                if abs(diff) > 1.0:
+                    scheduler.request_service(room_id, room.fan_speed)
+                    called = True
+
+        if self.is_active[idx]:
+            diff = self.current_temp[idx] - self.target_temp[idx]
+            if abs(diff) < 0.01:
+                scheduler.release_service(room_id)
+                room.is_active = False
+                called = True
+
+        self._frozen[idx] = bool(self.is_active[idx])
+
+        if not power_on:
+            if self.is_active[idx] or scheduler.is_waiting(room_id):
+                scheduler.release_service(room_id)
+                room.is_active = False
+                called = True
+        return called
+
+    def step(self, scheduler):
+        """Run one second of simulation (vectorized engine)"""
+        self._build_rate_tables()
+        with scheduler.coalesced():
+            scheduler.check_time_slices()
+            self._waiting_mask(scheduler)
+
+            # 需要调用调度器的房间只在开始时整体判断一次; 之后调度器改变了服务/等待状态的房间
+            # (_active_changing / _set_waiting) 重新加入候选，按下标顺序逐个处理，不再重新扫描后面的所有房间
+            self._candidates = np.flatnonzero(self._scheduler_events()).tolist()
+            self._frozen = {}
+            self._waiting_ahead = None
+            self._pos = 0
+            try:
+                settle = True
+                while True:
+                    if settle and scheduler.rebalance_pending and self._has_waiting_ahead():
+                        # 待执行的补位可能把后面的等待房间调入服务，先补位再判断
+                        scheduler.settle()
+                    settle = False
+                    if not self._candidates:
+                        break
+                    idx = heapq.heappop(self._candidates)
+                    if idx < self._pos:
+                        continue
+                    self._pos = idx + 1
+                    self._current = idx
+                    settle = self._step_room(self.room_list[idx], scheduler)
+                    self._current = None
+
+                # 所有房间一次推进，服务状态取逐对象循环经过它们时的值
+                n = self.size
+                serving = self.power_on[:n] & self.is_active[:n]
+                if self._frozen:
+                    frozen = np.fromiter(self._frozen, dtype=np.int64, count=len(self._frozen))
+                    serving[frozen] = self.power_on[frozen] & np.fromiter(
+                        self._frozen.values(), dtype=np.bool_, count=len(frozen))
+                self._advance_rooms(np.flatnonzero(serving), np.flatnonzero(~serving))
+            finally:
+                self._pos = self._current = None
+                self._candidates = self._frozen = self._waiting_ahead = None
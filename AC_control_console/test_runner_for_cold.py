@@ -1,3 +1,6 @@
+import json
+import os
+
 import requests
 import pandas as pd
 import time
@@ -6,34 +9,14 @@ import time
 API_BASE = "http://localhost:5000/api"
 OUTPUT_FILE = "test_report_for_cold.xlsx"
 
-# 测试用例定义
+# 测试用例定义 (与离线场景引擎 src/backend/scenario.py 共用 scenarios.json)
 # 格式: { 分钟数: [ (房间号, 动作类型, 值) ] }
 # 动作类型: 'power' (True/False), 'temp' (float), 'speed' ('High'/'Mid'/'Low')
-# 请根据您的图片内容填写以下字典
-TEST_CASES = {
-    0: [("101", "power", True)],
-    1: [("101", "temp", 18),("102","power", True),("105","power", True)],
-    2: [("103", "power", True)],
-    3: [("102", "temp", 19), ("104", "power", True)],
-    4: [("105", "temp", 22)],
-    5: [("101", "speed", "High")],
-    6: [("102", "power", False)],
-    7: [("102", "power", True), ("105", "speed", "High")],
-    9: [("101", "temp", 22), ("104", "temp", 18), ("104", "speed", "High")],
-    11: [("102", "temp", 22)],
-    12: [("105", "speed", "Low")],
-    14: [("101", "power", False), ("103", "temp", 24), ("103", "speed", "Low")],
-    15: [("105", "temp", 20), ("105", "speed", "High")],
-    16: [("102", "power", False)],
-    17: [("103", "speed", "High")],
-    18: [("101", "power", True), ("103", "temp", 20), ("103", "speed", "Mid")],
-    19: [("102", "power", True)],
-    20: [("104", "temp", 25)],
-    22: [("103", "power", False)],
-    23: [("105", "power", False)],
-    24: [("101", "power", False)],
-    25: [("102", "power", False), ("104", "power", False)]
-}
+SCENARIO_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "scenarios.json")
+with open(SCENARIO_FILE, encoding="utf-8") as f:
+    SCENARIO = json.load(f)["cold"]
+TEST_CASES = {int(minute): [tuple(action) for action in actions]
+              for minute, actions in SCENARIO["actions"].items()}
 
 def run_test():
     print("Starting Simulation Mode...")
@@ -43,7 +26,7 @@ def run_test():
     report_data = []
     
     # 模拟 25 分钟 (0-25)
-    for minute in range(26):
+    for minute in range(SCENARIO["minutes"]):
         print(f"--- Minute {minute} ---")
         
         # 1. 执行当前分钟的操作
@@ -64,7 +47,7 @@ def run_test():
         # 2. 获取当前状态快照
         # 获取所有房间状态
         # 这里我们假设只关心 101-105 (根据图片推测)
-        target_rooms = ["101", "102", "103", "104", "105"]
+        target_rooms = list(SCENARIO["rooms"])
         row = {"Time (min)": minute}
         
         # 获取调度队列信息 (需要后端支持，或者通过遍历所有房间状态推断)
@@ -1,3 +1,6 @@
+import json
+import os
+
 import requests
 import pandas as pd
 import time
@@ -6,34 +9,14 @@ import time
 API_BASE = "http://localhost:5000/api"
 OUTPUT_FILE = "test_report_for_hot.xlsx"
 
-# 测试用例定义
+# 测试用例定义 (与离线场景引擎 src/backend/scenario.py 共用 scenarios.json)
 # 格式: { 分钟数: [ (房间号, 动作类型, 值) ] }
 # 动作类型: 'power' (True/False), 'temp' (float), 'speed' ('High'/'Mid'/'Low')
-# 请根据您的图片内容填写以下字典
-TEST_CASES = {
-    0: [("106", "power", True)],
-    1: [("106", "temp", 24),("106","power", True)],
-    2: [("108", "power", True)],
-    3: [("108", "temp", 28), ("109", "power", True), ("110", "power", True)],
-    4: [("108", "temp", 28), ("110", "speed", "High")],
-    5: [("106", "speed", "High")],
-    7: [("110", "temp", 24)],
-    9: [("106", "temp", 22), ("109", "temp", 21), ("109", "speed", "High")],
-    11: [("110", "speed", "Mid")],
-
-    12: [("107", "power", False)],
-    14: [("106", "power", False), ("108", "speed", "Low")],
-    16: [("110", "power", False)],
-
-    17: [("108", "speed", "High")],
-    18: [("106", "power", True), ("109", "temp", 25), ("109", "speed", "Mid")],
-
-    20: [("107", "temp", 26), ("107", "speed", "Mid"), ("110", "power", True)],
-
-
-    24: [("106", "power", False), ("108", "power", False), ("110", "power", False)],
-    25: [("107", "power", False), ("109", "power", False)]
-}
+SCENARIO_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "scenarios.json")
+with open(SCENARIO_FILE, encoding="utf-8") as f:
+    SCENARIO = json.load(f)["hot"]
+TEST_CASES = {int(minute): [tuple(action) for action in actions]
+              for minute, actions in SCENARIO["actions"].items()}
 
 def run_test():
     print("Starting Simulation Mode...")
@@ -43,7 +26,7 @@ def run_test():
     report_data = []
     
     # 模拟 25 分钟 (0-25)
-    for minute in range(26):
+    for minute in range(SCENARIO["minutes"]):
         print(f"--- Minute {minute} ---")
         
         # 1. 执行当前分钟的操作
@@ -63,7 +46,7 @@ def run_test():
         
         # 2. 获取当前状态快照
         # 获取所有房间状态
-        target_rooms = ["106", "107", "108", "109", "110"]
+        target_rooms = list(SCENARIO["rooms"])
         row = {"Time (min)": minute}
         
         # 获取调度队列信息 (需要后端支持，或者通过遍历所有房间状态推断)